@@ -5,7 +5,7 @@ S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
 
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import AISummary, AIQuestion, AIConversation, AIMessage, AIRateLimit
+from .models import AISummary, AIQuestion, AIConversation, AIMessage, AIRateLimit, ExtractedText, AIJob, SharedSummary, QuestionBankItem, GeminiContextCache, AIUsage, AIUsageDaily
 
 
 @admin.register(AISummary)
@@ -13,25 +13,23 @@ class AISummaryAdmin(admin.ModelAdmin):
     """إدارة الملخصات الذكية"""
     list_display = [
         'file', 'user', 'summary_type_badge', 
-        'content_preview', 'created_at'
+        'content_preview', 'generated_at'
     ]
-    list_filter = ['summary_type', 'created_at']
-    search_fields = ['file__title', 'user__full_name', 'content']
-    ordering = ['-created_at']
-    readonly_fields = ['created_at']
+    list_filter = ['summary_type', 'generated_at']
+    search_fields = ['file__title', 'user__full_name', 'summary_text']
+    ordering = ['-generated_at']
+    readonly_fields = ['generated_at']
     
     def summary_type_badge(self, obj):
         colors = {
             'brief': '#2563eb',
             'detailed': '#10b981',
-            'bullet_points': '#f59e0b',
-            'key_concepts': '#8b5cf6',
+            'key_points': '#f59e0b',
         }
         labels = {
             'brief': 'موجز',
             'detailed': 'تفصيلي',
-            'bullet_points': 'نقاط',
-            'key_concepts': 'مفاهيم',
+            'key_points': 'نقاط',
         }
         color = colors.get(obj.summary_type, '#6b7280')
         label = labels.get(obj.summary_type, obj.summary_type)
@@ -43,9 +41,9 @@ class AISummaryAdmin(admin.ModelAdmin):
     summary_type_badge.short_description = 'نوع الملخص'
     
     def content_preview(self, obj):
-        if obj.content:
-            preview = obj.content[:100]
-            if len(obj.content) > 100:
+        if obj.summary_text:
+            preview = obj.summary_text[:100]
+            if len(obj.summary_text) > 100:
                 preview += '...'
             return preview
         return '-'
@@ -56,35 +54,13 @@ class AISummaryAdmin(admin.ModelAdmin):
 class AIQuestionAdmin(admin.ModelAdmin):
     """إدارة الأسئلة المولدة"""
     list_display = [
-        'file', 'user', 'question_type_badge', 'difficulty_badge',
-        'questions_count', 'created_at'
+        'file', 'user', 'difficulty_badge',
+        'questions_count_display', 'generated_at'
     ]
-    list_filter = ['question_type', 'difficulty', 'created_at']
+    list_filter = ['difficulty', 'generated_at']
     search_fields = ['file__title', 'user__full_name']
-    ordering = ['-created_at']
-    readonly_fields = ['created_at']
-    
-    def question_type_badge(self, obj):
-        colors = {
-            'mcq': '#2563eb',
-            'true_false': '#10b981',
-            'short_answer': '#f59e0b',
-            'essay': '#8b5cf6',
-        }
-        labels = {
-            'mcq': 'اختيارات',
-            'true_false': 'صح/خطأ',
-            'short_answer': 'إجابة قصيرة',
-            'essay': 'مقالي',
-        }
-        color = colors.get(obj.question_type, '#6b7280')
-        label = labels.get(obj.question_type, obj.question_type)
-        return format_html(
-            '<span style="background: {}; color: white; padding: 3px 10px; '
-            'border-radius: 12px;">{}</span>',
-            color, label
-        )
-    question_type_badge.short_description = 'نوع الأسئلة'
+    ordering = ['-generated_at']
+    readonly_fields = ['generated_at']
     
     def difficulty_badge(self, obj):
         colors = {
@@ -106,17 +82,9 @@ class AIQuestionAdmin(admin.ModelAdmin):
         )
     difficulty_badge.short_description = 'الصعوبة'
     
-    def questions_count(self, obj):
-        if obj.questions:
-            try:
-                import json
-                questions = json.loads(obj.questions) if isinstance(obj.questions, str) else obj.questions
-                count = len(questions) if isinstance(questions, list) else 0
-                return format_html('<span style="color: #2563eb; font-weight: bold;">{}</span>', count)
-            except:
-                return '-'
-        return '-'
-    questions_count.short_description = 'عدد الأسئلة'
+    def questions_count_display(self, obj):
+        return format_html('<span style="color: #2563eb; font-weight: bold;">{}</span>', obj.questions_count)
+    questions_count_display.short_description = 'عدد الأسئلة'
 
 
 @admin.register(AIConversation)
@@ -126,6 +94,7 @@ class AIConversationAdmin(admin.ModelAdmin):
     list_filter = ['is_active', 'created_at']
     search_fields = ['title', 'user__full_name', 'file__title']
     ordering = ['-updated_at']
+    readonly_fields = ['summary_until_id', 'created_at', 'updated_at']
     
     def messages_count(self, obj):
         count = obj.messages.count()
@@ -186,42 +155,178 @@ class AIMessageAdmin(admin.ModelAdmin):
 
 @admin.register(AIRateLimit)
 class AIRateLimitAdmin(admin.ModelAdmin):
-    """إدارة حدود الاستخدام"""
-    list_display = [
-        'user', 'date', 'summary_count', 'question_count', 
-        'chat_count', 'total_count', 'limit_status'
-    ]
-    list_filter = ['date']
+    """سجل طلبات AI المحتسبة في حدود الاستخدام"""
+    list_display = ['user', 'request_type_badge', 'request_time']
+    list_filter = ['request_type', 'request_time']
     search_fields = ['user__full_name', 'user__academic_id']
-    ordering = ['-date']
-    readonly_fields = ['user', 'date', 'summary_count', 'question_count', 'chat_count']
-    
-    def total_count(self, obj):
-        total = obj.summary_count + obj.question_count + obj.chat_count
-        return format_html('<span style="color: #2563eb; font-weight: bold;">{}</span>', total)
-    total_count.short_description = 'الإجمالي'
-    
-    def limit_status(self, obj):
-        total = obj.summary_count + obj.question_count + obj.chat_count
-        # افتراض حد 50 طلب يومياً
-        if total >= 50:
-            return format_html(
-                '<span style="background: #ef4444; color: white; padding: 3px 10px; '
-                'border-radius: 12px;">تم الوصول للحد</span>'
-            )
-        elif total >= 40:
-            return format_html(
-                '<span style="background: #f59e0b; color: white; padding: 3px 10px; '
-                'border-radius: 12px;">قريب من الحد</span>'
-            )
+    ordering = ['-request_time']
+    readonly_fields = ['user', 'request_type', 'request_time']
+    
+    def request_type_badge(self, obj):
+        colors = {
+            'summary': '#2563eb',
+            'questions': '#10b981',
+            'chat': '#8b5cf6',
+        }
+        color = colors.get(obj.request_type, '#6b7280')
         return format_html(
-            '<span style="background: #10b981; color: white; padding: 3px 10px; '
-            'border-radius: 12px;">متاح</span>'
+            '<span style="background: {}; color: white; padding: 3px 10px; '
+            'border-radius: 12px;">{}</span>',
+            color, obj.request_type
         )
-    limit_status.short_description = 'حالة الحد'
+    request_type_badge.short_description = 'نوع الطلب'
     
     def has_add_permission(self, request):
         return False
     
     def has_change_permission(self, request, obj=None):
         return False
+
+
+@admin.register(ExtractedText)
+class ExtractedTextAdmin(admin.ModelAdmin):
+    """إدارة النصوص المستخرجة المخزنة"""
+    list_display = ['short_hash', 'extractor_version', 'char_count', 'pages', 'extraction_time', 'created_at']
+    list_filter = ['extractor_version', 'created_at']
+    search_fields = ['content_hash']
+    ordering = ['-created_at']
+    readonly_fields = ['content_hash', 'extractor_version', 'char_count', 'extraction_time', 'created_at']
+    
+    def short_hash(self, obj):
+        return obj.content_hash[:12]
+    short_hash.short_description = 'البصمة'
+    
+    def pages(self, obj):
+        return obj.page_count or '-'
+    pages.short_description = 'الصفحات'
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(AIJob)
+class AIJobAdmin(admin.ModelAdmin):
+    """إدارة مهام AI في الخلفية"""
+    list_display = ['id', 'job_type', 'user', 'file', 'status_badge', 'created_at', 'finished_at']
+    list_filter = ['job_type', 'status', 'created_at']
+    search_fields = ['user__full_name', 'user__academic_id', 'file__title']
+    ordering = ['-created_at']
+    readonly_fields = ['created_at', 'started_at', 'finished_at']
+    
+    def status_badge(self, obj):
+        colors = {
+            'pending': '#6b7280',
+            'running': '#2563eb',
+            'done': '#10b981',
+            'failed': '#ef4444',
+        }
+        color = colors.get(obj.status, '#6b7280')
+        return format_html(
+            '<span style="background: {}; color: white; padding: 3px 10px; '
+            'border-radius: 12px;">{}</span>',
+            color, obj.get_status_display()
+        )
+    status_badge.short_description = 'الحالة'
+
+
+@admin.register(SharedSummary)
+class SharedSummaryAdmin(admin.ModelAdmin):
+    """إدارة الملخصات المشتركة بين الطلاب"""
+    list_display = ['short_hash', 'summary_type', 'language', 'prompt_version', 'word_count', 'hit_count', 'generated_at', 'last_hit_at']
+    list_filter = ['summary_type', 'language', 'prompt_version']
+    search_fields = ['content_hash']
+    ordering = ['-hit_count']
+    readonly_fields = ['content_hash', 'hit_count', 'generated_at', 'last_hit_at']
+    
+    def short_hash(self, obj):
+        return obj.content_hash[:12]
+    short_hash.short_description = 'البصمة'
+
+
+@admin.register(QuestionBankItem)
+class QuestionBankItemAdmin(admin.ModelAdmin):
+    """إدارة بنك الأسئلة"""
+    list_display = ['short_hash', 'difficulty', 'question_preview', 'draws_count', 'created_at']
+    list_filter = ['difficulty', 'created_at']
+    search_fields = ['content_hash']
+    ordering = ['-created_at']
+    readonly_fields = ['content_hash', 'question_hash', 'created_at']
+    
+    def short_hash(self, obj):
+        return obj.content_hash[:12]
+    short_hash.short_description = 'البصمة'
+    
+    def question_preview(self, obj):
+        text = str(obj.question_json.get('question', '')) if isinstance(obj.question_json, dict) else ''
+        return text[:80] + ('...' if len(text) > 80 else '')
+    question_preview.short_description = 'السؤال'
+    
+    def draws_count(self, obj):
+        return obj.draws.count()
+    draws_count.short_description = 'مرات السحب'
+
+
+@admin.register(GeminiContextCache)
+class GeminiContextCacheAdmin(admin.ModelAdmin):
+    """إدارة مراجع ذاكرة سياق Gemini"""
+    list_display = ['content_hash_short', 'model_name', 'token_count', 'hit_count', 'expires_at', 'created_at']
+    list_filter = ['model_name']
+    search_fields = ['content_hash', 'cache_name']
+    ordering = ['-created_at']
+    readonly_fields = ['content_hash', 'model_name', 'cache_name', 'token_count', 'hit_count', 'expires_at', 'created_at']
+    
+    def content_hash_short(self, obj):
+        return obj.content_hash[:12]
+    content_hash_short.short_description = 'بصمة المحتوى'
+
+
+@admin.register(AIUsage)
+class AIUsageAdmin(admin.ModelAdmin):
+    """سجل طلبات Gemini"""
+    list_display = [
+        'created_at', 'feature', 'model_name', 'user', 'file', 'outcome_badge',
+        'prompt_tokens', 'response_tokens', 'queue_time', 'latency', 'retry_count'
+    ]
+    list_filter = ['feature', 'model_name', 'outcome', 'created_at']
+    search_fields = ['user__full_name', 'user__academic_id', 'file__title', 'error']
+    ordering = ['-created_at']
+    list_select_related = ['user', 'file']
+    readonly_fields = [field.name for field in AIUsage._meta.fields]
+    
+    def outcome_badge(self, obj):
+        colors = {
+            'success': '#10b981',
+            'error': '#ef4444',
+            'busy': '#f59e0b',
+            'cancelled': '#6b7280',
+        }
+        color = colors.get(obj.outcome, '#6b7280')
+        return format_html(
+            '<span style="background: {}; color: white; padding: 3px 10px; '
+            'border-radius: 12px;">{}</span>',
+            color, obj.get_outcome_display()
+        )
+    outcome_badge.short_description = 'النتيجة'
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(AIUsageDaily)
+class AIUsageDailyAdmin(admin.ModelAdmin):
+    """التجميع اليومي لاستهلاك AI"""
+    list_display = [
+        'date', 'feature', 'model_name', 'calls', 'errors', 'retries',
+        'prompt_tokens', 'response_tokens', 'avg_latency_display', 'estimated_cost'
+    ]
+    list_filter = ['feature', 'model_name', 'date']
+    ordering = ['-date', 'feature']
+    date_hierarchy = 'date'
+    readonly_fields = [field.name for field in AIUsageDaily._meta.fields]
+    
+    def avg_latency_display(self, obj):
+        return f'{obj.avg_latency:.2f}s'
+    avg_latency_display.short_description = 'متوسط الزمن'
+    
+    def has_add_permission(self, request):
+        return False
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AiServiceConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "ai_service"
+
+    def ready(self):
+        from .checks import warn_if_local_cache  # تسجيل فحوص النظام
+        warn_if_local_cache()
@@ -0,0 +1,400 @@
+"""
+عروض خدمات AI غير المتزامنة (ASGI)
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+نسخ async من عروض التوليد والمحادثة والحالة في views.py، بنفس المسارات
+والقوالب والاستجابات. تُفعّل بـ AI_ASYNC_VIEWS = True عند التشغيل عبر خادم
+ASGI (مثل uvicorn sacm_project.asgi:application)، فتنتظر طلبات Gemini عبر
+العميل غير المتزامن (client.aio) دون حجز خيط لكل طلب.
+
+الاستعلامات المباشرة تستخدم ORM غير المتزامن (aget, acreate)، والدوال
+المتزامنة المشتركة (الملخصات المشتركة، الاسترجاع، حدود الاستخدام، القوالب)
+تُنفذ عبر sync_to_async.
+"""
+
+import time
+import logging
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.shortcuts import render, aget_object_or_404
+from django.template.loader import render_to_string
+from django.views.decorators.http import require_POST, require_GET
+
+from core.models import LectureFile
+from accounts.models import UserActivity
+from .models import AIQuestion, AIChat, AIRateLimit, AIJob, SharedSummary
+from .jobs import enqueue_job
+from .concurrency import ai_caller, get_queue_stats
+from .metering import usage_scope
+from .question_bank import draw_questions, schedule_bank_fill
+from .conversations import record_turn
+from .utils import (
+    agenerate_chat_response, agenerate_chat_response_stream, check_api_connection, SUMMARY_LANGUAGE_INSTRUCTIONS
+)
+from .views import (
+    SUMMARY_TYPES, _render_job, _invalid_summary_type, _prepare_chat_context, _sse_event, _sse_error_event,
+    _api_status_badge
+)
+
+# إعداد التسجيل
+logger = logging.getLogger(__name__)
+
+arender = sync_to_async(render)
+check_rate_limit = sync_to_async(AIRateLimit.check_rate_limit)
+record_request = sync_to_async(AIRateLimit.record_request)
+log_activity = sync_to_async(UserActivity.log)
+
+
+async def _get_student(request):
+    """
+    المستخدم الحالي إن كان طالباً، وإلا None
+
+    يُحمّل الدور مسبقاً ويُعيّن request.user للمستخدم المحمّل، فلا تُنفذ
+    القوالب والدوال اللاحقة استعلامات متزامنة داخل الحلقة.
+    """
+    user = await request.auser()
+    if not await sync_to_async(user.is_student)():
+        return None
+    request.user = user
+    return user
+
+
+def _forbidden():
+    return HttpResponse(
+        '<div class="alert alert-danger">غير مصرح لك بهذه العملية.</div>',
+        status=403
+    )
+
+
+def _rate_limited():
+    return HttpResponse(
+        '<div class="alert alert-warning">'
+        '<i class="bi bi-exclamation-triangle me-2"></i>'
+        'لقد تجاوزت الحد المسموح (10 طلبات/ساعة). يرجى المحاولة لاحقاً.'
+        '</div>',
+        status=429
+    )
+
+
+# ==================== مهام الخلفية ====================
+
+@login_required
+@require_GET
+async def ai_job_status_view(request, job_id):
+    """حالة مهمة AI - نسخة async من views.ai_job_status_view"""
+    user = await request.auser()
+    request.user = user
+    job = await aget_object_or_404(AIJob, id=job_id, user=user)
+    return await sync_to_async(_render_job)(request, job)
+
+
+# ==================== التلخيص ====================
+
+@login_required
+@require_POST
+async def ai_summary_generate_view(request, file_id):
+    """توليد الملخص عبر HTMX - نسخة async من views.ai_summary_generate_view"""
+    user = await _get_student(request)
+    if user is None:
+        return _forbidden()
+
+    lecture_file = await aget_object_or_404(LectureFile, id=file_id, is_deleted=False)
+
+    summary_type = request.POST.get('summary_type', 'brief')
+    if summary_type not in SUMMARY_TYPES:
+        return _invalid_summary_type()
+    language = request.POST.get('language', 'ar')
+    if language not in SUMMARY_LANGUAGE_INSTRUCTIONS:
+        language = 'ar'
+
+    # الملخص المشترك: إن ولّده طالب آخر يُعرض فوراً دون احتسابه من الحد
+    start_time = time.time()
+    shared = await sync_to_async(SharedSummary.for_file)(lecture_file, summary_type, language)
+    if shared:
+        await sync_to_async(shared.record_hit)()
+        summary = await sync_to_async(shared.create_user_summary)(user, lecture_file, time.time() - start_time)
+
+        await log_activity(
+            user=user,
+            action=UserActivity.AI_SUMMARY,
+            request=request,
+            details={
+                'file_id': file_id,
+                'file_name': lecture_file.title,
+                'summary_type': summary_type,
+                'summary_id': summary.id,
+                'shared_summary_id': shared.id,
+                'word_count': summary.word_count,
+                'processing_time': round(summary.processing_time, 3)
+            }
+        )
+
+        _, remaining = await check_rate_limit(user, 'summary')
+        return await arender(request, 'ai_service/partials/summary_result.html', {
+            'summary': summary,
+            'remaining': remaining,
+        })
+
+    can_use, remaining = await check_rate_limit(user, 'summary')
+    if not can_use:
+        return _rate_limited()
+
+    job = await sync_to_async(enqueue_job)(
+        AIJob.SUMMARY, user, lecture_file,
+        summary_type=summary_type, language=language
+    )
+
+    await record_request(user, 'summary')
+
+    return await sync_to_async(_render_job)(request, job)
+
+
+# ==================== الأسئلة ====================
+
+@login_required
+@require_POST
+async def ai_questions_generate_view(request, file_id):
+    """توليد الأسئلة عبر HTMX - نسخة async من views.ai_questions_generate_view"""
+    user = await _get_student(request)
+    if user is None:
+        return _forbidden()
+
+    lecture_file = await aget_object_or_404(LectureFile, id=file_id, is_deleted=False)
+
+    can_use, remaining = await check_rate_limit(user, 'questions')
+    if not can_use:
+        return _rate_limited()
+
+    difficulty = request.POST.get('difficulty', 'medium')
+    if difficulty not in dict(AIQuestion.DIFFICULTY_CHOICES):
+        difficulty = 'medium'
+    questions_count = int(request.POST.get('questions_count', 5))
+    questions_count = min(max(questions_count, 3), 15)  # بين 3 و 15
+
+    # السحب من بنك الأسئلة (قراءة من قاعدة البيانات بدون طلب لـ Gemini)
+    start_time = time.time()
+    drawn = await sync_to_async(draw_questions)(user, lecture_file, difficulty, questions_count)
+
+    await record_request(user, 'questions')
+    await sync_to_async(schedule_bank_fill)(user, lecture_file, difficulty)
+
+    if drawn:
+        ai_questions = await AIQuestion.objects.acreate(
+            file=lecture_file,
+            user=user,
+            difficulty=difficulty,
+            questions_json=drawn,
+            questions_count=len(drawn),
+            processing_time=time.time() - start_time
+        )
+
+        await log_activity(
+            user=user,
+            action=UserActivity.AI_QUESTIONS,
+            request=request,
+            details={
+                'file_id': file_id,
+                'file_name': lecture_file.title,
+                'difficulty': difficulty,
+                'questions_id': ai_questions.id,
+                'questions_count': len(drawn),
+                'from_bank': True,
+            }
+        )
+
+        return await arender(request, 'ai_service/partials/questions_result.html', {
+            'ai_questions': ai_questions,
+            'remaining': remaining - 1,
+        })
+
+    job = await sync_to_async(enqueue_job)(
+        AIJob.QUESTIONS, user, lecture_file,
+        difficulty=difficulty, questions_count=questions_count
+    )
+
+    return await sync_to_async(_render_job)(request, job)
+
+
+# ==================== المحادثة (Chatbot) ====================
+
+@login_required
+@require_POST
+async def ai_chat_send_view(request):
+    """إرسال رسالة للمساعد الذكي عبر HTMX - نسخة async من views.ai_chat_send_view"""
+    user = await _get_student(request)
+    if user is None:
+        return _forbidden()
+
+    can_use, remaining = await check_rate_limit(user, 'chat')
+    if not can_use:
+        return HttpResponse(
+            '<div class="chat-message bot-message">'
+            '<div class="message-content text-warning">'
+            '<i class="bi bi-exclamation-triangle me-2"></i>'
+            'لقد تجاوزت الحد المسموح (10 طلبات/ساعة). يرجى المحاولة لاحقاً.'
+            '</div>'
+            '</div>',
+            status=429
+        )
+
+    question = request.POST.get('question', '').strip()
+    file_id = request.POST.get('file_id')
+
+    if not question:
+        return HttpResponse(
+            '<div class="chat-message bot-message">'
+            '<div class="message-content text-muted">'
+            'يرجى إدخال سؤال.'
+            '</div>'
+            '</div>',
+            status=400
+        )
+
+    try:
+        with ai_caller(user), usage_scope('chat') as scope:
+            lecture_file, context_text, conversation, chat_history, cached_context = await sync_to_async(
+                _prepare_chat_context
+            )(user, file_id, question, request.POST.get('conversation_id'))
+            scope.file_id = getattr(lecture_file, 'pk', None)
+
+            # انتظار Gemini عبر العميل غير المتزامن
+            answer = await agenerate_chat_response(
+                question, context_text, chat_history, cached_context, conversation.summary
+            )
+
+        chat = await AIChat.objects.acreate(
+            user=user,
+            file=lecture_file,
+            question=question,
+            answer=answer
+        )
+
+        await sync_to_async(record_turn)(conversation, question, answer)
+        await record_request(user, 'chat')
+
+        await log_activity(
+            user=user,
+            action=UserActivity.AI_CHAT,
+            request=request,
+            details={
+                'chat_id': chat.id,
+                'file_id': file_id,
+                'question_length': len(question),
+                'answer_length': len(answer)
+            }
+        )
+
+        html = await sync_to_async(render_to_string)('ai_service/partials/chat_message.html', {
+            'chat': chat,
+            'remaining': remaining - 1,
+        }, request=request)
+
+        return HttpResponse(html)
+
+    except Exception as e:
+        logger.error(f"Chat error: {str(e)}")
+        return HttpResponse(
+            f'<div class="chat-message bot-message">'
+            f'<div class="message-content text-danger">'
+            f'<i class="bi bi-x-circle me-2"></i>'
+            f'حدث خطأ: {str(e)}'
+            f'</div>'
+            f'</div>',
+            status=500
+        )
+
+
+@login_required
+@require_POST
+async def ai_chat_stream_view(request):
+    """
+    بث إجابة المساعد الذكي (Server-Sent Events) - نسخة async من views.ai_chat_stream_view
+
+    نفس الأحداث: {"delta": "..."} ثم done أو error.
+    """
+    user = await _get_student(request)
+    if user is None:
+        return JsonResponse({'error': 'غير مصرح لك بهذه العملية.'}, status=403)
+
+    can_use, remaining = await check_rate_limit(user, 'chat')
+    if not can_use:
+        return JsonResponse(
+            {'error': 'لقد تجاوزت الحد المسموح (10 طلبات/ساعة). يرجى المحاولة لاحقاً.'},
+            status=429
+        )
+
+    question = request.POST.get('question', '').strip()
+    file_id = request.POST.get('file_id')
+    conversation_id = request.POST.get('conversation_id')
+
+    if not question:
+        return JsonResponse({'error': 'يرجى إدخال سؤال.'}, status=400)
+
+    async def event_stream():
+        answer_parts = []
+
+        try:
+            with ai_caller(user), usage_scope('chat') as scope:
+                lecture_file, context_text, conversation, chat_history, cached_context = await sync_to_async(
+                    _prepare_chat_context
+                )(user, file_id, question, conversation_id)
+                scope.file_id = getattr(lecture_file, 'pk', None)
+
+                async for chunk in agenerate_chat_response_stream(
+                    question, context_text, chat_history, cached_context, conversation.summary
+                ):
+                    answer_parts.append(chunk)
+                    yield _sse_event({'delta': chunk})
+
+            answer = ''.join(answer_parts) or 'عذراً، لم أتمكن من توليد إجابة. يرجى إعادة صياغة سؤالك.'
+
+            chat = await AIChat.objects.acreate(
+                user=user,
+                file=lecture_file,
+                question=question,
+                answer=answer
+            )
+
+            await sync_to_async(record_turn)(conversation, question, answer)
+            await record_request(user, 'chat')
+
+            # تسجيل النشاط بعد نجاح البث فقط
+            await log_activity(
+                user=user,
+                action=UserActivity.AI_CHAT,
+                request=request,
+                details={
+                    'file_id': file_id,
+                    'question_length': len(question),
+                    'streamed': True,
+                    'chat_id': chat.id,
+                    'answer_length': len(answer),
+                }
+            )
+
+            yield _sse_event(
+                {'chat_id': chat.id, 'conversation_id': conversation.pk, 'remaining': remaining - 1},
+                event='done'
+            )
+
+        except Exception as e:
+            logger.exception(f"Chat stream error: {str(e)}")
+            yield _sse_error_event(e)
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # منع التخزين المؤقت في Nginx
+    return response
+
+
+# ==================== حالة API ====================
+
+@login_required
+@require_GET
+async def api_status_view(request):
+    """حالة API عبر HTMX - نسخة async من views.api_status_view"""
+    status = await sync_to_async(check_api_connection)()
+    queue = await sync_to_async(get_queue_stats)()
+    return HttpResponse(_api_status_badge(request.path, status, queue))
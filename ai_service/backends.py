@@ -0,0 +1,498 @@
+"""
+واجهات نماذج اللغة (LLM Backends)
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+جميع طلبات التوليد تمر عبر generate_content / generate_content_stream في utils،
+وهي تستدعي الواجهة المختارة في AI_BACKEND:
+- gemini: Google Gemini API (الافتراضي)
+- fake: واجهة محلية بدون شبكة تُرجع ملخصات Markdown وأسئلة JSON جاهزة
+  مع زمن استجابة ونسبة أخطاء قابلة للضبط، لاختبارات الحمل والاختبارات الآلية
+  دون استهلاك الحصة.
+
+العروض غير المتزامنة تستدعي agenerate / agenerate_stream (عبر agenerate_content في utils).
+"""
+
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Iterator, AsyncIterator
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .metering import current_meter, report_usage_metadata
+
+# إعداد التسجيل
+logger = logging.getLogger(__name__)
+
+
+class LLMBackend:
+    """الواجهة الأساسية - كل واجهة تنفذ التوليد الكامل والمتدفق وفحص الاتصال"""
+
+    name = 'base'
+
+    def generate(self, prompt: str, model_name: str, cached_content: str = None,
+                 response_schema: dict = None) -> str:
+        """response_schema: مخطط JSON للرد (مخرجات منظمة)"""
+        raise NotImplementedError
+
+    def generate_stream(self, prompt: str, model_name: str, cached_content: str = None,
+                        response_schema: dict = None) -> Iterator[str]:
+        raise NotImplementedError
+
+    async def agenerate(self, prompt: str, model_name: str, cached_content: str = None,
+                        response_schema: dict = None) -> str:
+        """
+        نسخة generate غير المتزامنة
+
+        الافتراضي ينفذ generate في خيط منفصل؛ الواجهات التي لديها عميل
+        غير متزامن تُعيد تعريفها.
+        """
+        return await sync_to_async(self.generate, thread_sensitive=False)(
+            prompt, model_name, cached_content=cached_content, response_schema=response_schema
+        )
+
+    async def agenerate_stream(self, prompt: str, model_name: str, cached_content: str = None,
+                               response_schema: dict = None) -> AsyncIterator[str]:
+        """نسخة generate_stream غير المتزامنة (الافتراضي يقرأ البث المتزامن في خيط منفصل)"""
+        stream = self.generate_stream(
+            prompt, model_name, cached_content=cached_content, response_schema=response_schema
+        )
+        next_chunk = sync_to_async(next, thread_sensitive=False)
+        try:
+            while (chunk := await next_chunk(stream, None)) is not None:
+                yield chunk
+        finally:
+            stream.close()
+
+    def probe(self, model_name: str) -> None:
+        """فحص الاتصال دون توليد محتوى (يرفع استثناءً عند الفشل)"""
+        raise NotImplementedError
+
+    def create_cache(self, model_name: str, text: str, ttl_seconds: int):
+        """
+        تخزين نص في ذاكرة السياق لدى المزود (Context Caching)
+
+        Returns:
+            tuple: (اسم المرجع، وقت انتهاء الصلاحية datetime)
+        """
+        raise NotImplementedError
+
+
+# ==================== Gemini ====================
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini عبر google-genai (أو google-generativeai كبديل)"""
+
+    name = 'gemini'
+
+    @staticmethod
+    def _generation_config(response_schema=None):
+        from .utils import GENERATION_CONFIG
+
+        config = dict(GENERATION_CONFIG)
+        if response_schema is not None:
+            config.update(response_mime_type='application/json', response_schema=response_schema)
+        return config
+
+    def generate(self, prompt: str, model_name: str, cached_content: str = None,
+                 response_schema: dict = None) -> str:
+        from .utils import get_gemini_client
+
+        client = get_gemini_client()
+        config = self._generation_config(response_schema)
+
+        # التحقق من نوع العميل
+        if hasattr(client, 'models'):
+            # المكتبة الجديدة google-genai
+            from google.genai import types
+            response = client.models.generate_content(
+                model=model_name,
+                contents=prompt,
+                config=types.GenerateContentConfig(**config, cached_content=cached_content)
+            )
+        elif cached_content:
+            raise NotImplementedError('ذاكرة السياق تتطلب مكتبة google-genai')
+        else:
+            # المكتبة القديمة google-generativeai
+            model = client.GenerativeModel(
+                model_name=model_name,
+                generation_config=config
+            )
+            response = model.generate_content(prompt)
+
+        report_usage_metadata(getattr(response, 'usage_metadata', None))
+        return response.text
+
+    def generate_stream(self, prompt: str, model_name: str, cached_content: str = None,
+                        response_schema: dict = None) -> Iterator[str]:
+        from .utils import get_gemini_client
+
+        client = get_gemini_client()
+        config = self._generation_config(response_schema)
+        # مرجع القياس يُحفظ هنا: بقية البث قد تُستهلك في سياق آخر
+        meter = current_meter()
+
+        if hasattr(client, 'models'):
+            # المكتبة الجديدة google-genai
+            from google.genai import types
+            stream = client.models.generate_content_stream(
+                model=model_name,
+                contents=prompt,
+                config=types.GenerateContentConfig(**config, cached_content=cached_content)
+            )
+        elif cached_content:
+            raise NotImplementedError('ذاكرة السياق تتطلب مكتبة google-genai')
+        else:
+            # المكتبة القديمة google-generativeai
+            model = client.GenerativeModel(
+                model_name=model_name,
+                generation_config=config
+            )
+            stream = model.generate_content(prompt, stream=True)
+
+        usage = None
+        for chunk in stream:
+            # عدد التوكنات النهائي يصل مع آخر جزء
+            usage = getattr(chunk, 'usage_metadata', None) or usage
+            if chunk.text:
+                yield chunk.text
+
+        report_usage_metadata(usage, meter)
+
+    async def agenerate(self, prompt: str, model_name: str, cached_content: str = None,
+                        response_schema: dict = None) -> str:
+        from .utils import get_gemini_client
+
+        client = get_gemini_client()
+
+        if not hasattr(client, 'aio'):
+            # المكتبة القديمة google-generativeai: بدون عميل غير متزامن
+            return await super().agenerate(prompt, model_name, cached_content, response_schema)
+
+        from google.genai import types
+        config = self._generation_config(response_schema)
+        response = await client.aio.models.generate_content(
+            model=model_name,
+            contents=prompt,
+            config=types.GenerateContentConfig(**config, cached_content=cached_content)
+        )
+
+        report_usage_metadata(getattr(response, 'usage_metadata', None))
+        return response.text
+
+    async def agenerate_stream(self, prompt: str, model_name: str, cached_content: str = None,
+                               response_schema: dict = None) -> AsyncIterator[str]:
+        from .utils import get_gemini_client
+
+        client = get_gemini_client()
+        # مرجع القياس يُحفظ هنا: بقية البث قد تُستهلك في مهمة أخرى
+        meter = current_meter()
+
+        if not hasattr(client, 'aio'):
+            async for chunk in super().agenerate_stream(prompt, model_name, cached_content, response_schema):
+                yield chunk
+            return
+
+        from google.genai import types
+        config = self._generation_config(response_schema)
+        stream = await client.aio.models.generate_content_stream(
+            model=model_name,
+            contents=prompt,
+            config=types.GenerateContentConfig(**config, cached_content=cached_content)
+        )
+
+        usage = None
+        async for chunk in stream:
+            usage = getattr(chunk, 'usage_metadata', None) or usage
+            if chunk.text:
+                yield chunk.text
+
+        report_usage_metadata(usage, meter)
+
+    def probe(self, model_name: str) -> None:
+        from .utils import get_gemini_client
+
+        client = get_gemini_client()
+
+        if hasattr(client, 'models'):
+            # المكتبة الجديدة google-genai
+            client.models.get(model=model_name)
+        else:
+            # المكتبة القديمة google-generativeai
+            client.get_model(f'models/{model_name}')
+
+    def create_cache(self, model_name: str, text: str, ttl_seconds: int):
+        from .utils import get_gemini_client
+
+        client = get_gemini_client()
+
+        if not hasattr(client, 'caches'):
+            raise NotImplementedError('ذاكرة السياق تتطلب مكتبة google-genai')
+
+        from google.genai import types
+        cached = client.caches.create(
+            model=model_name,
+            config=types.CreateCachedContentConfig(
+                contents=[text],
+                ttl=f'{int(ttl_seconds)}s',
+                display_name='s-acm-lecture',
+            )
+        )
+        return cached.name, cached.expire_time
+
+
+# ==================== الواجهة المحلية (Fake) ====================
+
+class FakeAPIError(Exception):
+    """خطأ مُحاكى من الواجهة المحلية (بنفس رموز حالة Gemini)"""
+
+    def __init__(self, code, message):
+        super().__init__(f'{code} {message}')
+        self.code = code
+
+
+# الأخطاء المُحاكاة ونسبتها من إجمالي الأخطاء
+FAKE_ERRORS = [
+    (429, 'RESOURCE_EXHAUSTED: Quota exceeded (simulated)', 0.6),
+    (503, 'UNAVAILABLE: The model is overloaded (simulated)', 0.3),
+    (500, 'INTERNAL: Internal error (simulated)', 0.1),
+]
+
+FAKE_SUMMARY = """## ملخص المحاضرة
+
+### النقاط الرئيسية
+- **المفهوم الأول:** تعريف مختصر للمفهوم الأساسي في المحاضرة.
+- **المفهوم الثاني:** العلاقة بين المفاهيم وأمثلة تطبيقية.
+- **المفهوم الثالث:** الخطوات العملية والملاحظات المهمة.
+
+### الخلاصة
+تغطي المحاضرة الأساسيات النظرية مع أمثلة تطبيقية تساعد على الفهم.
+"""
+
+FAKE_CHAT_ANSWER = """بناءً على محتوى الملف:
+
+1. **الفكرة الأساسية** هي توضيح المفهوم المطروح في السؤال.
+2. يمكن تطبيقها من خلال الأمثلة الواردة في المحاضرة.
+
+> راجع القسم المتعلق بالسؤال في الملف لمزيد من التفاصيل.
+"""
+
+# علامات أنواع الطلبات (انظر generate_questions و build_chat_prompt و build_study_pack_prompt في utils)
+CHAT_PROMPT_MARKER = 'سؤال المستخدم الحالي:'
+STUDY_PACK_PROMPT_MARKER = 'أنشئ حزمة مذاكرة كاملة'
+STUDY_PACK_QUESTIONS_PATTERN = re.compile(r'- questions: (\d+) أسئلة')
+QUESTIONS_COUNT_PATTERN = re.compile(r'قم بإنشاء (\d+) أسئلة')
+QUESTIONS_DIFFICULTY_PATTERN = re.compile(r'"difficulty": "(\w+)"')
+
+
+class FakeBackend(LLMBackend):
+    """
+    واجهة محلية بدون شبكة لاختبارات الحمل والاختبارات الآلية
+
+    Args:
+        latency: توزيع زمن الاستجابة ('none', 'fixed', 'uniform', 'lognormal')
+        latency_mean: متوسط زمن الاستجابة بالثواني (الوسيط في lognormal)
+        latency_sigma: التشتت (نصف المدى في uniform، وsigma في lognormal)
+        error_rate: نسبة الطلبات التي تفشل بخطأ مُحاكى (0 - 1)
+        stream_chunks: عدد أجزاء الإجابة المتدفقة
+        seed: بذرة العشوائية لتكرار نفس السلوك في الاختبارات
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency='lognormal', latency_mean=1.0, latency_sigma=0.5,
+                 error_rate=0.0, stream_chunks=20, seed=None):
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.stream_chunks = max(int(stream_chunks), 1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.caches = {}
+
+    @classmethod
+    def from_settings(cls):
+        return cls(**getattr(settings, 'AI_FAKE_BACKEND', {}))
+
+    # ---------- المحاكاة ----------
+
+    def sample_latency(self) -> float:
+        """زمن استجابة عشوائي حسب التوزيع المحدد (بالثواني)"""
+        with self._lock:
+            if self.latency == 'fixed':
+                return self.latency_mean
+            if self.latency == 'uniform':
+                return max(self._random.uniform(
+                    self.latency_mean - self.latency_sigma,
+                    self.latency_mean + self.latency_sigma
+                ), 0.0)
+            if self.latency == 'lognormal' and self.latency_mean > 0:
+                return self._random.lognormvariate(0, self.latency_sigma) * self.latency_mean
+        return 0.0
+
+    def maybe_fail(self):
+        """رفع خطأ مُحاكى بنسبة error_rate"""
+        with self._lock:
+            self.calls += 1
+            if self._random.random() >= self.error_rate:
+                return
+            roll = self._random.random()
+
+        for code, message, share in FAKE_ERRORS:
+            if roll < share:
+                raise FakeAPIError(code, message)
+            roll -= share
+        raise FakeAPIError(*FAKE_ERRORS[-1][:2])
+
+    # ---------- المحتوى ----------
+
+    def build_response(self, prompt: str) -> str:
+        """محتوى جاهز حسب نوع الطلب: إجابة محادثة، أو أسئلة JSON، أو حزمة مذاكرة JSON، أو ملخص"""
+        if CHAT_PROMPT_MARKER in prompt:
+            return FAKE_CHAT_ANSWER
+
+        if STUDY_PACK_PROMPT_MARKER in prompt:
+            pack = {'brief': FAKE_SUMMARY, 'detailed': FAKE_SUMMARY, 'key_points': FAKE_SUMMARY}
+            count_match = STUDY_PACK_QUESTIONS_PATTERN.search(prompt)
+            if count_match:
+                difficulty_match = QUESTIONS_DIFFICULTY_PATTERN.search(prompt)
+                pack['questions'] = self.build_questions(
+                    int(count_match.group(1)),
+                    difficulty_match.group(1) if difficulty_match else 'medium'
+                )
+            return json.dumps(pack, ensure_ascii=False)
+
+        count_match = QUESTIONS_COUNT_PATTERN.search(prompt)
+        if count_match:
+            difficulty_match = QUESTIONS_DIFFICULTY_PATTERN.search(prompt)
+            return json.dumps(
+                self.build_questions(
+                    int(count_match.group(1)),
+                    difficulty_match.group(1) if difficulty_match else 'medium'
+                ),
+                ensure_ascii=False
+            )
+
+        return FAKE_SUMMARY
+
+    def build_questions(self, count, difficulty):
+        with self._lock:
+            batch = self._random.getrandbits(32)
+
+        questions = []
+        for i in range(1, count + 1):
+            options = [f'الخيار {letter} للسؤال {i}' for letter in ('أ', 'ب', 'ج', 'د')]
+            questions.append({
+                'question': f'سؤال تجريبي رقم {i} ({batch:08x}): ما المقصود بالمفهوم {i}؟',
+                'options': options,
+                'correct_answer': options[0],
+                'explanation': 'شرح تجريبي للإجابة الصحيحة.',
+                'difficulty': difficulty,
+            })
+        return questions
+
+    # ---------- الواجهة ----------
+
+    def check_cached_content(self, cached_content):
+        if cached_content and cached_content not in self.caches:
+            raise FakeAPIError(404, f'NOT_FOUND: CachedContent {cached_content} not found (simulated)')
+
+    def generate(self, prompt: str, model_name: str, cached_content: str = None,
+                 response_schema: dict = None) -> str:
+        time.sleep(self.sample_latency())
+        self.maybe_fail()
+        self.check_cached_content(cached_content)
+        return self.build_response(prompt)
+
+    def generate_stream(self, prompt: str, model_name: str, cached_content: str = None,
+                        response_schema: dict = None) -> Iterator[str]:
+        # زمن أول جزء ثم توزيع بقية الزمن على الأجزاء
+        total = self.sample_latency()
+        time.sleep(total * 0.3)
+        self.maybe_fail()
+        self.check_cached_content(cached_content)
+
+        text = self.build_response(prompt)
+        step = max(len(text) // self.stream_chunks, 1)
+        delay = (total * 0.7) / self.stream_chunks
+
+        for start in range(0, len(text), step):
+            time.sleep(delay)
+            yield text[start:start + step]
+
+    async def agenerate(self, prompt: str, model_name: str, cached_content: str = None,
+                        response_schema: dict = None) -> str:
+        await asyncio.sleep(self.sample_latency())
+        self.maybe_fail()
+        self.check_cached_content(cached_content)
+        return self.build_response(prompt)
+
+    async def agenerate_stream(self, prompt: str, model_name: str, cached_content: str = None,
+                               response_schema: dict = None) -> AsyncIterator[str]:
+        total = self.sample_latency()
+        await asyncio.sleep(total * 0.3)
+        self.maybe_fail()
+        self.check_cached_content(cached_content)
+
+        text = self.build_response(prompt)
+        step = max(len(text) // self.stream_chunks, 1)
+        delay = (total * 0.7) / self.stream_chunks
+
+        for start in range(0, len(text), step):
+            await asyncio.sleep(delay)
+            yield text[start:start + step]
+
+    def probe(self, model_name: str) -> None:
+        return None
+
+    def create_cache(self, model_name: str, text: str, ttl_seconds: int):
+        from django.utils import timezone
+
+        with self._lock:
+            name = f'cachedContents/fake-{len(self.caches) + 1}'
+            self.caches[name] = text
+        return name, timezone.now() + timezone.timedelta(seconds=ttl_seconds)
+
+
+# ==================== اختيار الواجهة ====================
+
+BACKENDS = {
+    GeminiBackend.name: GeminiBackend,
+    FakeBackend.name: FakeBackend.from_settings,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> LLMBackend:
+    """الواجهة المحددة في AI_BACKEND (نسخة واحدة لكل عملية)"""
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = getattr(settings, 'AI_BACKEND', 'gemini')
+                if name not in BACKENDS:
+                    raise ValueError(f'واجهة AI غير معروفة: {name}')
+                _backend = BACKENDS[name]()
+                if name != GeminiBackend.name:
+                    logger.warning(f"AI backend '{name}' is active - no requests are sent to Gemini")
+
+    return _backend
+
+
+def set_backend(backend: LLMBackend = None):
+    """
+    تعيين الواجهة يدوياً (للاختبارات)، أو None لإعادة القراءة من الإعدادات
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
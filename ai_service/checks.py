@@ -0,0 +1,49 @@
+"""
+فحوص النظام لخدمات AI
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+حدود الاستخدام وأماكن طلبات Gemini المتزامنة تُحفظ في Django cache،
+والذاكرة المؤقتة الافتراضية (LocMemCache) خاصة بكل عملية: مع عدة عمليات
+(gunicorn / uvicorn --workers) يرى كل منها عدادات وطوابير مختلفة. الفحص
+ينبه لذلك في الإنتاج، ويُسجل نفس التحذير عند بدء كل عملية (warn_if_local_cache)
+لأن خوادم التشغيل لا تُنفذ فحوص النظام.
+"""
+
+import logging
+
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+logger = logging.getLogger(__name__)
+
+# ذاكرة مؤقتة لا تراها إلا العملية التي أنشأتها
+PROCESS_LOCAL_CACHE_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def cache_is_shared(alias='default'):
+    """هل الذاكرة المؤقتة مشتركة بين العمليات (Redis أو Memcached أو قاعدة البيانات أو الملفات)"""
+    backend = settings.CACHES.get(alias, {}).get('BACKEND', '')
+    return backend not in PROCESS_LOCAL_CACHE_BACKENDS
+
+
+LOCAL_CACHE_MESSAGE = (
+    'CACHES["default"] is process-local: AI rate limits are counted from the database '
+    'on every request, and AI_MAX_CONCURRENT_CALLS applies per process instead of per deployment.'
+)
+LOCAL_CACHE_HINT = 'Configure a shared cache (Redis or Memcached) in CACHES.'
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if settings.DEBUG or cache_is_shared():
+        return []
+    return [Warning(LOCAL_CACHE_MESSAGE, hint=LOCAL_CACHE_HINT, id='ai_service.W001')]
+
+
+def warn_if_local_cache():
+    """تحذير في سجل العملية عند بدئها (gunicorn وuvicorn لا تُنفذ فحوص النظام)"""
+    if not settings.DEBUG and not cache_is_shared():
+        logger.warning(f"{LOCAL_CACHE_MESSAGE} {LOCAL_CACHE_HINT}")
@@ -0,0 +1,393 @@
+"""
+التحكم في عدد طلبات Gemini المتزامنة على مستوى النشر كاملاً
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+كل استدعاء لـ generate_content يحجز مكاناً (lease) ضمن حدين:
+1. حد المستخدم (AI_MAX_CONCURRENT_CALLS_PER_USER): طلبات المستخدم الواحد
+   تنتظر بعضها، فلا يستحوذ مستخدم واحد على كل الأماكن.
+2. الحد العام (AI_MAX_CONCURRENT_CALLS): الحد الكلي لكل العمليات والخوادم.
+
+الطلب الذي لا يجد مكاناً يأخذ تذكرة في طابور مستخدمه. طوابير المستخدمين
+تُخدم بالتناوب (round-robin): كلما حصل مستخدم على مكان انتقل لآخر الدور،
+فمستخدم لديه عشرات الطلبات المنتظرة لا يؤخر طلب مستخدم آخر أكثر من دورة
+واحدة، وطلبات المستخدم الواحد تُخدم بترتيب وصولها.
+
+الأماكن والطوابير حالة واحدة في Django cache تُعدل تحت قفل قصير (cache.add
+مع مدة صلاحية)، فالحجز والتحرير ذريان بين العمليات. للأماكن مدة صلاحية فلا
+يبقى مكان محجوزاً إذا توقفت العملية فجأة، والتذكرة التي توقف صاحبها عن
+الاستطلاع تُحذف. الطلب ينتظر حتى AI_CALL_WAIT_TIMEOUT ثانية ثم يُرفض بـ
+AIServiceBusy بدلاً من إرسال طلب سيُرد بخطأ 429. هذا يتطلب ذاكرة مؤقتة
+مشتركة (راجع checks.py). العروض غير المتزامنة تستخدم acall_slot (نفس
+الحالة، انتظار بـ asyncio، وعمليات الذاكرة المؤقتة في خيط حتى لا توقف
+حلقة الأحداث).
+"""
+
+import time
+import uuid
+import random
+import asyncio
+import logging
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .health import AIServiceUnavailable
+
+# إعداد التسجيل
+logger = logging.getLogger(__name__)
+
+# المستخدم صاحب الطلبات الحالية (يُعيَّن في العروض والمهام)
+_current_caller = ContextVar('ai_current_caller', default=None)
+
+
+class AIServiceBusy(AIServiceUnavailable):
+    """انتهت مهلة انتظار مكان متاح لطلب Gemini"""
+
+
+def get_limits():
+    """(الحد العام، حد المستخدم، مهلة الانتظار، مدة حجز المكان)"""
+    return (
+        getattr(settings, 'AI_MAX_CONCURRENT_CALLS', 16),
+        getattr(settings, 'AI_MAX_CONCURRENT_CALLS_PER_USER', 4),
+        getattr(settings, 'AI_CALL_WAIT_TIMEOUT', 30),
+        getattr(settings, 'AI_CALL_SLOT_TTL', 300),
+    )
+
+
+# ==================== صاحب الطلب ====================
+
+@contextmanager
+def ai_caller(user_or_id):
+    """
+    تحديد المستخدم الذي تُحتسب عليه طلبات Gemini داخل الكتلة
+
+    Example:
+        with ai_caller(request.user):
+            answer = generate_chat_response(...)
+    """
+    user_id = getattr(user_or_id, 'pk', user_or_id)
+    token = _current_caller.set(user_id)
+    try:
+        yield
+    finally:
+        _current_caller.reset(token)
+
+
+def current_caller():
+    return _current_caller.get()
+
+
+# ==================== الأماكن والطوابير ====================
+
+STATE_KEY = 'ai:cc:state'
+LOCK_KEY = 'ai:cc:lock'
+
+# مدة القفل: التعديل يستغرق أجزاء من الثانية، والمدة لعملية توقفت وهي تحمله
+LOCK_TTL = 5
+LOCK_RETRY_DELAY = 0.01
+
+# أطول انتظار بين استطلاعين (مع العشوائية 1.5 ثانية)، والتذكرة التي لم
+# يستطلعها صاحبها خلال STALE_TICKET_AFTER تُحذف (عملية توقفت أو طلب أُلغي)
+MAX_POLL_DELAY = 1.0
+STALE_TICKET_AFTER = 3.0
+
+
+def _caller_key(caller):
+    return str(caller) if caller is not None else 'system'
+
+
+def _empty_state():
+    # leases: المعرف -> [المستخدم، نهاية الصلاحية]
+    # tickets: المستخدم -> [[المعرف، آخر استطلاع]...] بترتيب الوصول
+    # rotation: ترتيب دور المستخدمين المنتظرين
+    return {'leases': {}, 'tickets': {}, 'rotation': []}
+
+
+def _lock():
+    """محاولة واحدة لأخذ القفل (لا تنتظر)"""
+    return cache.add(LOCK_KEY, True, timeout=LOCK_TTL)
+
+
+def _unlock():
+    cache.delete(LOCK_KEY)
+
+
+def _load_state(now):
+    """الحالة الحالية بعد حذف الأماكن المنتهية والتذاكر المتروكة (تحت القفل)"""
+    state = cache.get(STATE_KEY) or _empty_state()
+
+    state['leases'] = {
+        lease: value for lease, value in state['leases'].items() if value[1] > now
+    }
+    for user, tickets in list(state['tickets'].items()):
+        tickets = [ticket for ticket in tickets if now - ticket[1] < STALE_TICKET_AFTER]
+        if tickets:
+            state['tickets'][user] = tickets
+        else:
+            del state['tickets'][user]
+    state['rotation'] = [user for user in state['rotation'] if user in state['tickets']]
+    return state
+
+
+def _save_state(state):
+    cache.set(STATE_KEY, state, timeout=None)
+
+
+def _admitted(state, global_limit, user_limit):
+    """
+    التذاكر التي يحق لها مكان الآن
+
+    تمر على المستخدمين بترتيب الدور وتأخذ أول تذكرة لكل مستخدم لم يبلغ
+    حده، ثم الثانية في الدورة التالية، حتى تنفد الأماكن الفارغة.
+    """
+    free = global_limit - len(state['leases'])
+    in_use = {}
+    for user, _ in state['leases'].values():
+        in_use[user] = in_use.get(user, 0) + 1
+
+    admitted = set()
+    position = {user: 0 for user in state['rotation']}
+    while free > 0:
+        progress = False
+        for user in state['rotation']:
+            tickets = state['tickets'][user]
+            if position[user] >= len(tickets):
+                continue
+            if user_limit > 0 and in_use.get(user, 0) >= user_limit:
+                continue
+            admitted.add(tickets[position[user]][0])
+            position[user] += 1
+            in_use[user] = in_use.get(user, 0) + 1
+            free -= 1
+            progress = True
+            if free == 0:
+                break
+        if not progress:
+            break
+    return admitted
+
+
+def _poll(user, ticket, global_limit, user_limit, ttl):
+    """
+    استطلاع واحد تحت القفل: تسجيل التذكرة أو تحديثها، وتحويلها لمكان إن جاء دورها
+
+    Returns:
+        bool | None: True عند الحجز، False إذا لم يأتِ الدور، None إذا كان القفل مشغولاً
+    """
+    if not _lock():
+        return None
+    try:
+        now = time.time()
+        state = _load_state(now)
+
+        tickets = state['tickets'].setdefault(user, [])
+        for entry in tickets:
+            if entry[0] == ticket:
+                entry[1] = now
+                break
+        else:
+            tickets.append([ticket, now])
+        if user not in state['rotation']:
+            state['rotation'].append(user)
+
+        acquired = ticket in _admitted(state, global_limit, user_limit)
+        if acquired:
+            tickets.remove(next(entry for entry in tickets if entry[0] == ticket))
+            state['leases'][ticket] = [user, now + ttl]
+            # المستخدم الذي خُدم ينتقل لآخر الدور
+            state['rotation'].remove(user)
+            if tickets:
+                state['rotation'].append(user)
+            else:
+                del state['tickets'][user]
+
+        _save_state(state)
+        return acquired
+    finally:
+        _unlock()
+
+
+def _withdraw(user, ticket):
+    """حذف تذكرة طلب توقف عن الانتظار (محاولة واحدة، وإلا تُحذف لاحقاً لأنها متروكة)"""
+    if not _lock():
+        return
+    try:
+        state = _load_state(time.time())
+        tickets = [entry for entry in state['tickets'].get(user, []) if entry[0] != ticket]
+        if tickets:
+            state['tickets'][user] = tickets
+        else:
+            state['tickets'].pop(user, None)
+            state['rotation'] = [other for other in state['rotation'] if other != user]
+        _save_state(state)
+    finally:
+        _unlock()
+
+
+def _acquire_slots(wait_timeout, global_limit, user_limit, ttl):
+    """
+    انتظار الدور في طابور المستخدم ثم حجز مكان
+
+    مولد يُرجع مدة الانتظار قبل كل محاولة تالية، والمستدعي ينام بالطريقة
+    المناسبة له (time.sleep أو asyncio.sleep) ثم يستأنفه.
+
+    Returns:
+        str: معرف المكان المحجوز عند انتهاء المولد
+
+    Raises:
+        AIServiceBusy: إذا لم يأتِ الدور قبل انتهاء المهلة
+    """
+    caller = current_caller()
+    user = _caller_key(caller)
+    ticket = uuid.uuid4().hex
+
+    deadline = time.monotonic() + wait_timeout
+    delay = 0.05
+
+    try:
+        while True:
+            acquired = _poll(user, ticket, global_limit, user_limit, ttl)
+            if acquired:
+                return ticket
+
+            # القفل مشغول: إعادة المحاولة بعد لحظة (المهلة تُحسب بعد استطلاع فعلي)
+            if acquired is None:
+                yield LOCK_RETRY_DELAY
+                continue
+
+            if time.monotonic() >= deadline:
+                logger.warning(f"Gemini call slot wait timed out for caller {caller}")
+                raise AIServiceBusy('خدمة الذكاء الاصطناعي مشغولة حالياً. يرجى المحاولة بعد قليل.')
+
+            # انتظار تصاعدي مع عشوائية حتى لا تتزامن محاولات العمليات
+            yield min(delay, max(deadline - time.monotonic(), 0)) * random.uniform(0.5, 1.5)
+            delay = min(delay * 2, MAX_POLL_DELAY)
+    except BaseException:
+        _withdraw(user, ticket)
+        raise
+
+
+def _release_slot(lease):
+    """
+    تحرير مكان تحت القفل (مولد يُرجع مدة الانتظار إذا كان القفل مشغولاً)
+
+    المكان يُحذف من الحالة بمعرفه، فلا يمكن أن يحرر طلب مكان طلب آخر.
+    """
+    deadline = time.monotonic() + LOCK_TTL
+    while not _lock():
+        if time.monotonic() >= deadline:
+            # ينتهي المكان وحده بانتهاء صلاحيته
+            logger.warning("Gemini call slot release timed out waiting for the lock")
+            return
+        yield LOCK_RETRY_DELAY
+    try:
+        state = _load_state(time.time())
+        state['leases'].pop(lease, None)
+        _save_state(state)
+    finally:
+        _unlock()
+
+
+def _wait(attempts):
+    """تشغيل مولد محاولات مع النوم بين المحاولات، وإرجاع نتيجته"""
+    try:
+        while True:
+            time.sleep(next(attempts))
+    except StopIteration as done:
+        return done.value
+    finally:
+        attempts.close()
+
+
+def _step(attempts):
+    """محاولة واحدة من مولد المحاولات: (انتهى؟، مدة الانتظار أو النتيجة)"""
+    try:
+        return False, next(attempts)
+    except StopIteration as done:
+        return True, done.value
+
+
+async def _await(attempts):
+    """
+    نسخة _wait غير المتزامنة (الإلغاء أثناء الانتظار يُغلق المولد فتُسحب التذكرة)
+
+    المحاولات تستدعي Django cache المتزامن، فتُنفذ في خيط منفصل: لا توقف
+    حلقة الأحداث، ولا تُرفض مع الواجهات التي تمنع الاستدعاء من سياق
+    غير متزامن (مثل DatabaseCache).
+    """
+    step = sync_to_async(_step, thread_sensitive=False)
+    try:
+        while True:
+            done, value = await step(attempts)
+            if done:
+                return value
+            await asyncio.sleep(value)
+    finally:
+        try:
+            await sync_to_async(attempts.close, thread_sensitive=False)()
+        except ValueError:
+            # أُلغي الطلب أثناء محاولة لم تنتهِ بعد: التذكرة تُحذف لاحقاً لأنها متروكة
+            pass
+
+
+@contextmanager
+def call_slot():
+    """
+    حجز مكان لطلب Gemini واحد طوال الكتلة
+
+    Raises:
+        AIServiceBusy: إذا لم يتوفر مكان قبل انتهاء المهلة
+    """
+    global_limit, user_limit, wait_timeout, ttl = get_limits()
+
+    if global_limit <= 0:
+        yield
+        return
+
+    lease = _wait(_acquire_slots(wait_timeout, global_limit, user_limit, ttl))
+    try:
+        yield
+    finally:
+        _wait(_release_slot(lease))
+
+
+@asynccontextmanager
+async def acall_slot():
+    """نسخة call_slot للعروض غير المتزامنة (الانتظار لا يحجز خيطاً)"""
+    global_limit, user_limit, wait_timeout, ttl = get_limits()
+
+    if global_limit <= 0:
+        yield
+        return
+
+    lease = await _await(_acquire_slots(wait_timeout, global_limit, user_limit, ttl))
+    try:
+        yield
+    finally:
+        await _await(_release_slot(lease))
+
+
+# ==================== الإحصاءات ====================
+
+def get_queue_stats():
+    """
+    حالة طلبات Gemini الحالية على مستوى النشر
+
+    Returns:
+        dict: السعة، الطلبات الجارية، الطلبات المنتظرة
+    """
+    global_limit = get_limits()[0]
+    state = cache.get(STATE_KEY) or _empty_state()
+    now = time.time()
+
+    return {
+        'capacity': global_limit,
+        'in_flight': sum(1 for _, expires in state['leases'].values() if expires > now),
+        'waiting': sum(
+            1 for tickets in state['tickets'].values()
+            for _, seen in tickets if now - seen < STALE_TICKET_AFTER
+        ),
+    }
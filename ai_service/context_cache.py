@@ -0,0 +1,162 @@
+"""
+ذاكرة السياق لدى Gemini (Context Caching) لملفات المحاضرات
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+بدلاً من إرسال نص الملف مع كل رسالة محادثة أو دفعة أسئلة، يُرفع النص
+مرة واحدة لكل (بصمة محتوى، نموذج) ويُشار إليه في الطلبات اللاحقة باسم
+المرجع، فتُحتسب توكناته بسعر مخفض ويقل زمن أول استجابة.
+
+- لا يُنشأ مرجع لنص أقل من AI_CONTEXT_CACHE_MIN_TOKENS (حد المزود الأدنى)
+- المرجع صالح لمدة AI_CONTEXT_CACHE_TTL ثانية، ثم يُنشأ مرجع جديد عند الحاجة
+- أي خطأ في ذاكرة السياق لا يُفشل الطلب: يُرسل النص بالطريقة العادية
+"""
+
+import logging
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .models import GeminiContextCache
+from .prompt_budget import estimate_tokens
+
+# إعداد التسجيل
+logger = logging.getLogger(__name__)
+
+CREATE_LOCK_KEY = 'ai:ctxcache:creating:{content_hash}:{model}'
+
+# هامش قبل انتهاء الصلاحية لا يُستخدم فيه المرجع (ثانية)
+EXPIRY_MARGIN = 120
+
+# نص يحل محل نص الملف في الطلبات التي تشير لذاكرة السياق
+ATTACHED_TEXT_NOTE = '(نص المحاضرة الكامل مرفق في سياق هذا الطلب)'
+
+
+@dataclass
+class CachedContext:
+    """مرجع ذاكرة سياق صالح لنموذج محدد"""
+    name: str
+    model: str
+
+
+def is_enabled():
+    return getattr(settings, 'AI_CONTEXT_CACHE_ENABLED', True)
+
+
+def _lookup(content_hash, model):
+    entry = GeminiContextCache.objects.filter(
+        content_hash=content_hash,
+        model_name=model,
+        expires_at__gt=timezone.now() + timezone.timedelta(seconds=EXPIRY_MARGIN)
+    ).first()
+
+    if entry:
+        GeminiContextCache.objects.filter(pk=entry.pk).update(hit_count=F('hit_count') + 1)
+    return entry
+
+
+def get_cached_context(content_hash, text, model=None, create=True):
+    """
+    مرجع ذاكرة السياق لنص الملف، ويُنشأ إن لم يوجد (عند create=True)
+
+    Args:
+        content_hash: بصمة محتوى الملف
+        text: النص الكامل (لإنشاء المرجع)
+        model: النموذج (الافتراضي DEFAULT_MODEL)
+        create: إنشاء مرجع جديد إن لم يوجد
+
+    Returns:
+        CachedContext | None
+    """
+    from .backends import get_backend
+
+    model = model or _default_model()
+
+    if not is_enabled() or not content_hash or not text:
+        return None
+
+    token_count = estimate_tokens(text)
+    if token_count < getattr(settings, 'AI_CONTEXT_CACHE_MIN_TOKENS', 32768):
+        return None
+
+    try:
+        entry = _lookup(content_hash, model)
+        if entry:
+            return CachedContext(entry.cache_name, model)
+
+        if not create:
+            return None
+
+        # عملية واحدة فقط تُنشئ المرجع، والبقية ترسل النص عادياً هذه المرة
+        lock_key = CREATE_LOCK_KEY.format(content_hash=content_hash, model=model)
+        if not cache.add(lock_key, True, timeout=120):
+            return None
+
+        try:
+            ttl = getattr(settings, 'AI_CONTEXT_CACHE_TTL', 3600)
+            name, expires_at = get_backend().create_cache(model, f"نص المحاضرة:\n{text}", ttl)
+
+            GeminiContextCache.objects.update_or_create(
+                content_hash=content_hash,
+                model_name=model,
+                defaults={
+                    'cache_name': name,
+                    'token_count': token_count,
+                    'expires_at': expires_at or timezone.now() + timezone.timedelta(seconds=ttl),
+                    'hit_count': 0,
+                }
+            )
+            logger.info(f"Context cache created for {content_hash[:12]} on {model} (~{token_count} tokens)")
+            return CachedContext(name, model)
+        finally:
+            cache.delete(lock_key)
+
+    except NotImplementedError:
+        return None
+    except Exception as e:
+        logger.warning(f"Context cache unavailable for {content_hash[:12]}: {str(e)}")
+        return None
+
+
+def get_file_cached_context(lecture_file, text=None, create=True):
+    """
+    مرجع ذاكرة السياق لملف محاضرة
+
+    Returns:
+        CachedContext | None
+    """
+    from .text_extractor import get_file_hash, get_file_text
+
+    if not is_enabled() or lecture_file is None:
+        return None
+    if lecture_file.content_type == 'external_link' or not lecture_file.file:
+        return None
+
+    try:
+        content_hash = get_file_hash(lecture_file)
+    except OSError as e:
+        logger.warning(f"Context cache: cannot hash file {lecture_file.pk}: {str(e)}")
+        return None
+
+    if text is None:
+        # البحث أولاً حتى لا يُقرأ النص إذا كان المرجع موجوداً
+        entry = _lookup(content_hash, _default_model())
+        if entry:
+            return CachedContext(entry.cache_name, entry.model_name)
+        if not create:
+            return None
+        text = get_file_text(lecture_file)
+
+    return get_cached_context(content_hash, text, create=create)
+
+
+def invalidate(cached_context):
+    """حذف مرجع لم يعد صالحاً لدى المزود (انتهى أو حُذف)"""
+    GeminiContextCache.objects.filter(cache_name=cached_context.name).delete()
+
+
+def _default_model():
+    from .utils import DEFAULT_MODEL
+    return DEFAULT_MODEL
@@ -0,0 +1,199 @@
+"""
+جلسات المحادثة وضغط السجل
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+كل سؤال يُنسب لجلسة (AIConversation) للمستخدم والملف. الطلب يحتوي على
+ملخص الجلسة المتجدد وآخر AI_CHAT_RECENT_TURNS أدوار فقط، والأدوار الأقدم
+تُدمج في الملخص بمهمة في الخلفية (AIJob.CHAT_SUMMARY) بعد كل دور جديد،
+فيبقى حجم الطلب ثابتاً مهما طالت المحادثة.
+"""
+
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import AIJob, AIConversation, AIMessage
+from .prompt_budget import truncate_to_tokens
+
+# إعداد التسجيل
+logger = logging.getLogger(__name__)
+
+# أقصى عدد من الأدوار غير الملخصة في الطلب (إذا تأخر تحديث الملخص)
+MAX_PENDING_TURNS = 5
+
+
+def get_recent_turns():
+    """عدد الأدوار الأخيرة التي تُرسل كما هي"""
+    return max(getattr(settings, 'AI_CHAT_RECENT_TURNS', 1), 1)
+
+
+def get_summary_max_tokens():
+    return getattr(settings, 'AI_CHAT_SUMMARY_MAX_TOKENS', 400)
+
+
+# ==================== الجلسات ====================
+
+def get_conversation(user, lecture_file=None, conversation_id=None):
+    """
+    الجلسة المطلوبة، أو آخر جلسة نشطة لنفس الملف خلال AI_CHAT_SESSION_TIMEOUT،
+    أو جلسة جديدة
+
+    Returns:
+        AIConversation
+    """
+    if conversation_id:
+        conversation = AIConversation.objects.filter(pk=conversation_id, user=user, is_active=True).first()
+        if conversation:
+            return conversation
+
+    timeout = getattr(settings, 'AI_CHAT_SESSION_TIMEOUT', 3 * 3600)
+    conversation = AIConversation.objects.filter(
+        user=user,
+        file=lecture_file,
+        is_active=True,
+        updated_at__gte=timezone.now() - timezone.timedelta(seconds=timeout)
+    ).first()
+
+    return conversation or AIConversation.objects.create(user=user, file=lecture_file)
+
+
+def _pair_turns(messages):
+    """تحويل الرسائل المتتالية (مستخدم ثم مساعد) إلى أدوار"""
+    turns = []
+    for message in messages:
+        if message.role == AIMessage.USER:
+            turns.append({'question': message.content, 'answer': ''})
+        elif message.role == AIMessage.ASSISTANT and turns:
+            turns[-1]['answer'] = message.content
+    return turns
+
+
+def get_prompt_history(conversation):
+    """
+    سجل الجلسة للطلب
+
+    Returns:
+        tuple: (ملخص الأدوار القديمة، آخر الأدوار غير الملخصة [{question, answer}])
+    """
+    messages = list(
+        conversation.messages.filter(id__gt=conversation.summary_until_id)
+        .order_by('-id')[:MAX_PENDING_TURNS * 2]
+    )
+    turns = _pair_turns(reversed(messages))
+    return conversation.summary, turns
+
+
+def record_turn(conversation, question, answer):
+    """
+    حفظ دور جديد في الجلسة وجدولة تحديث الملخص إذا تجاوزت الأدوار غير الملخصة الحد
+
+    Returns:
+        AIJob | None: مهمة تحديث الملخص إن جُدولت
+    """
+    AIMessage.objects.bulk_create([
+        AIMessage(conversation=conversation, role=AIMessage.USER, content=question),
+        AIMessage(conversation=conversation, role=AIMessage.ASSISTANT, content=answer),
+    ])
+
+    update_fields = ['updated_at']
+    if not conversation.title:
+        conversation.title = question[:200]
+        update_fields.append('title')
+    conversation.save(update_fields=update_fields)
+
+    return schedule_summary_refresh(conversation)
+
+
+# ==================== ضغط السجل ====================
+
+def _messages_to_fold(conversation):
+    """الرسائل غير الملخصة باستثناء آخر الأدوار"""
+    pending = list(conversation.messages.filter(id__gt=conversation.summary_until_id).order_by('id'))
+    keep = get_recent_turns() * 2
+    return pending[:-keep] if len(pending) > keep else []
+
+
+def schedule_summary_refresh(conversation):
+    """
+    جدولة مهمة في الخلفية لدمج الأدوار القديمة في ملخص الجلسة
+
+    لا تُنشأ مهمة إذا كانت هناك مهمة معلقة لنفس الجلسة، ولا يُحدث الملخص
+    داخل الطلب عند تعطيل قائمة الانتظار (يُرسل عندها آخر MAX_PENDING_TURNS أدوار).
+
+    Returns:
+        AIJob | None
+    """
+    from .jobs import enqueue_job
+
+    if not getattr(settings, 'AI_JOB_QUEUE_ENABLED', False):
+        return None
+
+    pending_count = conversation.messages.filter(id__gt=conversation.summary_until_id).count()
+    if pending_count <= get_recent_turns() * 2:
+        return None
+
+    pending = AIJob.objects.filter(
+        job_type=AIJob.CHAT_SUMMARY,
+        status__in=[AIJob.PENDING, AIJob.RUNNING],
+        params__conversation_id=conversation.pk
+    ).exists()
+    if pending:
+        return None
+
+    return enqueue_job(AIJob.CHAT_SUMMARY, conversation.user, conversation.file, conversation_id=conversation.pk)
+
+
+def build_summary_prompt(summary, turns, max_tokens):
+    """نص طلب دمج الأدوار الجديدة في الملخص الحالي"""
+    turns_text = ''.join(
+        f"المستخدم: {turn['question']}\nالمساعد: {turn['answer']}\n\n" for turn in turns
+    )
+    return f"""
+أنت تختصر محادثة بين طالب ومساعد أكاديمي ليستمر المساعد فيها لاحقاً.
+
+الملخص الحالي:
+{summary or '(لا يوجد)'}
+
+الأدوار الجديدة:
+{turns_text}
+حدّث الملخص ليشمل الأدوار الجديدة:
+1. احتفظ بالمواضيع التي سأل عنها الطالب والإجابات والتعريفات المهمة
+2. احتفظ بما يحتاجه المساعد لفهم أسئلة المتابعة (المراجع، الأمثلة، ما لم يفهمه الطالب)
+3. احذف التحيات والتكرار
+4. لا تتجاوز {max_tokens // 2} كلمة تقريباً
+5. اكتب الملخص مباشرة بدون مقدمة
+"""
+
+
+def refresh_summary(conversation):
+    """
+    دمج الأدوار القديمة في ملخص الجلسة (يُنفذ في مهمة الخلفية)
+
+    Returns:
+        bool: True إذا تم تحديث الملخص
+    """
+    from .utils import generate_content
+
+    messages = _messages_to_fold(conversation)
+    turns = _pair_turns(messages)
+    if not turns:
+        return False
+
+    max_tokens = get_summary_max_tokens()
+    summary = generate_content(build_summary_prompt(conversation.summary, turns, max_tokens))
+    if not summary:
+        return False
+
+    summary = truncate_to_tokens(summary.strip(), max_tokens)
+
+    # التحديث مشروط بعدم تغير الملخص منذ القراءة (مهمة أخرى سبقت)
+    updated = AIConversation.objects.filter(
+        pk=conversation.pk,
+        summary_until_id=conversation.summary_until_id
+    ).update(summary=summary, summary_until_id=messages[-1].id)
+
+    if updated:
+        conversation.summary = summary
+        conversation.summary_until_id = messages[-1].id
+    return bool(updated)
@@ -0,0 +1,279 @@
+"""
+استخراج النصوص في عمليات معزولة
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+ملف PDF تالف أو ضخم قد يُبقي PyPDF2 يعمل لدقائق أو يستهلك جيجابايتات
+من الذاكرة، فلا يُنفذ الاستخراج داخل عامل الويب بل في عمليات منفصلة:
+- حد زمني لكل ملف (AI_EXTRACTION_TIMEOUT): تُنهى العملية عند تجاوزه
+- حد للذاكرة (AI_EXTRACTION_MAX_MEMORY_MB): يُضبط كحد لمساحة العناوين
+  (RLIMIT_AS) داخل العملية فيفشل أي تخصيص يتجاوزه مهما كان سريعاً،
+  وتُراقب الذاكرة المقيمة أيضاً أثناء الانتظار وتُنهى العملية عند تجاوزه
+- استبدال العملية بعد AI_EXTRACTION_MAX_JOBS_PER_WORKER ملف (تسرب الذاكرة في المكتبات)
+- الفشل يُرفع كـ ExtractionError برمز ثابت بدلاً من طباعة الخطأ
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+import multiprocessing
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# فترة مراقبة العملية أثناء انتظار النتيجة (ثانية)
+POLL_INTERVAL = 0.05
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class ExtractionError(Exception):
+    """فشل استخراج النص من ملف"""
+
+    TIMEOUT = 'timeout'
+    MEMORY = 'memory'
+    CRASHED = 'crashed'
+    FAILED = 'failed'
+
+    def __init__(self, code, message, file_path=''):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.file_path = file_path
+
+    def as_dict(self):
+        return {'code': self.code, 'message': self.message, 'file': os.path.basename(self.file_path)}
+
+
+def _limit_memory(max_memory_mb):
+    """حد مساحة العناوين للعملية الحالية (لا يُطبق خارج Unix)"""
+    try:
+        import resource
+    except ImportError:
+        return
+
+    limit = int(max_memory_mb * 1024 * 1024)
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        logger.warning(f"Could not limit extraction memory to {max_memory_mb} MB: {e}")
+
+
+def _worker_main(conn, max_memory_mb=None):
+    """حلقة العملية: استقبال (المسار، الامتداد) وإرسال النتيجة حتى يصل None"""
+    import django
+    django.setup()
+
+    if max_memory_mb:
+        _limit_memory(max_memory_mb)
+
+    from .text_extractor import read_document
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        file_path, extension = job
+        start_time = time.time()
+        try:
+            text, page_offsets = read_document(file_path, extension)
+        except MemoryError:
+            conn.send(('memory', f'Extraction exceeded {max_memory_mb} MB'))
+        except Exception as e:
+            conn.send(('error', f'{type(e).__name__}: {e}'))
+        else:
+            conn.send(('ok', text, page_offsets, time.time() - start_time))
+
+
+def _rss_mb(pid):
+    """الذاكرة المقيمة للعملية بالميجابايت (0 إذا تعذرت قراءتها، مثل خارج Linux)"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class _Worker:
+    """عملية استخراج واحدة مع قناة الاتصال بها"""
+
+    def __init__(self, context, max_memory_mb=None):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, max_memory_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(timeout=1)
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+
+class ExtractionPool:
+    """
+    مجموعة عمليات الاستخراج
+
+    العمليات تُنشأ عند الحاجة (spawn) حتى `workers`، والعملية التي تتجاوز
+    الحدود أو تتعطل تُنهى ويحل محلها عملية جديدة في الطلب التالي.
+    """
+
+    def __init__(self, workers=2, timeout=60, max_memory_mb=1024, max_jobs_per_worker=50):
+        self.timeout = timeout
+        self.max_memory_mb = max_memory_mb
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self._context = multiprocessing.get_context('spawn')
+        self._slots = threading.BoundedSemaphore(max(workers, 1))
+        self._lock = threading.Lock()
+        self._idle = []
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        options = {
+            'workers': getattr(settings, 'AI_EXTRACTION_WORKERS', 2),
+            'timeout': getattr(settings, 'AI_EXTRACTION_TIMEOUT', 60),
+            'max_memory_mb': getattr(settings, 'AI_EXTRACTION_MAX_MEMORY_MB', 1024),
+            'max_jobs_per_worker': getattr(settings, 'AI_EXTRACTION_MAX_JOBS_PER_WORKER', 50),
+        }
+        options.update(overrides)
+        return cls(**options)
+
+    def extract(self, file_path, extension):
+        """
+        استخراج نص ملف في إحدى العمليات (ينتظر مكاناً متاحاً)
+
+        Returns:
+            tuple: (النص أو None، بدايات الصفحات، زمن الاستخراج)
+
+        Raises:
+            ExtractionError
+        """
+        with self._slots:
+            worker = self._checkout()
+            try:
+                return self._run(worker, file_path, extension)
+            except ExtractionError as e:
+                if e.code != ExtractionError.FAILED:
+                    logger.warning(f"Extraction worker {worker.process.pid} stopped ({e.code}): {e.message}")
+                    worker.kill()
+                    worker = None
+                raise
+            finally:
+                if worker is not None:
+                    self._checkin(worker)
+
+    def _run(self, worker, file_path, extension):
+        try:
+            worker.conn.send((file_path, extension))
+        except OSError:
+            raise ExtractionError(ExtractionError.CRASHED, 'Extraction process is not running', file_path)
+        worker.jobs += 1
+        deadline = time.monotonic() + self.timeout
+
+        while not worker.conn.poll(POLL_INTERVAL):
+            if not worker.process.is_alive():
+                break
+            if time.monotonic() > deadline:
+                raise ExtractionError(
+                    ExtractionError.TIMEOUT, f'Extraction exceeded {self.timeout}s', file_path
+                )
+            if self.max_memory_mb and _rss_mb(worker.process.pid) > self.max_memory_mb:
+                raise ExtractionError(
+                    ExtractionError.MEMORY, f'Extraction exceeded {self.max_memory_mb} MB', file_path
+                )
+
+        try:
+            result = worker.conn.recv()
+        except (EOFError, OSError):
+            raise ExtractionError(
+                ExtractionError.CRASHED, f'Extraction process exited ({worker.process.exitcode})', file_path
+            )
+
+        if result[0] == 'memory':
+            raise ExtractionError(ExtractionError.MEMORY, result[1], file_path)
+        if result[0] == 'error':
+            raise ExtractionError(ExtractionError.FAILED, result[1], file_path)
+        return result[1:]
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return _Worker(self._context, self.max_memory_mb)
+
+    def _checkin(self, worker):
+        if worker.jobs >= self.max_jobs_per_worker:
+            worker.stop()
+            return
+        with self._lock:
+            self._idle.append(worker)
+
+    def shutdown(self):
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.stop()
+
+
+# ==================== المجموعة المشتركة ====================
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_extraction_pool():
+    """مجموعة العمليات المشتركة في هذه العملية (تُنشأ من جديد بعد fork)"""
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ExtractionPool.from_settings()
+            _pool_pid = os.getpid()
+        return _pool
+
+
+@atexit.register
+def _shutdown_pool():
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.shutdown()
+
+
+def extract_isolated(file_path, extension):
+    """
+    استخراج نص ملف في عملية معزولة، أو داخل العملية الحالية إذا عُطل العزل
+    (AI_EXTRACTION_SANDBOX = False)
+
+    Returns:
+        tuple: (النص أو None، بدايات الصفحات، زمن الاستخراج)
+
+    Raises:
+        ExtractionError
+    """
+    if getattr(settings, 'AI_EXTRACTION_SANDBOX', True):
+        return get_extraction_pool().extract(file_path, extension)
+
+    from .text_extractor import read_document
+
+    start_time = time.time()
+    try:
+        text, page_offsets = read_document(file_path, extension)
+    except Exception as e:
+        raise ExtractionError(ExtractionError.FAILED, f'{type(e).__name__}: {e}', file_path)
+    return text, page_offsets, time.time() - start_time
@@ -0,0 +1,190 @@
+"""
+مراقبة حالة Gemini API وقاطع الدائرة (Circuit Breaker)
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+- حالة الاتصال تُحفظ في الذاكرة المؤقتة وتُحدَّث في الخلفية كل
+  AI_HEALTH_CHECK_INTERVAL ثانية، فلا تنتظر الصفحات أي طلب للـ API.
+- الفحص يستعلم عن بيانات النموذج فقط (بدون توليد محتوى مدفوع).
+- قاطع الدائرة يوقف الطلبات مؤقتاً بعد تكرار الأخطاء ويُرجع خطأً فورياً
+  بدلاً من انتظار مهلة الـ API في كل طلب.
+"""
+
+import time
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+# إعداد التسجيل
+logger = logging.getLogger(__name__)
+
+HEALTH_STATUS_KEY = 'ai:health:status'
+HEALTH_PROBE_LOCK_KEY = 'ai:health:probing'
+
+CIRCUIT_FAILURES_KEY = 'ai:circuit:failures'
+CIRCUIT_OPEN_UNTIL_KEY = 'ai:circuit:open_until'
+CIRCUIT_TRIAL_KEY = 'ai:circuit:trial'
+
+
+class AIServiceUnavailable(Exception):
+    """الخدمة متوقفة مؤقتاً (قاطع الدائرة مفتوح)"""
+
+
+# ==================== قاطع الدائرة ====================
+
+class CircuitBreaker:
+    """
+    قاطع دائرة مشترك بين العمليات (الحالة في Django cache)
+
+    الحالات:
+    - مغلق: الطلبات تمر بشكل طبيعي
+    - مفتوح: بعد failure_threshold أخطاء متتالية، تُرفض الطلبات فوراً
+      لمدة reset_timeout ثانية
+    - نصف مفتوح: بعد انتهاء المدة يُسمح بطلب تجريبي واحد، نجاحه يغلق
+      الدائرة وفشله يعيد فتحها
+
+    الإعدادات تُقرأ عند كل استخدام (لا عند الاستيراد) ما لم تُمرر قيم صريحة.
+    """
+
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+
+    @property
+    def failure_threshold(self):
+        return self._failure_threshold or getattr(settings, 'AI_CIRCUIT_FAILURE_THRESHOLD', 5)
+
+    @property
+    def reset_timeout(self):
+        return self._reset_timeout or getattr(settings, 'AI_CIRCUIT_RESET_TIMEOUT', 60)
+
+    def is_open(self):
+        open_until = cache.get(CIRCUIT_OPEN_UNTIL_KEY)
+        return open_until is not None and time.time() < open_until
+
+    def before_call(self):
+        """
+        التحقق قبل إرسال الطلب
+
+        Raises:
+            AIServiceUnavailable: إذا كانت الدائرة مفتوحة
+        """
+        open_until = cache.get(CIRCUIT_OPEN_UNTIL_KEY)
+        if open_until is None:
+            return
+
+        if time.time() < open_until:
+            raise AIServiceUnavailable('خدمة الذكاء الاصطناعي غير متاحة مؤقتاً. يرجى المحاولة بعد قليل.')
+
+        # نصف مفتوح: طلب تجريبي واحد فقط
+        if not cache.add(CIRCUIT_TRIAL_KEY, True, timeout=self.reset_timeout):
+            raise AIServiceUnavailable('خدمة الذكاء الاصطناعي غير متاحة مؤقتاً. يرجى المحاولة بعد قليل.')
+
+    def record_success(self):
+        if cache.get(CIRCUIT_OPEN_UNTIL_KEY) is not None:
+            logger.info("Gemini circuit closed")
+        cache.delete_many([CIRCUIT_FAILURES_KEY, CIRCUIT_OPEN_UNTIL_KEY, CIRCUIT_TRIAL_KEY])
+
+    def record_failure(self):
+        cache.add(CIRCUIT_FAILURES_KEY, 0, timeout=self.reset_timeout * 10)
+        try:
+            failures = cache.incr(CIRCUIT_FAILURES_KEY)
+        except ValueError:
+            failures = 1
+
+        if failures >= self.failure_threshold or cache.get(CIRCUIT_TRIAL_KEY):
+            cache.set(CIRCUIT_OPEN_UNTIL_KEY, time.time() + self.reset_timeout, timeout=self.reset_timeout * 10)
+            cache.delete(CIRCUIT_TRIAL_KEY)
+            logger.warning(f"Gemini circuit opened after {failures} failures")
+
+
+circuit_breaker = CircuitBreaker()
+
+
+# ==================== فحص الحالة ====================
+
+def probe_api():
+    """
+    فحص الاتصال بـ Gemini API دون توليد محتوى
+
+    يستعلم عن بيانات النموذج فقط، وهو طلب غير مدفوع.
+
+    Returns:
+        dict: حالة الاتصال
+    """
+    from .backends import get_backend
+    from .utils import DEFAULT_MODEL
+
+    try:
+        get_backend().probe(DEFAULT_MODEL)
+
+        status = {
+            'status': 'connected',
+            'model': DEFAULT_MODEL,
+            'message': 'الاتصال ناجح'
+        }
+    except ValueError as e:
+        status = {
+            'status': 'error',
+            'model': None,
+            'message': str(e)
+        }
+    except Exception as e:
+        status = {
+            'status': 'error',
+            'model': None,
+            'message': f'خطأ في الاتصال: {str(e)}'
+        }
+
+    status['checked_at'] = time.time()
+    cache.set(HEALTH_STATUS_KEY, status, timeout=None)
+    return status
+
+
+def _probe_in_background():
+    try:
+        probe_api()
+    except Exception as e:
+        logger.error(f"Gemini health probe error: {str(e)}")
+    finally:
+        cache.delete(HEALTH_PROBE_LOCK_KEY)
+
+
+def refresh_status_async():
+    """بدء فحص في الخلفية إن لم يكن هناك فحص جارٍ"""
+    if cache.add(HEALTH_PROBE_LOCK_KEY, True, timeout=60):
+        threading.Thread(target=_probe_in_background, daemon=True).start()
+
+
+def get_api_status():
+    """
+    حالة الاتصال من الذاكرة المؤقتة (لا تنتظر أي طلب للـ API)
+
+    إذا كانت الحالة أقدم من AI_HEALTH_CHECK_INTERVAL يبدأ فحص جديد
+    في الخلفية وتُرجع آخر حالة معروفة.
+
+    Returns:
+        dict: حالة الاتصال
+    """
+    interval = getattr(settings, 'AI_HEALTH_CHECK_INTERVAL', 300)
+    status = cache.get(HEALTH_STATUS_KEY)
+
+    if status is None or time.time() - status.get('checked_at', 0) > interval:
+        refresh_status_async()
+
+    if circuit_breaker.is_open():
+        return {
+            'status': 'error',
+            'model': None,
+            'message': 'الخدمة متوقفة مؤقتاً بسبب أخطاء متكررة'
+        }
+
+    if status is None:
+        return {
+            'status': 'checking',
+            'model': None,
+            'message': 'جاري التحقق من الاتصال'
+        }
+
+    return status
@@ -0,0 +1,349 @@
+"""
+مهام AI في الخلفية (قائمة انتظار في قاعدة البيانات)
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+العروض تُنشئ المهمة عبر enqueue_job وتعود فوراً برقمها،
+وأمر `python manage.py ai_worker` ينفذ المهام المعلقة بالتوازي.
+"""
+
+import time
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from accounts.models import UserActivity
+from .models import AIJob, AIQuestion, SharedSummary, AIConversation
+from .concurrency import ai_caller
+from .metering import usage_scope
+from .context_cache import get_file_cached_context
+from .text_extractor import get_file_text
+from .question_bank import add_questions_to_bank, record_draws, fill_bank, schedule_bank_fill
+from .pipeline import process_lecture_file
+from .conversations import refresh_summary
+from .utils import generate_summary, generate_questions, generate_study_pack, STUDY_PACK_SUMMARY_TYPES
+
+# إعداد التسجيل
+logger = logging.getLogger(__name__)
+
+
+class AIJobError(Exception):
+    """خطأ متوقع أثناء تنفيذ المهمة - تُعرض رسالته للمستخدم كما هي"""
+
+
+# ==================== منفذات المهام ====================
+
+def run_summary_job(job):
+    """
+    تنفيذ مهمة توليد ملخص
+
+    يُستخدم الملخص المشترك إن وُجد (ربما ولّده طالب آخر أثناء
+    انتظار المهمة)، وإلا يُولد ويُحفظ في الملخصات المشتركة.
+
+    Returns:
+        int: معرف الملخص المُنشأ
+    """
+    summary_type = job.params.get('summary_type', 'brief')
+    language = job.params.get('language', 'ar')
+    start_time = time.time()
+
+    shared = SharedSummary.for_file(job.file, summary_type, language)
+
+    if shared:
+        shared.record_hit()
+    else:
+        # استخراج النص من الملف
+        text = get_file_text(job.file)
+
+        if not text or len(text.strip()) < 50:
+            raise AIJobError('لم نتمكن من استخراج نص كافٍ من هذا الملف.')
+
+        # توليد الملخص عبر Gemini API وحفظه للمشاركة
+        # (يُستخدم مرجع ذاكرة السياق إن أنشأته المحادثة أو الأسئلة، دون إنشاء مرجع جديد)
+        cached_context = get_file_cached_context(job.file, text, create=False)
+        summary_text = generate_summary(text, summary_type, language, cached_context)
+        shared = SharedSummary.store(job.file, summary_type, language, summary_text)
+
+    processing_time = time.time() - start_time
+
+    # حفظ نسخة الملخص للمستخدم في قاعدة البيانات
+    summary = shared.create_user_summary(job.user, job.file, processing_time)
+
+    # تسجيل النشاط في User_Activity
+    UserActivity.log(
+        user=job.user,
+        action=UserActivity.AI_SUMMARY,
+        details={
+            'file_id': job.file_id,
+            'file_name': job.file.title,
+            'summary_type': summary_type,
+            'summary_id': summary.id,
+            'job_id': job.id,
+            'word_count': summary.word_count,
+            'processing_time': round(processing_time, 2)
+        }
+    )
+
+    logger.info(f"Summary generated for user {job.user.academic_id}, file {job.file_id}")
+    return summary.id
+
+
+def run_questions_job(job):
+    """
+    تنفيذ مهمة توليد أسئلة
+
+    Returns:
+        int: معرف مجموعة الأسئلة المُنشأة
+    """
+    difficulty = job.params.get('difficulty', 'medium')
+    questions_count = job.params.get('questions_count', 5)
+    start_time = time.time()
+
+    # استخراج النص من الملف
+    text = get_file_text(job.file)
+
+    if not text or len(text.strip()) < 100:
+        raise AIJobError('لم نتمكن من استخراج نص كافٍ من هذا الملف.')
+
+    # توليد الأسئلة عبر Gemini API
+    cached_context = get_file_cached_context(job.file, text)
+    questions_json = generate_questions(text, difficulty, questions_count, cached_context=cached_context)
+
+    if not questions_json:
+        raise AIJobError('لم نتمكن من توليد أسئلة من هذا المحتوى. جرب ملفاً آخر.')
+
+    # إضافة الأسئلة لبنك الملف وتسجيلها كمسحوبة للطالب
+    record_draws(job.user, add_questions_to_bank(job.file, difficulty, questions_json))
+
+    processing_time = time.time() - start_time
+
+    # حفظ الأسئلة في قاعدة البيانات
+    ai_questions = AIQuestion.objects.create(
+        file=job.file,
+        user=job.user,
+        difficulty=difficulty,
+        questions_json=questions_json,
+        questions_count=len(questions_json),
+        processing_time=processing_time
+    )
+
+    # تسجيل النشاط في User_Activity
+    UserActivity.log(
+        user=job.user,
+        action=UserActivity.AI_QUESTIONS,
+        details={
+            'file_id': job.file_id,
+            'file_name': job.file.title,
+            'difficulty': difficulty,
+            'questions_id': ai_questions.id,
+            'job_id': job.id,
+            'questions_count': len(questions_json),
+            'processing_time': round(processing_time, 2)
+        }
+    )
+
+    logger.info(f"Questions generated for user {job.user.academic_id}, file {job.file_id}")
+    return ai_questions.id
+
+
+def run_question_bank_job(job):
+    """
+    تنفيذ مهمة ملء بنك الأسئلة لملف ومستوى صعوبة
+
+    Returns:
+        None: لا توجد نتيجة خاصة بمستخدم
+    """
+    difficulty = job.params.get('difficulty', 'medium')
+
+    text = get_file_text(job.file)
+
+    if not text or len(text.strip()) < 100:
+        raise AIJobError('لم نتمكن من استخراج نص كافٍ من هذا الملف.')
+
+    fill_bank(job.file, difficulty, text)
+    return None
+
+
+def run_prepare_file_job(job):
+    """
+    تنفيذ مهمة تجهيز نص ملف بعد رفعه ثم جدولة ملء بنك الأسئلة
+
+    Returns:
+        None: لا توجد نتيجة خاصة بمستخدم
+    """
+    if not process_lecture_file(job.file):
+        raise AIJobError(job.file.processing_error or 'لم نتمكن من استخراج نص من هذا الملف.')
+
+    for difficulty in getattr(settings, 'AI_QUESTION_BANK_PREFILL', []):
+        schedule_bank_fill(job.user, job.file, difficulty)
+    return None
+
+
+def run_chat_summary_job(job):
+    """
+    تنفيذ مهمة دمج الأدوار القديمة في ملخص جلسة المحادثة
+
+    Returns:
+        int: معرف الجلسة
+    """
+    conversation = AIConversation.objects.filter(pk=job.params.get('conversation_id')).first()
+
+    if conversation is None:
+        raise AIJobError('جلسة المحادثة غير موجودة.')
+
+    refresh_summary(conversation)
+    return conversation.pk
+
+
+def run_study_pack_job(job):
+    """
+    تنفيذ مهمة حزمة المذاكرة: الملخصات الثلاثة (وأسئلة اختيارية) بطلب واحد
+
+    إذا كانت الملخصات الثلاثة مشتركة مسبقاً ولا أسئلة مطلوبة لا يُرسل أي طلب.
+    القسم الناقص من الرد يُولد وحده بطلب ملخص عادي.
+    معرفات النتائج تُحفظ في job.params['results'].
+
+    Returns:
+        int: معرف أول ملخص (الموجز)
+    """
+    language = job.params.get('language', 'ar')
+    questions_count = job.params.get('questions_count', 0)
+    difficulty = job.params.get('difficulty', 'medium')
+    start_time = time.time()
+
+    shared = {
+        summary_type: SharedSummary.for_file(job.file, summary_type, language)
+        for summary_type in STUDY_PACK_SUMMARY_TYPES
+    }
+    for reused in filter(None, shared.values()):
+        reused.record_hit()
+    pack = {'questions': []}
+
+    if questions_count or not all(shared.values()):
+        text = get_file_text(job.file)
+
+        if not text or len(text.strip()) < 100:
+            raise AIJobError('لم نتمكن من استخراج نص كافٍ من هذا الملف.')
+
+        cached_context = get_file_cached_context(job.file, text, create=False)
+        pack = generate_study_pack(text, language, questions_count, difficulty, cached_context)
+
+        for summary_type in STUDY_PACK_SUMMARY_TYPES:
+            if shared[summary_type]:
+                continue
+            summary_text = pack.get(summary_type)
+            if not summary_text:
+                logger.warning(f"Study pack for file {job.file_id} missing {summary_type}, generating separately")
+                summary_text = generate_summary(text, summary_type, language, cached_context)
+            shared[summary_type] = SharedSummary.store(job.file, summary_type, language, summary_text)
+
+    processing_time = time.time() - start_time
+
+    summaries = []
+    for summary_type in STUDY_PACK_SUMMARY_TYPES:
+        summaries.append(shared[summary_type].create_user_summary(job.user, job.file, processing_time))
+
+    ai_questions = None
+    questions_json = pack['questions']
+    if questions_json:
+        record_draws(job.user, add_questions_to_bank(job.file, difficulty, questions_json))
+        ai_questions = AIQuestion.objects.create(
+            file=job.file,
+            user=job.user,
+            difficulty=difficulty,
+            questions_json=questions_json,
+            questions_count=len(questions_json),
+            processing_time=processing_time
+        )
+
+    job.params['results'] = {
+        'summary_ids': [summary.id for summary in summaries],
+        'questions_id': ai_questions.id if ai_questions else None,
+    }
+    job.save(update_fields=['params'])
+
+    # تسجيل النشاط في User_Activity
+    UserActivity.log(
+        user=job.user,
+        action=UserActivity.AI_SUMMARY,
+        details={
+            'file_id': job.file_id,
+            'file_name': job.file.title,
+            'summary_type': 'study_pack',
+            'summary_ids': job.params['results']['summary_ids'],
+            'questions_id': job.params['results']['questions_id'],
+            'job_id': job.id,
+            'processing_time': round(processing_time, 2)
+        }
+    )
+
+    logger.info(f"Study pack generated for user {job.user.academic_id}, file {job.file_id}")
+    return summaries[0].id
+
+
+JOB_HANDLERS = {
+    AIJob.SUMMARY: run_summary_job,
+    AIJob.QUESTIONS: run_questions_job,
+    AIJob.QUESTION_BANK: run_question_bank_job,
+    AIJob.CHAT_SUMMARY: run_chat_summary_job,
+    AIJob.STUDY_PACK: run_study_pack_job,
+    AIJob.PREPARE_FILE: run_prepare_file_job,
+}
+
+
+# ==================== تشغيل المهام ====================
+
+def run_job(job):
+    """
+    تنفيذ مهمة محجوزة وتسجيل نتيجتها
+
+    Args:
+        job: مهمة بحالة running
+
+    Returns:
+        AIJob: المهمة بعد تحديث حالتها
+    """
+    handler = JOB_HANDLERS.get(job.job_type)
+
+    if handler is None:
+        job.mark_failed(f'نوع مهمة غير معروف: {job.job_type}')
+        return job
+
+    try:
+        with ai_caller(job.user_id), usage_scope(job.job_type, job.file_id):
+            result_id = handler(job)
+    except AIJobError as e:
+        job.mark_failed(e)
+    except Exception as e:
+        logger.error(f"AI job {job.id} ({job.job_type}) error: {str(e)}")
+        job.mark_failed(f'حدث خطأ: {str(e)}')
+    else:
+        job.mark_done(result_id)
+
+    return job
+
+
+def enqueue_job(job_type, user, lecture_file, **params):
+    """
+    إضافة مهمة جديدة لقائمة الانتظار
+
+    إذا كانت قائمة الانتظار معطلة (AI_JOB_QUEUE_ENABLED = False)
+    تُنفذ المهمة فوراً داخل الطلب كما في السابق.
+
+    Returns:
+        AIJob: المهمة المُنشأة
+    """
+    job = AIJob.objects.create(
+        job_type=job_type,
+        user=user,
+        file=lecture_file,
+        params=params,
+    )
+
+    if not getattr(settings, 'AI_JOB_QUEUE_ENABLED', False):
+        job.status = AIJob.RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+        run_job(job)
+
+    return job
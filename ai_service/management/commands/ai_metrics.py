@@ -0,0 +1,36 @@
+"""
+عرض مقاييس طلبات Gemini
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+الاستخدام:
+    python manage.py ai_metrics
+    python manage.py ai_metrics --reset
+"""
+
+from django.core.management.base import BaseCommand
+
+from ai_service.concurrency import get_queue_stats
+from ai_service.resilience import get_resilience_metrics, reset_resilience_metrics
+
+
+class Command(BaseCommand):
+    help = 'عرض عدادات إعادة المحاولة والنماذج البديلة والطلبات المتحوطة وحالة قائمة الانتظار'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='تصفير العدادات بعد عرضها'
+        )
+
+    def handle(self, *args, **options):
+        queue = get_queue_stats()
+        self.stdout.write(
+            f"الطلبات الجارية: {queue['in_flight']}/{queue['capacity']}  |  في الانتظار: {queue['waiting']}"
+        )
+
+        for name, value in get_resilience_metrics().items():
+            self.stdout.write(f'{name:<24} {value}')
+
+        if options['reset']:
+            reset_resilience_metrics()
+            self.stdout.write(self.style.SUCCESS('تم تصفير العدادات'))
@@ -0,0 +1,314 @@
+"""
+تلخيص محاضرات الفصل مسبقاً في الملخصات المشتركة
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+يمر على ملفات المحاضرات لمقررات الفصل (الحالي افتراضياً) مرتبة بالمقرر:
+- استخراج النصوص في عمليات معزولة (--extract-workers) بحدود الزمن والذاكرة نفسها
+  التي تطبق على عوامل الويب (ExtractionPool)
+- توليد الملخصات في خيوط (--concurrency) عبر generate_content، فتمر بحد الطلبات
+  المتزامنة المشترك (مجموعة "system")، ولا تأخذ أماكن الطلاب
+- الأنواع الثلاثة تُولد بطلب واحد (حزمة مذاكرة) وتُحفظ في SharedSummary
+- كل ملف مكتمل يُسجل في ملف نقطة استئناف، فإعادة التشغيل بعد انقطاع تكمل من حيث توقفت
+- يُطبع معدل الإنجاز والوقت المتبقي المتوقع بعد كل ملف
+
+الاستخدام:
+    python manage.py ai_precompute
+    python manage.py ai_precompute --semester 3 --course CS101 --course CS102
+    python manage.py ai_precompute --types brief key_points --language en
+    python manage.py ai_precompute --restart   (تجاهل نقطة الاستئناف)
+"""
+
+import os
+import json
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from core.models import Semester, LectureFile
+from ai_service.models import SharedSummary
+from ai_service.metering import usage_scope
+from ai_service.structured import STUDY_PACK_SUMMARY_TYPES
+from ai_service.extraction_pool import ExtractionPool, ExtractionError
+from ai_service.text_extractor import get_file_hash, get_stored_text, store_extracted_text
+from ai_service.utils import generate_summary, generate_study_pack, SUMMARY_LANGUAGE_INSTRUCTIONS
+
+MIN_TEXT_LENGTH = 50
+
+
+def _summarize(lecture_file, text, summary_types, language):
+    """
+    توليد الأنواع الناقصة لملف وحفظها في الملخصات المشتركة (في خيط)
+
+    Returns:
+        int: عدد الملخصات المولدة
+    """
+    try:
+        with usage_scope('precompute', lecture_file):
+            missing = [
+                summary_type for summary_type in summary_types
+                if not SharedSummary.for_file(lecture_file, summary_type, language)
+            ]
+
+            pack = {}
+            if len(missing) > 1 and set(missing) <= set(STUDY_PACK_SUMMARY_TYPES):
+                pack = generate_study_pack(text, language)
+
+            for summary_type in missing:
+                summary_text = pack.get(summary_type) or generate_summary(text, summary_type, language)
+                SharedSummary.store(lecture_file, summary_type, language, summary_text)
+
+        return len(missing)
+    finally:
+        close_old_connections()
+
+
+class Checkpoint:
+    """نقطة استئناف في ملف JSON: الملفات المكتملة والفاشلة لتشغيل (فصل، لغة، أنواع)"""
+
+    def __init__(self, path, semester_id, language, summary_types):
+        self.path = Path(path)
+        self.key = {'semester': semester_id, 'language': language, 'summary_types': sorted(summary_types)}
+        self.done = set()
+        self.failed = {}
+
+    def load(self):
+        """
+        Returns:
+            bool: True إذا وُجدت نقطة استئناف لنفس التشغيل
+        """
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return False
+        if data.get('key') != self.key:
+            return False
+        self.done = set(data.get('done', []))
+        self.failed = {int(pk): error for pk, error in data.get('failed', {}).items()}
+        return True
+
+    def save(self):
+        """كتابة ذرية (ملف مؤقت ثم استبدال) حتى لا يتلف الملف عند الانقطاع"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_suffix('.tmp')
+        temp_path.write_text(json.dumps({
+            'key': self.key,
+            'done': sorted(self.done),
+            'failed': self.failed,
+            'updated_at': timezone.now().isoformat(),
+        }, ensure_ascii=False), encoding='utf-8')
+        os.replace(temp_path, self.path)
+
+    def mark_done(self, file_id):
+        self.done.add(file_id)
+        self.failed.pop(file_id, None)
+        self.save()
+
+    def mark_failed(self, file_id, error):
+        self.failed[file_id] = str(error)[:255]
+        self.save()
+
+
+class Command(BaseCommand):
+    help = 'تلخيص محاضرات الفصل مسبقاً في الملخصات المشتركة (مع نقاط استئناف)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--semester', type=int,
+            help='معرف الفصل الدراسي (الافتراضي: الفصل الحالي)'
+        )
+        parser.add_argument(
+            '--course', action='append', default=[],
+            help='رمز مقرر محدد (يمكن تكراره)'
+        )
+        parser.add_argument(
+            '--types', nargs='+', default=STUDY_PACK_SUMMARY_TYPES, choices=STUDY_PACK_SUMMARY_TYPES,
+            help='أنواع الملخص المطلوبة'
+        )
+        parser.add_argument(
+            '--language', default='ar', choices=list(SUMMARY_LANGUAGE_INSTRUCTIONS),
+            help='لغة الملخصات'
+        )
+        parser.add_argument(
+            '--extract-workers', type=int, default=os.cpu_count() or 2,
+            help='عدد عمليات استخراج النصوص'
+        )
+        parser.add_argument(
+            '--concurrency', type=int,
+            default=getattr(settings, 'AI_WORKER_CONCURRENCY', 4),
+            help='عدد الملفات التي تُلخص في نفس الوقت'
+        )
+        parser.add_argument(
+            '--limit', type=int, default=0,
+            help='أقصى عدد من الملفات في هذا التشغيل (0 = الكل)'
+        )
+        parser.add_argument(
+            '--checkpoint', type=str,
+            help='مسار ملف نقطة الاستئناف'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='تجاهل نقطة الاستئناف والبدء من جديد'
+        )
+
+    def handle(self, *args, **options):
+        semester = self.get_semester(options['semester'])
+        language = options['language']
+        summary_types = list(dict.fromkeys(options['types']))
+
+        checkpoint_path = options['checkpoint'] or (
+            Path(getattr(settings, 'AI_PRECOMPUTE_DIR', settings.BASE_DIR / 'ai_precompute'))
+            / f'semester-{semester.pk}-{language}.json'
+        )
+        checkpoint = Checkpoint(checkpoint_path, semester.pk, language, summary_types)
+        if not options['restart'] and checkpoint.load():
+            self.stdout.write(self.style.WARNING(
+                f'استئناف من {checkpoint.path} ({len(checkpoint.done)} ملف مكتمل، {len(checkpoint.failed)} فاشل)'
+            ))
+
+        files = LectureFile.objects.filter(
+            course__semester=semester,
+            content_type='local_file',
+            is_deleted=False,
+        ).exclude(file='').exclude(file__isnull=True).select_related('course').order_by('course__code', 'id')
+        if options['course']:
+            files = files.filter(course__code__in=options['course'])
+
+        files = [lecture_file for lecture_file in files if lecture_file.pk not in checkpoint.done]
+        if options['limit'] > 0:
+            files = files[:options['limit']]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'🤖 تلخيص {len(files)} ملف من {semester} ({", ".join(summary_types)} / {language})'
+        ))
+        if not files:
+            return
+
+        self.total = len(files)
+        self.completed = 0
+        self.generated = 0
+        self.started = time.monotonic()
+
+        try:
+            self.run(files, checkpoint, summary_types, language, options)
+        except KeyboardInterrupt:
+            checkpoint.save()
+            self.stdout.write(self.style.WARNING(
+                f'⏹ توقف - أعد تشغيل الأمر للاستئناف ({len(checkpoint.done)} ملف مكتمل)'
+            ))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✔ اكتمل: {self.completed} ملف، {self.generated} ملخص جديد، '
+            f'{len(checkpoint.failed)} فاشل، خلال {self.format_duration(time.monotonic() - self.started)}'
+        ))
+
+    def get_semester(self, semester_id):
+        if semester_id:
+            semester = Semester.objects.filter(pk=semester_id).first()
+        else:
+            semester = Semester.objects.filter(is_current=True).first()
+        if semester is None:
+            raise CommandError('لم يُعثر على الفصل الدراسي (حدد --semester)')
+        return semester
+
+    def run(self, files, checkpoint, summary_types, language, options):
+        """خط المعالجة: الاستخراج في عمليات معزولة ثم التوليد في خيوط"""
+        extract_workers = max(options['extract_workers'], 1)
+        extraction = ExtractionPool.from_settings(workers=extract_workers)
+        extract_pool = ThreadPoolExecutor(max_workers=extract_workers)
+        generate_pool = ThreadPoolExecutor(max_workers=max(options['concurrency'], 1))
+        extracting = {}
+        generating = {}
+
+        try:
+            for lecture_file in files:
+                try:
+                    content_hash = get_file_hash(lecture_file)
+                except (OSError, ValueError) as e:
+                    self.record(checkpoint, lecture_file, error=f'تعذرت قراءة الملف: {e}')
+                    continue
+
+                if all(SharedSummary.for_file(lecture_file, t, language) for t in summary_types):
+                    self.record(checkpoint, lecture_file, generated=0)
+                    continue
+
+                text = get_stored_text(content_hash)
+                if text is None:
+                    future = extract_pool.submit(
+                        extraction.extract, lecture_file.file.path, lecture_file.get_file_extension()
+                    )
+                    extracting[future] = (lecture_file, content_hash)
+                else:
+                    generating[self.submit(generate_pool, lecture_file, text, summary_types, language)] = lecture_file
+
+            while extracting or generating:
+                done, _ = wait(set(extracting) | set(generating), return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    if future in extracting:
+                        lecture_file, content_hash = extracting.pop(future)
+                        try:
+                            text, page_offsets, extraction_time = future.result()
+                        except ExtractionError as e:
+                            self.record(checkpoint, lecture_file, error=f'فشل الاستخراج ({e.code}): {e.message}')
+                            continue
+
+                        if not text or len(text.strip()) < MIN_TEXT_LENGTH:
+                            self.record(checkpoint, lecture_file, error='لا يوجد نص كافٍ في الملف')
+                            continue
+
+                        store_extracted_text(content_hash, text, extraction_time, page_offsets)
+                        generating[self.submit(generate_pool, lecture_file, text, summary_types, language)] = lecture_file
+                    else:
+                        lecture_file = generating.pop(future)
+                        try:
+                            generated = future.result()
+                        except Exception as e:
+                            self.record(checkpoint, lecture_file, error=e)
+                        else:
+                            self.record(checkpoint, lecture_file, generated=generated)
+        finally:
+            extract_pool.shutdown(wait=False, cancel_futures=True)
+            generate_pool.shutdown(wait=False, cancel_futures=True)
+            extraction.shutdown()
+
+    def submit(self, pool, lecture_file, text, summary_types, language):
+        if len(text.strip()) < MIN_TEXT_LENGTH:
+            # نتيجة فورية بنفس مسار الأخطاء
+            return pool.submit(self._raise, 'لا يوجد نص كافٍ في الملف')
+        return pool.submit(_summarize, lecture_file, text, summary_types, language)
+
+    @staticmethod
+    def _raise(message):
+        raise ValueError(message)
+
+    def record(self, checkpoint, lecture_file, generated=0, error=None):
+        """تسجيل نتيجة ملف في نقطة الاستئناف وطباعة التقدم"""
+        self.completed += 1
+        elapsed = time.monotonic() - self.started
+        rate = self.completed / elapsed if elapsed > 0 else 0
+        eta = (self.total - self.completed) / rate if rate else 0
+        progress = (
+            f'[{self.completed}/{self.total}] {lecture_file.course.code} • {lecture_file.title[:40]}'
+        )
+        stats = f'{rate * 60:.1f} ملف/دقيقة، المتبقي ~{self.format_duration(eta)}'
+
+        if error is not None:
+            checkpoint.mark_failed(lecture_file.pk, error)
+            self.stdout.write(self.style.ERROR(f'{progress}: ✘ {error} ({stats})'))
+            return
+
+        checkpoint.mark_done(lecture_file.pk)
+        self.generated += generated
+        result = f'{generated} ملخص جديد' if generated else 'موجود مسبقاً'
+        self.stdout.write(f'{progress}: {result} ({stats})')
+
+    @staticmethod
+    def format_duration(seconds):
+        seconds = int(seconds)
+        return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
@@ -0,0 +1,47 @@
+"""
+تحديد حالة تجهيز الملفات المرفوعة قبل تفعيل التجهيز عند الرفع
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+الملفات القديمة تبقى بحالة "في الانتظار" لأنها لم تمر بمسار الرفع الجديد.
+الأمر يمر عليها: ما استُخرج نصه من قبل (ExtractedText لنفس البصمة) يُعلم
+بأنه جاهز فوراً، والروابط والامتدادات غير المدعومة تُعلم بأنها لا تحتاج
+معالجة، والباقي تُجدول له مهمة تجهيز (أو يُجهز فوراً إذا عُطلت قائمة الانتظار).
+
+الاستخدام:
+    python manage.py ai_prepare_files
+    python manage.py ai_prepare_files --retry-failed
+"""
+
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from core.models import LectureFile
+from ai_service.pipeline import prepare_existing_file
+
+
+class Command(BaseCommand):
+    help = 'تحديد حالة تجهيز الملفات التي ما زالت في الانتظار (وجدولة ما لم يُستخرج نصه)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='إعادة تجهيز الملفات التي فشل تجهيزها أيضاً'
+        )
+
+    def handle(self, *args, **options):
+        statuses = [LectureFile.PROCESSING_PENDING]
+        if options['retry_failed']:
+            statuses.append(LectureFile.PROCESSING_FAILED)
+
+        files = LectureFile.objects.filter(
+            is_deleted=False, processing_status__in=statuses
+        ).select_related('uploader').order_by('pk')
+
+        counts = Counter()
+        for lecture_file in files.iterator():
+            prepare_existing_file(lecture_file)
+            counts[lecture_file.get_processing_status_display()] += 1
+
+        summary = '، '.join(f'{label}: {count}' for label, count in counts.items()) or 'لا توجد ملفات'
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,30 @@
+"""
+حذف سجلات حدود استخدام AI القديمة
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+الاستخدام:
+    python manage.py ai_prune_rate_limits
+    python manage.py ai_prune_rate_limits --days 7
+"""
+
+from django.core.management.base import BaseCommand
+
+from ai_service.rate_limit import prune
+
+
+class Command(BaseCommand):
+    help = 'حذف صفوف AIRateLimit الأقدم من المدة المحددة (العدادات الحالية في الذاكرة المؤقتة)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=30,
+            help='الاحتفاظ بسجلات آخر N يوم'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='عدد الصفوف المحذوفة في كل دفعة'
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune(options['days'] * 86400, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'تم حذف {deleted} سجل'))
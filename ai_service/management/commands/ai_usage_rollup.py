@@ -0,0 +1,62 @@
+"""
+تجميع استهلاك AI اليومي (AIUsage -> AIUsageDaily)
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+الاستخدام:
+    python manage.py ai_usage_rollup                  # أمس واليوم
+    python manage.py ai_usage_rollup --days 30
+    python manage.py ai_usage_rollup --date 2025-01-15
+    python manage.py ai_usage_rollup --keep-days 90   # حذف صفوف AIUsage الأقدم بعد التجميع
+"""
+
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ai_service.models import AIUsage
+from ai_service.metering import rollup_day
+
+
+class Command(BaseCommand):
+    help = 'تجميع صفوف AIUsage في AIUsageDaily لكل (يوم، ميزة، نموذج) مع التكلفة التقديرية'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date', type=str,
+            help='تجميع يوم محدد (YYYY-MM-DD)'
+        )
+        parser.add_argument(
+            '--days', type=int, default=2,
+            help='تجميع آخر N يوم بما فيها اليوم'
+        )
+        parser.add_argument(
+            '--keep-days', type=int, default=0,
+            help='حذف صفوف AIUsage الأقدم من N يوم بعد تجميعها (0 = عدم الحذف)'
+        )
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                days = [date.fromisoformat(options['date'])]
+            except ValueError:
+                raise CommandError('صيغة التاريخ يجب أن تكون YYYY-MM-DD')
+        else:
+            today = timezone.localdate()
+            days = [today - timedelta(days=offset) for offset in range(max(options['days'], 1))]
+
+        for day in sorted(days):
+            count = rollup_day(day)
+            self.stdout.write(f'{day}: {count} صف')
+
+        if options['keep_days'] > 0:
+            # الحذف بأيام كاملة، وبعد تجميعها حتى لا يضيع استهلاكها
+            old_rows = AIUsage.objects.filter(
+                created_at__date__lt=timezone.localdate() - timedelta(days=options['keep_days'])
+            )
+            for day in old_rows.dates('created_at', 'day'):
+                rollup_day(day)
+            deleted = old_rows.delete()[0]
+            self.stdout.write(f'تم حذف {deleted} صف من AIUsage')
+
+        self.stdout.write(self.style.SUCCESS('تم التجميع'))
@@ -0,0 +1,85 @@
+"""
+عامل تنفيذ مهام AI في الخلفية
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+الاستخدام:
+    python manage.py ai_worker
+    python manage.py ai_worker --concurrency 8
+    python manage.py ai_worker --once   (تنفيذ المهام المعلقة ثم الخروج)
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ai_service.models import AIJob
+from ai_service.jobs import run_job
+
+
+def _run_in_thread(job):
+    """تنفيذ مهمة في خيط منفصل مع إغلاق اتصالات قاعدة البيانات بعدها"""
+    try:
+        return run_job(job)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'تنفيذ مهام AI المعلقة (التلخيص وتوليد الأسئلة) بالتوازي'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int,
+            default=getattr(settings, 'AI_WORKER_CONCURRENCY', 4),
+            help='عدد المهام المنفذة في نفس الوقت'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='الفترة بالثواني بين فحص المهام الجديدة'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='تنفيذ المهام المعلقة الحالية ثم الخروج'
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(options['concurrency'], 1)
+        poll_interval = options['poll_interval']
+
+        requeued = AIJob.requeue_stale(getattr(settings, 'AI_JOB_STALE_AFTER', 600))
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'أُعيدت {requeued} مهمة عالقة إلى الانتظار'))
+
+        self.stdout.write(self.style.SUCCESS(f'🤖 عامل AI يعمل ({concurrency} مهام متزامنة)'))
+
+        in_flight = set()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            try:
+                while True:
+                    # حجز مهام جديدة حتى امتلاء الخيوط المتاحة
+                    while len(in_flight) < concurrency:
+                        job = AIJob.claim_next()
+                        if job is None:
+                            break
+                        self.stdout.write(f'▶ {job}')
+                        in_flight.add(executor.submit(_run_in_thread, job))
+
+                    if not in_flight:
+                        if options['once']:
+                            break
+                        time.sleep(poll_interval)
+                        continue
+
+                    done, in_flight = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                    in_flight = set(in_flight)
+
+                    for future in done:
+                        job = future.result()
+                        style = self.style.SUCCESS if job.status == AIJob.DONE else self.style.ERROR
+                        self.stdout.write(style(f'✔ {job}'))
+            except KeyboardInterrupt:
+                self.stdout.write(self.style.WARNING('⏹ إيقاف العامل بعد إنهاء المهام الجارية...'))
@@ -0,0 +1,339 @@
+"""
+قياس استهلاك Gemini (AIUsage)
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+- usage_scope: الميزة والملف اللذان تُنسب لهما طلبات الكتلة (تُعيَّن في المهام والعروض)
+- meter_call: يُغلف كل طلب صادر في utils ويكتب صف AIUsage واحداً عند انتهائه
+  بعدد التوكنات ووقت الانتظار في قائمة التزامن وزمن النموذج والنتيجة ورقم المحاولة
+  (ameter_call للطلبات غير المتزامنة)
+- وقت استخراج نص الملف يُسجل مع أول طلب في الكتلة (note_extraction_time)
+- rollup_day يجمع صفوف يوم في AIUsageDaily مع التكلفة التقديرية (AI_MODEL_PRICING)
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from decimal import Decimal
+from dataclasses import dataclass
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum, Max, Q
+
+from .prompt_budget import estimate_tokens
+
+# إعداد التسجيل
+logger = logging.getLogger(__name__)
+
+DEFAULT_FEATURE = 'other'
+
+# أسعار تقريبية بالدولار لكل مليون توكن
+DEFAULT_MODEL_PRICING = {
+    'gemini-1.5-flash': {'input': 0.075, 'cached': 0.01875, 'output': 0.30},
+    'gemini-1.5-flash-8b': {'input': 0.0375, 'cached': 0.01, 'output': 0.15},
+    'gemini-1.5-pro': {'input': 1.25, 'cached': 0.3125, 'output': 5.00},
+}
+
+_current_scope = ContextVar('ai_usage_scope', default=None)
+_current_meter = ContextVar('ai_usage_meter', default=None)
+
+_extraction_lock = threading.Lock()
+
+
+def is_enabled():
+    return getattr(settings, 'AI_USAGE_METERING_ENABLED', True)
+
+
+# ==================== نطاق الاستخدام ====================
+
+@dataclass
+class UsageScope:
+    feature: str
+    file_id: int = None
+    extraction_time: float = 0.0
+
+    def take_extraction_time(self):
+        """وقت الاستخراج يُنسب لأول طلب فقط حتى لا يتكرر في التجميع"""
+        with _extraction_lock:
+            seconds, self.extraction_time = self.extraction_time, 0.0
+        return seconds
+
+
+@contextmanager
+def usage_scope(feature, lecture_file=None):
+    """
+    نسب طلبات Gemini داخل الكتلة لميزة وملف
+
+    Example:
+        with usage_scope('chat') as scope:
+            scope.file_id = lecture_file.pk
+    """
+    scope = UsageScope(feature=feature, file_id=getattr(lecture_file, 'pk', lecture_file))
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+@contextmanager
+def use_scope(scope):
+    """متابعة نطاق موجود في خيط آخر (الخيوط لا ترث ContextVar)"""
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+def current_scope():
+    return _current_scope.get()
+
+
+def note_extraction_time(seconds):
+    """إضافة وقت استخراج نص الملف للنطاق الحالي"""
+    scope = _current_scope.get()
+    if scope is not None:
+        with _extraction_lock:
+            scope.extraction_time += seconds
+
+
+# ==================== قياس الطلب ====================
+
+class CallMeter:
+    """قياسات طلب واحد للنموذج"""
+
+    def __init__(self, model_name, prompt, retry_count=0):
+        from .concurrency import current_caller
+
+        # يُحفظ النطاق وصاحب الطلب عند البدء: البث قد يُغلق في خيط آخر
+        self.scope = _current_scope.get() or UsageScope(feature=DEFAULT_FEATURE)
+        self.user_id = current_caller()
+        self.model_name = model_name
+        self.prompt = prompt
+        self.retry_count = retry_count
+        self.started = time.monotonic()
+        self.slot_acquired_at = None
+        self.prompt_tokens = None
+        self.cached_tokens = 0
+        self.response_tokens = None
+        self.estimated_response_tokens = 0
+
+    def slot_acquired(self):
+        self.slot_acquired_at = time.monotonic()
+
+    def add_response(self, text):
+        self.estimated_response_tokens += estimate_tokens(text)
+
+    def report_usage_metadata(self, usage):
+        """عدد التوكنات الفعلي من usage_metadata في رد Gemini"""
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, 'prompt_token_count', None)
+        if prompt_tokens is not None:
+            self.prompt_tokens = prompt_tokens
+        self.cached_tokens = getattr(usage, 'cached_content_token_count', None) or 0
+        response_tokens = getattr(usage, 'candidates_token_count', None)
+        if response_tokens is not None:
+            self.response_tokens = response_tokens
+
+    def finish(self, outcome, error=None):
+        """كتابة صف AIUsage (فشل الكتابة لا يؤثر على الطلب)"""
+        from .models import AIUsage
+
+        now = time.monotonic()
+        acquired = self.slot_acquired_at or now
+        scope = self.scope
+
+        try:
+            AIUsage.objects.create(
+                user_id=self.user_id,
+                file_id=scope.file_id,
+                feature=scope.feature,
+                model_name=self.model_name,
+                prompt_tokens=self.prompt_tokens if self.prompt_tokens is not None else estimate_tokens(self.prompt),
+                cached_tokens=self.cached_tokens,
+                response_tokens=(
+                    self.response_tokens if self.response_tokens is not None else self.estimated_response_tokens
+                ),
+                queue_time=acquired - self.started,
+                extraction_time=scope.take_extraction_time(),
+                latency=now - acquired,
+                outcome=outcome,
+                error=str(error)[:255] if error is not None else '',
+                retry_count=self.retry_count,
+            )
+        except Exception as e:
+            logger.warning(f"AI usage record failed: {str(e)}")
+
+
+def _outcome_for(error):
+    from .models import AIUsage
+    from .concurrency import AIServiceBusy
+
+    if isinstance(error, AIServiceBusy):
+        return AIUsage.BUSY
+    if isinstance(error, (GeneratorExit, asyncio.CancelledError)):
+        return AIUsage.CANCELLED
+    return AIUsage.ERROR
+
+
+@contextmanager
+def meter_call(model_name, prompt):
+    """
+    قياس طلب واحد للنموذج وتسجيله في AIUsage عند انتهاء الكتلة
+
+    Yields:
+        CallMeter: القياس (لا يُسجل إذا كان AI_USAGE_METERING_ENABLED = False)
+    """
+    from .models import AIUsage
+    from .resilience import current_attempt
+
+    meter = CallMeter(model_name, prompt, retry_count=current_attempt())
+    enabled = is_enabled()
+    try:
+        yield meter
+    except BaseException as e:
+        if enabled:
+            meter.finish(_outcome_for(e), None if isinstance(e, GeneratorExit) else e)
+        raise
+    else:
+        if enabled:
+            meter.finish(AIUsage.SUCCESS)
+
+
+@asynccontextmanager
+async def ameter_call(model_name, prompt):
+    """نسخة meter_call للطلبات غير المتزامنة (كتابة الصف في خيط منفصل)"""
+    from .models import AIUsage
+    from .resilience import current_attempt
+
+    meter = CallMeter(model_name, prompt, retry_count=current_attempt())
+    enabled = is_enabled()
+    try:
+        yield meter
+    except BaseException as e:
+        if enabled:
+            cancelled = isinstance(e, (GeneratorExit, asyncio.CancelledError))
+            await sync_to_async(meter.finish)(_outcome_for(e), None if cancelled else e)
+        raise
+    else:
+        if enabled:
+            await sync_to_async(meter.finish)(AIUsage.SUCCESS)
+
+
+@contextmanager
+def bind_meter(meter):
+    """
+    إتاحة القياس للواجهة (backend) أثناء الكتلة
+
+    لا يُستخدم عبر yield داخل مولد، لأن البث قد يُستأنف في سياق آخر
+    (مثل الطلبات المتحوطة)؛ الواجهة تحتفظ بمرجع القياس من أول جزء.
+    """
+    token = _current_meter.set(meter)
+    try:
+        yield
+    finally:
+        _current_meter.reset(token)
+
+
+def current_meter():
+    return _current_meter.get()
+
+
+def report_usage_metadata(usage, meter=None):
+    """تمرير usage_metadata من رد Gemini للقياس الحالي"""
+    meter = meter or _current_meter.get()
+    if meter is not None:
+        meter.report_usage_metadata(usage)
+
+
+# ==================== التجميع اليومي ====================
+
+def get_model_pricing(model_name):
+    pricing = {**DEFAULT_MODEL_PRICING, **getattr(settings, 'AI_MODEL_PRICING', {})}
+    return pricing.get(model_name)
+
+
+def estimate_cost(model_name, prompt_tokens, cached_tokens, response_tokens):
+    """
+    التكلفة التقديرية بالدولار
+
+    توكنات ذاكرة السياق ضمن prompt_tokens وتُحسب بسعرها المخفض.
+    """
+    pricing = get_model_pricing(model_name)
+    if not pricing:
+        return Decimal(0)
+
+    cached_tokens = min(cached_tokens, prompt_tokens)
+    cost = (
+        (prompt_tokens - cached_tokens) * pricing.get('input', 0)
+        + cached_tokens * pricing.get('cached', pricing.get('input', 0))
+        + response_tokens * pricing.get('output', 0)
+    ) / 1_000_000
+    return Decimal(str(round(cost, 6)))
+
+
+def aggregate_usage(queryset):
+    """
+    تجميع صفوف AIUsage لكل (ميزة، نموذج)
+
+    Returns:
+        QuerySet: قواميس بالمجاميع
+    """
+    from .models import AIUsage
+
+    return (
+        queryset.values('feature', 'model_name')
+        .annotate(
+            calls=Count('id'),
+            errors=Count('id', filter=~Q(outcome=AIUsage.SUCCESS)),
+            retries=Count('id', filter=Q(retry_count__gt=0)),
+            prompt_tokens=Sum('prompt_tokens'),
+            cached_tokens=Sum('cached_tokens'),
+            response_tokens=Sum('response_tokens'),
+            total_queue_time=Sum('queue_time'),
+            total_extraction_time=Sum('extraction_time'),
+            total_latency=Sum('latency'),
+            max_latency=Max('latency'),
+        )
+        .order_by('feature', 'model_name')
+    )
+
+
+def rollup_day(day):
+    """
+    إعادة حساب صفوف AIUsageDaily ليوم واحد من AIUsage
+
+    يوم بلا صفوف (مثلاً بعد حذفها) يبقى تجميعه السابق كما هو.
+
+    Returns:
+        int: عدد صفوف (ميزة، نموذج) المكتوبة
+    """
+    from .models import AIUsage, AIUsageDaily
+
+    rows = list(aggregate_usage(AIUsage.objects.filter(created_at__date=day)))
+    if not rows:
+        return 0
+
+    with transaction.atomic():
+        AIUsageDaily.objects.filter(date=day).delete()
+        AIUsageDaily.objects.bulk_create([
+            AIUsageDaily(
+                date=day,
+                estimated_cost=estimate_cost(
+                    row['model_name'], row['prompt_tokens'] or 0, row['cached_tokens'] or 0,
+                    row['response_tokens'] or 0
+                ),
+                **{field: value or 0 for field, value in row.items() if field not in ('feature', 'model_name')},
+                feature=row['feature'],
+                model_name=row['model_name'],
+            )
+            for row in rows
+        ])
+
+    return len(rows)
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractedText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='بصمة المحتوى')),
+                ('extractor_version', models.PositiveIntegerField(default=1, verbose_name='نسخة المستخرج')),
+                ('text', models.TextField(verbose_name='النص المستخرج')),
+                ('char_count', models.PositiveIntegerField(default=0, verbose_name='عدد الأحرف')),
+                ('extraction_time', models.FloatField(default=0, verbose_name='وقت الاستخراج (ثانية)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الاستخراج')),
+            ],
+            options={
+                'verbose_name': 'نص مستخرج',
+                'verbose_name_plural': 'النصوص المستخرجة',
+                'ordering': ['-created_at'],
+                'unique_together': {('content_hash', 'extractor_version')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0003_aijob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SharedSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='بصمة المحتوى')),
+                ('summary_type', models.CharField(choices=[('brief', 'ملخص موجز'), ('detailed', 'ملخص تفصيلي'), ('key_points', 'نقاط رئيسية')], max_length=20, verbose_name='نوع الملخص')),
+                ('language', models.CharField(default='ar', max_length=5, verbose_name='اللغة')),
+                ('prompt_version', models.PositiveIntegerField(verbose_name='نسخة التعليمات')),
+                ('summary_text', models.TextField(verbose_name='نص الملخص')),
+                ('word_count', models.PositiveIntegerField(default=0, verbose_name='عدد الكلمات')),
+                ('hit_count', models.PositiveIntegerField(default=0, verbose_name='مرات الاستخدام')),
+                ('generated_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ التوليد')),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True, verbose_name='آخر استخدام')),
+            ],
+            options={
+                'verbose_name': 'ملخص مشترك',
+                'verbose_name_plural': 'الملخصات المشتركة',
+                'ordering': ['-generated_at'],
+                'unique_together': {('content_hash', 'summary_type', 'language', 'prompt_version')},
+            },
+        ),
+        migrations.AddField(
+            model_name='aisummary',
+            name='shared_summary',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='user_summaries', to='ai_service.sharedsummary', verbose_name='الملخص المشترك'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0004_sharedsummary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='aijob',
+            name='job_type',
+            field=models.CharField(choices=[('summary', 'توليد ملخص'), ('questions', 'توليد أسئلة'), ('question_bank', 'تعبئة بنك الأسئلة')], max_length=30, verbose_name='نوع المهمة'),
+        ),
+        migrations.CreateModel(
+            name='QuestionBankItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='بصمة المحتوى')),
+                ('difficulty', models.CharField(choices=[('easy', 'سهل'), ('medium', 'متوسط'), ('hard', 'صعب')], max_length=20, verbose_name='مستوى الصعوبة')),
+                ('question_json', models.JSONField(verbose_name='السؤال')),
+                ('question_hash', models.CharField(max_length=64, verbose_name='بصمة السؤال')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإضافة')),
+            ],
+            options={
+                'verbose_name': 'سؤال في البنك',
+                'verbose_name_plural': 'بنك الأسئلة',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='QuestionBankDraw',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('drawn_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ السحب')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='question_bank_draws', to=settings.AUTH_USER_MODEL, verbose_name='المستخدم')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='draws', to='ai_service.questionbankitem', verbose_name='السؤال')),
+            ],
+            options={
+                'verbose_name': 'سؤال مسحوب',
+                'verbose_name_plural': 'الأسئلة المسحوبة',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='questionbankitem',
+            index=models.Index(fields=['content_hash', 'difficulty'], name='ai_service__content_c49237_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='questionbankitem',
+            unique_together={('content_hash', 'difficulty', 'question_hash')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='questionbankdraw',
+            unique_together={('user', 'item')},
+        ),
+    ]
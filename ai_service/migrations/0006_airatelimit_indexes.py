@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0005_question_bank'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='airatelimit',
+            index=models.Index(fields=['user', 'request_type', 'request_time'], name='ai_service__user_id_ebf6d3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='airatelimit',
+            index=models.Index(fields=['request_time'], name='ai_service__request_6e3b12_idx'),
+        ),
+    ]
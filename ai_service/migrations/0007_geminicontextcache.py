@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0006_airatelimit_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeminiContextCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='بصمة المحتوى')),
+                ('model_name', models.CharField(max_length=100, verbose_name='النموذج')),
+                ('cache_name', models.CharField(max_length=255, verbose_name='اسم المرجع')),
+                ('token_count', models.PositiveIntegerField(default=0, verbose_name='عدد التوكنات (تقديري)')),
+                ('expires_at', models.DateTimeField(verbose_name='انتهاء الصلاحية')),
+                ('hit_count', models.PositiveIntegerField(default=0, verbose_name='مرات الاستخدام')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')),
+            ],
+            options={
+                'verbose_name': 'ذاكرة سياق Gemini',
+                'verbose_name_plural': 'ذاكرة سياق Gemini',
+                'ordering': ['-created_at'],
+                'unique_together': {('content_hash', 'model_name')},
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0007_geminicontextcache'),
+        ('core', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIUsageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='اليوم')),
+                ('feature', models.CharField(max_length=30, verbose_name='الميزة')),
+                ('model_name', models.CharField(max_length=100, verbose_name='النموذج')),
+                ('calls', models.PositiveIntegerField(default=0, verbose_name='عدد الطلبات')),
+                ('errors', models.PositiveIntegerField(default=0, verbose_name='الطلبات الفاشلة')),
+                ('retries', models.PositiveIntegerField(default=0, verbose_name='إعادة المحاولة')),
+                ('prompt_tokens', models.PositiveBigIntegerField(default=0, verbose_name='توكنات الطلب')),
+                ('cached_tokens', models.PositiveBigIntegerField(default=0, verbose_name='توكنات ذاكرة السياق')),
+                ('response_tokens', models.PositiveBigIntegerField(default=0, verbose_name='توكنات الرد')),
+                ('total_queue_time', models.FloatField(default=0, verbose_name='إجمالي الانتظار (ثانية)')),
+                ('total_extraction_time', models.FloatField(default=0, verbose_name='إجمالي الاستخراج (ثانية)')),
+                ('total_latency', models.FloatField(default=0, verbose_name='إجمالي زمن النموذج (ثانية)')),
+                ('max_latency', models.FloatField(default=0, verbose_name='أقصى زمن للنموذج (ثانية)')),
+                ('estimated_cost', models.DecimalField(decimal_places=6, default=0, max_digits=12, verbose_name='التكلفة التقديرية ($)')),
+            ],
+            options={
+                'verbose_name': 'استهلاك AI اليومي',
+                'verbose_name_plural': 'استهلاك AI اليومي',
+                'ordering': ['-date', 'feature'],
+                'unique_together': {('date', 'feature', 'model_name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='AIUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feature', models.CharField(max_length=30, verbose_name='الميزة')),
+                ('model_name', models.CharField(max_length=100, verbose_name='النموذج')),
+                ('prompt_tokens', models.PositiveIntegerField(default=0, verbose_name='توكنات الطلب')),
+                ('cached_tokens', models.PositiveIntegerField(default=0, verbose_name='توكنات ذاكرة السياق')),
+                ('response_tokens', models.PositiveIntegerField(default=0, verbose_name='توكنات الرد')),
+                ('queue_time', models.FloatField(default=0, verbose_name='وقت الانتظار (ثانية)')),
+                ('extraction_time', models.FloatField(default=0, verbose_name='وقت الاستخراج (ثانية)')),
+                ('latency', models.FloatField(default=0, verbose_name='زمن النموذج (ثانية)')),
+                ('outcome', models.CharField(choices=[('success', 'نجاح'), ('error', 'خطأ'), ('busy', 'انتهت مهلة الانتظار'), ('cancelled', 'أُلغي')], default='success', max_length=20, verbose_name='النتيجة')),
+                ('error', models.CharField(blank=True, max_length=255, verbose_name='الخطأ')),
+                ('retry_count', models.PositiveSmallIntegerField(default=0, verbose_name='رقم إعادة المحاولة')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='الوقت')),
+                ('file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ai_usage', to='core.lecturefile', verbose_name='الملف')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ai_usage', to=settings.AUTH_USER_MODEL, verbose_name='المستخدم')),
+            ],
+            options={
+                'verbose_name': 'استهلاك AI',
+                'verbose_name_plural': 'استهلاك AI',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['created_at'], name='ai_service__created_faa154_idx'), models.Index(fields=['file', 'created_at'], name='ai_service__file_id_7e2e23_idx')],
+            },
+        ),
+    ]
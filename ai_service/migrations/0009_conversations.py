@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0008_aiusage'),
+        ('core', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='aijob',
+            name='file',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ai_jobs', to='core.lecturefile', verbose_name='الملف'),
+        ),
+        migrations.AlterField(
+            model_name='aijob',
+            name='job_type',
+            field=models.CharField(choices=[('summary', 'توليد ملخص'), ('questions', 'توليد أسئلة'), ('question_bank', 'تعبئة بنك الأسئلة'), ('chat_summary', 'تحديث ملخص المحادثة')], max_length=30, verbose_name='نوع المهمة'),
+        ),
+        migrations.CreateModel(
+            name='AIConversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(blank=True, max_length=200, verbose_name='العنوان')),
+                ('summary', models.TextField(blank=True, default='', verbose_name='ملخص المحادثة')),
+                ('summary_until_id', models.PositiveBigIntegerField(default=0, verbose_name='آخر رسالة في الملخص')),
+                ('is_active', models.BooleanField(default=True, verbose_name='نشطة')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ البدء')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='آخر نشاط')),
+                ('file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ai_conversations', to='core.lecturefile', verbose_name='الملف')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ai_conversations', to=settings.AUTH_USER_MODEL, verbose_name='المستخدم')),
+            ],
+            options={
+                'verbose_name': 'جلسة محادثة',
+                'verbose_name_plural': 'جلسات المحادثة',
+                'ordering': ['-updated_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AIMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('user', 'المستخدم'), ('assistant', 'المساعد'), ('system', 'النظام')], max_length=20, verbose_name='الدور')),
+                ('content', models.TextField(verbose_name='المحتوى')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='التاريخ')),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='ai_service.aiconversation', verbose_name='المحادثة')),
+            ],
+            options={
+                'verbose_name': 'رسالة محادثة',
+                'verbose_name_plural': 'رسائل المحادثات',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='aiconversation',
+            index=models.Index(fields=['user', 'file', 'updated_at'], name='ai_service__user_id_256bb2_idx'),
+        ),
+    ]
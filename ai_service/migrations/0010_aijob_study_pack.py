@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0009_conversations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='aijob',
+            name='job_type',
+            field=models.CharField(choices=[('summary', 'توليد ملخص'), ('questions', 'توليد أسئلة'), ('question_bank', 'تعبئة بنك الأسئلة'), ('chat_summary', 'تحديث ملخص المحادثة'), ('study_pack', 'توليد حزمة مذاكرة')], max_length=30, verbose_name='نوع المهمة'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_service', '0010_aijob_study_pack'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='extractedtext',
+            name='page_offsets',
+            field=models.JSONField(blank=True, default=list, verbose_name='بداية كل صفحة في النص'),
+        ),
+    ]
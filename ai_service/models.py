@@ -26,6 +26,12 @@ class AISummary(models.Model):
     word_count = models.PositiveIntegerField(default=0, verbose_name='عدد الكلمات')
     processing_time = models.FloatField(default=0, verbose_name='وقت المعالجة (ثانية)')
     
+    # الملخص المشترك الذي أُخذ منه هذا الملخص (إن وجد)
+    shared_summary = models.ForeignKey(
+        'SharedSummary', on_delete=models.SET_NULL, blank=True, null=True,
+        related_name='user_summaries', verbose_name='الملخص المشترك'
+    )
+    
     generated_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ التوليد')
     
     class Meta:
@@ -37,6 +43,99 @@ class AISummary(models.Model):
         return f"ملخص: {self.file.title}"
 
 
+class SharedSummary(models.Model):
+    """
+    جدول الملخصات المشتركة بين المستخدمين
+    
+    الملخص مرتبط ببصمة محتوى الملف ونوع الملخص واللغة ونسخة التعليمات،
+    فإذا طلب عدة طلاب نفس الملخص لنفس الملف يُولد مرة واحدة فقط
+    ويُنسخ لكل طالب كسجل AISummary خاص به.
+    """
+    content_hash = models.CharField(max_length=64, verbose_name='بصمة المحتوى')
+    summary_type = models.CharField(max_length=20, choices=AISummary.SUMMARY_TYPE_CHOICES, verbose_name='نوع الملخص')
+    language = models.CharField(max_length=5, default='ar', verbose_name='اللغة')
+    prompt_version = models.PositiveIntegerField(verbose_name='نسخة التعليمات')
+    
+    summary_text = models.TextField(verbose_name='نص الملخص')
+    word_count = models.PositiveIntegerField(default=0, verbose_name='عدد الكلمات')
+    
+    hit_count = models.PositiveIntegerField(default=0, verbose_name='مرات الاستخدام')
+    generated_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ التوليد')
+    last_hit_at = models.DateTimeField(blank=True, null=True, verbose_name='آخر استخدام')
+    
+    class Meta:
+        verbose_name = 'ملخص مشترك'
+        verbose_name_plural = 'الملخصات المشتركة'
+        ordering = ['-generated_at']
+        unique_together = ['content_hash', 'summary_type', 'language', 'prompt_version']
+    
+    def __str__(self):
+        return f"{self.get_summary_type_display()} ({self.language}) - {self.content_hash[:12]}"
+    
+    @classmethod
+    def for_file(cls, lecture_file, summary_type, language='ar'):
+        """
+        البحث عن ملخص مشترك جاهز لملف
+        
+        Returns:
+            SharedSummary | None
+        """
+        from .text_extractor import get_file_hash
+        from .utils import SUMMARY_PROMPT_VERSION
+        
+        if lecture_file.content_type == 'external_link' or not lecture_file.file:
+            return None
+        
+        try:
+            content_hash = get_file_hash(lecture_file)
+        except (OSError, ValueError):
+            return None
+        
+        return cls.objects.filter(
+            content_hash=content_hash,
+            summary_type=summary_type,
+            language=language,
+            prompt_version=SUMMARY_PROMPT_VERSION
+        ).first()
+    
+    @classmethod
+    def store(cls, lecture_file, summary_type, language, summary_text):
+        """حفظ ملخص مولد ليستفيد منه بقية الطلاب"""
+        from .text_extractor import get_file_hash
+        from .utils import SUMMARY_PROMPT_VERSION
+        
+        shared, created = cls.objects.get_or_create(
+            content_hash=get_file_hash(lecture_file),
+            summary_type=summary_type,
+            language=language,
+            prompt_version=SUMMARY_PROMPT_VERSION,
+            defaults={
+                'summary_text': summary_text,
+                'word_count': len(summary_text.split()),
+            }
+        )
+        return shared
+    
+    def record_hit(self):
+        """تسجيل استخدام الملخص من الذاكرة المشتركة"""
+        self.__class__.objects.filter(pk=self.pk).update(
+            hit_count=models.F('hit_count') + 1,
+            last_hit_at=timezone.now()
+        )
+    
+    def create_user_summary(self, user, lecture_file, processing_time=0):
+        """إنشاء سجل AISummary للمستخدم مرتبط بهذا الملخص"""
+        return AISummary.objects.create(
+            file=lecture_file,
+            user=user,
+            summary_type=self.summary_type,
+            summary_text=self.summary_text,
+            word_count=self.word_count,
+            processing_time=processing_time,
+            shared_summary=self
+        )
+
+
 class AIQuestion(models.Model):
     """جدول أسئلة AI"""
     DIFFICULTY_CHOICES = [
@@ -64,6 +163,51 @@ class AIQuestion(models.Model):
         return f"أسئلة: {self.file.title}"
 
 
+class QuestionBankItem(models.Model):
+    """
+    جدول بنك الأسئلة المولدة مسبقاً لكل محتوى ملف ومستوى صعوبة
+    
+    تُسحب منه أسئلة الطلاب بدلاً من طلب جديد لـ Gemini في كل مرة،
+    ويُعاد ملؤه في الخلفية عند انخفاض عدد الأسئلة.
+    المفتاح بصمة محتوى الملف (مثل SharedSummary): استبدال ملف المحاضرة
+    يبدأ بنكاً جديداً، والملفات المتطابقة تشترك في نفس البنك.
+    """
+    content_hash = models.CharField(max_length=64, verbose_name='بصمة المحتوى')
+    difficulty = models.CharField(max_length=20, choices=AIQuestion.DIFFICULTY_CHOICES, verbose_name='مستوى الصعوبة')
+    
+    question_json = models.JSONField(verbose_name='السؤال')
+    question_hash = models.CharField(max_length=64, verbose_name='بصمة السؤال')  # لمنع تكرار نفس السؤال
+    
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإضافة')
+    
+    class Meta:
+        verbose_name = 'سؤال في البنك'
+        verbose_name_plural = 'بنك الأسئلة'
+        ordering = ['-created_at']
+        unique_together = ['content_hash', 'difficulty', 'question_hash']
+        indexes = [
+            models.Index(fields=['content_hash', 'difficulty']),
+        ]
+    
+    def __str__(self):
+        return f"{self.content_hash[:12]} ({self.get_difficulty_display()})"
+
+
+class QuestionBankDraw(models.Model):
+    """جدول الأسئلة المسحوبة لكل طالب من البنك (حتى لا تتكرر عليه)"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='question_bank_draws', verbose_name='المستخدم')
+    item = models.ForeignKey(QuestionBankItem, on_delete=models.CASCADE, related_name='draws', verbose_name='السؤال')
+    drawn_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ السحب')
+    
+    class Meta:
+        verbose_name = 'سؤال مسحوب'
+        verbose_name_plural = 'الأسئلة المسحوبة'
+        unique_together = ['user', 'item']
+    
+    def __str__(self):
+        return f"{self.user} - {self.item_id}"
+
+
 class AIChat(models.Model):
     """جدول محادثات AI (المساعد الذكي)"""
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='ai_chats', verbose_name='المستخدم')
@@ -85,8 +229,70 @@ class AIChat(models.Model):
         return f"سؤال من {self.user.full_name}"
 
 
+class AIConversation(models.Model):
+    """
+    جلسة محادثة مع المساعد الذكي
+    
+    الرسائل القديمة تُضغط في الخلفية في ملخص متجدد (summary)، فيحتوي
+    الطلب على الملخص وآخر دور فقط بدلاً من سجل يكبر مع كل سؤال.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='ai_conversations', verbose_name='المستخدم')
+    file = models.ForeignKey('core.LectureFile', on_delete=models.CASCADE, blank=True, null=True, related_name='ai_conversations', verbose_name='الملف')
+    
+    title = models.CharField(max_length=200, blank=True, verbose_name='العنوان')
+    summary = models.TextField(blank=True, default='', verbose_name='ملخص المحادثة')
+    # آخر رسالة دخلت في الملخص (الرسائل بعدها تُرسل كما هي)
+    summary_until_id = models.PositiveBigIntegerField(default=0, verbose_name='آخر رسالة في الملخص')
+    
+    is_active = models.BooleanField(default=True, verbose_name='نشطة')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ البدء')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='آخر نشاط')
+    
+    class Meta:
+        verbose_name = 'جلسة محادثة'
+        verbose_name_plural = 'جلسات المحادثة'
+        ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['user', 'file', 'updated_at']),
+        ]
+    
+    def __str__(self):
+        return self.title or f"محادثة {self.pk}"
+
+
+class AIMessage(models.Model):
+    """رسالة في جلسة محادثة"""
+    USER = 'user'
+    ASSISTANT = 'assistant'
+    SYSTEM = 'system'
+    
+    ROLE_CHOICES = [
+        (USER, 'المستخدم'),
+        (ASSISTANT, 'المساعد'),
+        (SYSTEM, 'النظام'),
+    ]
+    
+    conversation = models.ForeignKey(AIConversation, on_delete=models.CASCADE, related_name='messages', verbose_name='المحادثة')
+    role = models.CharField(max_length=20, choices=ROLE_CHOICES, verbose_name='الدور')
+    content = models.TextField(verbose_name='المحتوى')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='التاريخ')
+    
+    class Meta:
+        verbose_name = 'رسالة محادثة'
+        verbose_name_plural = 'رسائل المحادثات'
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.get_role_display()}: {self.content[:50]}"
+
+
 class AIRateLimit(models.Model):
-    """جدول تتبع حدود استخدام AI"""
+    """
+    جدول تتبع حدود استخدام AI
+    
+    العد يتم بنافذة منزلقة في الذاكرة المؤقتة (انظر rate_limit.py)،
+    والجدول سجل دائم يُستخدم لملء العدادات وعند تعطل الذاكرة المؤقتة.
+    """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='ai_rate_limits')
     request_type = models.CharField(max_length=50, verbose_name='نوع الطلب')  # summary, questions, chat
     request_time = models.DateTimeField(auto_now_add=True, verbose_name='وقت الطلب')
@@ -95,25 +301,285 @@ class AIRateLimit(models.Model):
         verbose_name = 'حد استخدام AI'
         verbose_name_plural = 'حدود استخدام AI'
         ordering = ['-request_time']
+        indexes = [
+            models.Index(fields=['user', 'request_type', 'request_time']),
+            models.Index(fields=['request_time']),
+        ]
     
     @classmethod
     def check_rate_limit(cls, user, request_type='all'):
         """التحقق من حد الاستخدام"""
-        from django.conf import settings
-        
-        limit = getattr(settings, 'AI_RATE_LIMIT', 10)
-        period = getattr(settings, 'AI_RATE_LIMIT_PERIOD', 3600)
+        from .rate_limit import check
+        return check(user, request_type)
+    
+    @classmethod
+    def record_request(cls, user, request_type):
+        """تسجيل طلب جديد"""
+        from .rate_limit import record
+        return record(user, request_type)
+
+
+class ExtractedText(models.Model):
+    """
+    جدول النصوص المستخرجة من الملفات (تخزين دائم)
+    
+    المفتاح هو بصمة SHA-256 لمحتوى الملف مع نسخة المستخرج،
+    فيُستخرج نص كل ملف مرة واحدة فقط ويُعاد استخدامه في الطلبات اللاحقة.
+    تغيير ملف المحاضرة يغيّر البصمة تلقائياً فلا يُستخدم النص القديم.
+    """
+    content_hash = models.CharField(max_length=64, verbose_name='بصمة المحتوى')
+    extractor_version = models.PositiveIntegerField(default=1, verbose_name='نسخة المستخرج')
+    
+    text = models.TextField(verbose_name='النص المستخرج')
+    char_count = models.PositiveIntegerField(default=0, verbose_name='عدد الأحرف')
+    page_offsets = models.JSONField(default=list, blank=True, verbose_name='بداية كل صفحة في النص')
+    extraction_time = models.FloatField(default=0, verbose_name='وقت الاستخراج (ثانية)')
+    
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الاستخراج')
+    
+    class Meta:
+        verbose_name = 'نص مستخرج'
+        verbose_name_plural = 'النصوص المستخرجة'
+        ordering = ['-created_at']
+        unique_together = ['content_hash', 'extractor_version']
+    
+    def __str__(self):
+        return f"{self.content_hash[:12]} (v{self.extractor_version})"
+    
+    @property
+    def page_count(self):
+        return len(self.page_offsets)
+
+
+class AIJob(models.Model):
+    """
+    جدول مهام AI في الخلفية
+    
+    يُنشئ العرض المهمة ويعود فوراً، ثم ينفذها أمر ai_worker
+    بينما تستطلع الواجهة حالتها عبر HTMX.
+    """
+    SUMMARY = 'summary'
+    QUESTIONS = 'questions'
+    QUESTION_BANK = 'question_bank'
+    CHAT_SUMMARY = 'chat_summary'
+    STUDY_PACK = 'study_pack'
+    PREPARE_FILE = 'prepare_file'
+    
+    JOB_TYPE_CHOICES = [
+        (SUMMARY, 'توليد ملخص'),
+        (QUESTIONS, 'توليد أسئلة'),
+        (QUESTION_BANK, 'تعبئة بنك الأسئلة'),
+        (CHAT_SUMMARY, 'تحديث ملخص المحادثة'),
+        (STUDY_PACK, 'توليد حزمة مذاكرة'),
+        (PREPARE_FILE, 'تجهيز نص الملف'),
+    ]
+    
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (PENDING, 'في الانتظار'),
+        (RUNNING, 'قيد التنفيذ'),
+        (DONE, 'مكتملة'),
+        (FAILED, 'فشلت'),
+    ]
+    
+    job_type = models.CharField(max_length=30, choices=JOB_TYPE_CHOICES, verbose_name='نوع المهمة')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING, verbose_name='الحالة')
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='ai_jobs', verbose_name='المستخدم')
+    # بعض المهام لا ترتبط بملف (مثل ملخص محادثة عامة)
+    file = models.ForeignKey('core.LectureFile', on_delete=models.CASCADE, blank=True, null=True, related_name='ai_jobs', verbose_name='الملف')
+    
+    params = models.JSONField(default=dict, blank=True, verbose_name='المعاملات')
+    result_id = models.PositiveIntegerField(blank=True, null=True, verbose_name='معرف النتيجة')
+    error = models.TextField(blank=True, default='', verbose_name='الخطأ')
+    
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')
+    started_at = models.DateTimeField(blank=True, null=True, verbose_name='بدء التنفيذ')
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name='انتهاء التنفيذ')
+    
+    class Meta:
+        verbose_name = 'مهمة AI'
+        verbose_name_plural = 'مهام AI'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_job_type_display()} #{self.pk} ({self.get_status_display()})"
+    
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+    
+    @classmethod
+    def claim_next(cls):
+        """
+        حجز أقدم مهمة في الانتظار للتنفيذ
         
-        cutoff_time = timezone.now() - timezone.timedelta(seconds=period)
+        يتم الحجز بتحديث مشروط على الحالة، فلا تُنفذ المهمة
+        مرتين حتى مع تشغيل أكثر من عامل.
         
-        query = cls.objects.filter(user=user, request_time__gte=cutoff_time)
-        if request_type != 'all':
-            query = query.filter(request_type=request_type)
+        Returns:
+            AIJob | None: المهمة المحجوزة
+        """
+        candidates = cls.objects.filter(status=cls.PENDING).order_by('created_at').values_list('pk', flat=True)[:10]
         
-        count = query.count()
-        return count < limit, limit - count
+        for pk in candidates:
+            claimed = cls.objects.filter(pk=pk, status=cls.PENDING).update(
+                status=cls.RUNNING,
+                started_at=timezone.now()
+            )
+            if claimed:
+                return cls.objects.select_related('file', 'user').get(pk=pk)
+        return None
     
     @classmethod
-    def record_request(cls, user, request_type):
-        """تسجيل طلب جديد"""
-        return cls.objects.create(user=user, request_type=request_type)
+    def requeue_stale(cls, older_than_seconds):
+        """إعادة المهام العالقة (بسبب توقف العامل) إلى الانتظار"""
+        cutoff = timezone.now() - timezone.timedelta(seconds=older_than_seconds)
+        return cls.objects.filter(status=cls.RUNNING, started_at__lt=cutoff).update(
+            status=cls.PENDING,
+            started_at=None
+        )
+    
+    def mark_done(self, result_id):
+        self.status = self.DONE
+        self.result_id = result_id
+        self.finished_at = timezone.now()
+        self.save(update_fields=['status', 'result_id', 'finished_at'])
+    
+    def mark_failed(self, error):
+        self.status = self.FAILED
+        self.error = str(error)
+        self.finished_at = timezone.now()
+        self.save(update_fields=['status', 'error', 'finished_at'])
+
+
+class GeminiContextCache(models.Model):
+    """
+    جدول مراجع ذاكرة السياق لدى Gemini (Context Caching)
+    
+    نص الملف يُرفع مرة واحدة لكل (بصمة محتوى، نموذج) ويُشار إليه باسم
+    المرجع في طلبات المحادثة والأسئلة والتلخيص اللاحقة حتى انتهاء صلاحيته.
+    """
+    content_hash = models.CharField(max_length=64, verbose_name='بصمة المحتوى')
+    model_name = models.CharField(max_length=100, verbose_name='النموذج')
+    cache_name = models.CharField(max_length=255, verbose_name='اسم المرجع')
+    token_count = models.PositiveIntegerField(default=0, verbose_name='عدد التوكنات (تقديري)')
+    expires_at = models.DateTimeField(verbose_name='انتهاء الصلاحية')
+    hit_count = models.PositiveIntegerField(default=0, verbose_name='مرات الاستخدام')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')
+    
+    class Meta:
+        verbose_name = 'ذاكرة سياق Gemini'
+        verbose_name_plural = 'ذاكرة سياق Gemini'
+        ordering = ['-created_at']
+        unique_together = ['content_hash', 'model_name']
+    
+    def __str__(self):
+        return f"{self.content_hash[:12]} ({self.model_name})"
+    
+    @property
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+
+
+class AIUsage(models.Model):
+    """
+    جدول استهلاك Gemini - صف لكل طلب صادر للنموذج (بما فيها إعادة المحاولة)
+    
+    يُنشأ من metering.py حول كل استدعاء في utils، ويُجمع يومياً في
+    AIUsageDaily بأمر ai_usage_rollup.
+    """
+    SUCCESS = 'success'
+    ERROR = 'error'
+    BUSY = 'busy'
+    CANCELLED = 'cancelled'
+    
+    OUTCOME_CHOICES = [
+        (SUCCESS, 'نجاح'),
+        (ERROR, 'خطأ'),
+        (BUSY, 'انتهت مهلة الانتظار'),
+        (CANCELLED, 'أُلغي'),
+    ]
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True,
+        related_name='ai_usage', verbose_name='المستخدم'
+    )
+    file = models.ForeignKey(
+        'core.LectureFile', on_delete=models.SET_NULL, blank=True, null=True,
+        related_name='ai_usage', verbose_name='الملف'
+    )
+    feature = models.CharField(max_length=30, verbose_name='الميزة')  # summary, questions, chat ...
+    model_name = models.CharField(max_length=100, verbose_name='النموذج')
+    
+    prompt_tokens = models.PositiveIntegerField(default=0, verbose_name='توكنات الطلب')
+    cached_tokens = models.PositiveIntegerField(default=0, verbose_name='توكنات ذاكرة السياق')
+    response_tokens = models.PositiveIntegerField(default=0, verbose_name='توكنات الرد')
+    
+    queue_time = models.FloatField(default=0, verbose_name='وقت الانتظار (ثانية)')
+    extraction_time = models.FloatField(default=0, verbose_name='وقت الاستخراج (ثانية)')
+    latency = models.FloatField(default=0, verbose_name='زمن النموذج (ثانية)')
+    
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES, default=SUCCESS, verbose_name='النتيجة')
+    error = models.CharField(max_length=255, blank=True, verbose_name='الخطأ')
+    retry_count = models.PositiveSmallIntegerField(default=0, verbose_name='رقم إعادة المحاولة')
+    
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='الوقت')
+    
+    class Meta:
+        verbose_name = 'استهلاك AI'
+        verbose_name_plural = 'استهلاك AI'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['file', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.feature} - {self.model_name} ({self.get_outcome_display()})"
+
+
+class AIUsageDaily(models.Model):
+    """
+    التجميع اليومي لجدول AIUsage لكل (يوم، ميزة، نموذج)
+    
+    تقارير الفترات الطويلة تُقرأ من هذا الجدول بدلاً من صفوف AIUsage.
+    """
+    date = models.DateField(verbose_name='اليوم')
+    feature = models.CharField(max_length=30, verbose_name='الميزة')
+    model_name = models.CharField(max_length=100, verbose_name='النموذج')
+    
+    calls = models.PositiveIntegerField(default=0, verbose_name='عدد الطلبات')
+    errors = models.PositiveIntegerField(default=0, verbose_name='الطلبات الفاشلة')
+    retries = models.PositiveIntegerField(default=0, verbose_name='إعادة المحاولة')
+    
+    prompt_tokens = models.PositiveBigIntegerField(default=0, verbose_name='توكنات الطلب')
+    cached_tokens = models.PositiveBigIntegerField(default=0, verbose_name='توكنات ذاكرة السياق')
+    response_tokens = models.PositiveBigIntegerField(default=0, verbose_name='توكنات الرد')
+    
+    total_queue_time = models.FloatField(default=0, verbose_name='إجمالي الانتظار (ثانية)')
+    total_extraction_time = models.FloatField(default=0, verbose_name='إجمالي الاستخراج (ثانية)')
+    total_latency = models.FloatField(default=0, verbose_name='إجمالي زمن النموذج (ثانية)')
+    max_latency = models.FloatField(default=0, verbose_name='أقصى زمن للنموذج (ثانية)')
+    
+    estimated_cost = models.DecimalField(max_digits=12, decimal_places=6, default=0, verbose_name='التكلفة التقديرية ($)')
+    
+    class Meta:
+        verbose_name = 'استهلاك AI اليومي'
+        verbose_name_plural = 'استهلاك AI اليومي'
+        ordering = ['-date', 'feature']
+        unique_together = ['date', 'feature', 'model_name']
+    
+    def __str__(self):
+        return f"{self.date} - {self.feature} ({self.model_name})"
+    
+    @property
+    def avg_latency(self):
+        return self.total_latency / self.calls if self.calls else 0
@@ -0,0 +1,160 @@
+"""
+توحيد النص العربي المستخرج
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+النص المستخرج من PDF مليء بالتطويل والتشكيل وأشكال العرض (الحروف
+المتصلة والمركبة مثل ﻻ)، والمسافات المكررة، وترويسة وتذييل يتكرران في
+كل صفحة، وكلها توكنات تُرسل لـ Gemini. يُطبق التوحيد مرة واحدة بعد
+الاستخراج (join_pages في text_extractor) فيُخزن النص موحداً، وتُبنى منه
+الفهارس وتُرسل منه الطلبات.
+
+- normalize_text: الشكل المعتمد للتخزين والطلبات (جدول translate واحد
+  وتعابير منتظمة مترجمة مسبقاً)
+- remove_repeated_lines: حذف الترويسة والتذييل المتكررين عبر الصفحات
+- normalize_for_search: شكل البحث (توحيد الألف والياء والتاء المربوطة
+  والأرقام) للفهرسة وأسئلة الطلاب
+"""
+
+import re
+import unicodedata
+from collections import Counter
+
+# التشكيل وعلامات المصحف
+DIACRITICS = (
+    list(range(0x0610, 0x061B))
+    + list(range(0x064B, 0x0660))
+    + [0x0670]
+    + list(range(0x06D6, 0x06DD))
+    + list(range(0x06DF, 0x06E5))
+    + [0x06E7, 0x06E8]
+    + list(range(0x06EA, 0x06EE))
+)
+TATWEEL = 0x0640
+
+# محارف غير مرئية تضيفها برامج PDF (اتجاه النص، BOM، الشرطة الناعمة)
+INVISIBLE = [0x00AD, 0x200B, 0x200E, 0x200F, 0xFEFF] + list(range(0x202A, 0x202F)) + list(range(0x2066, 0x206A))
+
+# مسافات خاصة تُستبدل بمسافة عادية
+SPACES = [0x00A0, 0x202F, 0x205F, 0x3000] + list(range(0x2000, 0x200B))
+
+# أشكال العرض العربية (الحروف بحسب موضعها والمركبات)
+PRESENTATION_FORMS = list(range(0xFB50, 0xFE00)) + list(range(0xFE70, 0xFEFF))
+
+SEARCH_FOLDING = {
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي',
+    'ة': 'ه',
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},
+}
+
+# عدد الأسطر التي تُفحص في أعلى وأسفل كل صفحة
+EDGE_LINES = 2
+# السطر يُعد ترويسة أو تذييلاً إذا تكرر في هذه النسبة من الصفحات على الأقل
+REPEATED_LINE_RATIO = 0.5
+MIN_PAGES_FOR_REPEATED_LINES = 3
+
+_HORIZONTAL_SPACE = re.compile(r'[ \t\f\v]+')
+_SPACE_AROUND_NEWLINE = re.compile(r' ?\n ?')
+_BLANK_LINES = re.compile(r'\n{3,}')
+_DIGITS = re.compile(r'[0-9٠-٩۰-۹]+')
+
+
+def _build_tables():
+    """جدولا translate: للنص المعتمد وللبحث"""
+    removed = {code: None for code in DIACRITICS + INVISIBLE + [TATWEEL]}
+    text_table = {**removed, **{code: ' ' for code in SPACES}}
+
+    def strip_marks(value):
+        return value.translate(text_table)
+
+    for code in PRESENTATION_FORMS:
+        if code in text_table:
+            continue
+        decomposed = unicodedata.normalize('NFKC', chr(code))
+        if decomposed != chr(code):
+            text_table[code] = strip_marks(decomposed)
+
+    folding = str.maketrans(SEARCH_FOLDING)
+    search_table = {
+        code: value.translate(folding) if isinstance(value, str) else value
+        for code, value in text_table.items()
+    }
+    search_table.update(folding)
+
+    return str.maketrans(text_table), str.maketrans(search_table)
+
+
+TEXT_TABLE, SEARCH_TABLE = _build_tables()
+
+
+def normalize_text(text):
+    """
+    الشكل المعتمد للنص: بدون تشكيل أو تطويل أو أشكال عرض،
+    ومسافات وأسطر فارغة موحدة
+    """
+    if not text:
+        return ''
+
+    text = text.replace('\r\n', '\n').replace('\r', '\n').translate(TEXT_TABLE)
+    text = _HORIZONTAL_SPACE.sub(' ', text)
+    text = _SPACE_AROUND_NEWLINE.sub('\n', text)
+    text = _BLANK_LINES.sub('\n\n', text)
+    return text.strip()
+
+
+def normalize_for_search(text):
+    """شكل البحث: التوحيد مع طي الألف والياء والتاء المربوطة والأرقام وحالة الأحرف"""
+    return text.translate(SEARCH_TABLE).lower()
+
+
+def _line_key(line):
+    """مفتاح مقارنة السطر (أرقام الصفحات لا تمنع التطابق)"""
+    return _DIGITS.sub('#', line.strip())
+
+
+def remove_repeated_lines(pages):
+    """
+    حذف الترويسة والتذييل: الأسطر في أعلى وأسفل الصفحات التي تتكرر
+    (بعد استبدال الأرقام) في نصف الصفحات على الأقل
+
+    الصفحات القصيرة (كلها ضمن الأطراف) لا تُحسب ولا يُحذف منها شيء.
+
+    Args:
+        pages: نصوص الصفحات بعد normalize_text
+
+    Returns:
+        list: الصفحات بنفس الترتيب والعدد
+    """
+    if len(pages) < MIN_PAGES_FOR_REPEATED_LINES:
+        return pages
+
+    split_pages = [page.split('\n') for page in pages]
+    headers = Counter()
+    footers = Counter()
+    for lines in split_pages:
+        if len(lines) <= EDGE_LINES * 2:
+            continue
+        headers.update({_line_key(line) for line in lines[:EDGE_LINES] if line.strip()})
+        footers.update({_line_key(line) for line in lines[-EDGE_LINES:] if line.strip()})
+
+    threshold = max(MIN_PAGES_FOR_REPEATED_LINES, len(pages) * REPEATED_LINE_RATIO)
+    repeated_headers = {key for key, count in headers.items() if count >= threshold}
+    repeated_footers = {key for key, count in footers.items() if count >= threshold}
+    if not repeated_headers and not repeated_footers:
+        return pages
+
+    result = []
+    for page, lines in zip(pages, split_pages):
+        if len(lines) <= EDGE_LINES * 2:
+            result.append(page)
+            continue
+        start = 0
+        while start < min(EDGE_LINES, len(lines)) and _line_key(lines[start]) in repeated_headers:
+            start += 1
+        end = len(lines)
+        while end > max(start, len(lines) - EDGE_LINES) and _line_key(lines[end - 1]) in repeated_footers:
+            end -= 1
+        result.append('\n'.join(lines[start:end]).strip())
+
+    return result
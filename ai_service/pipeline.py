@@ -0,0 +1,142 @@
+"""
+تجهيز ملفات المحاضرات بعد الرفع
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+عند رفع ملف تُجدول مهمة في الخلفية (AIJob.PREPARE_FILE) تستخرج نصه في
+عملية معزولة وتحفظه مع فهرس الاسترجاع، وتسجل على LectureFile بصمة
+المحتوى وعدد الصفحات وحالة المعالجة. فيجد أول طالب يستخدم ميزات AI
+النص جاهزاً، ويرى المدرس حالة كل ملف. بعد النجاح يُجدول ملء بنك الأسئلة.
+"""
+
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.models import LectureFile
+from .models import AIJob, ExtractedText
+from .extraction_pool import ExtractionError
+from .text_extractor import EXTRACTOR_VERSION, SUPPORTED_EXTENSIONS, get_file_hash, extract_and_store
+
+# إعداد التسجيل
+logger = logging.getLogger(__name__)
+
+
+def _set_status(lecture_file, status, **fields):
+    """تحديث حالة المعالجة دون حفظ بقية حقول الملف"""
+    fields['processing_status'] = status
+    LectureFile.objects.filter(pk=lecture_file.pk).update(**fields)
+    for name, value in fields.items():
+        setattr(lecture_file, name, value)
+
+
+def schedule_file_processing(user, lecture_file):
+    """
+    جدولة تجهيز نص ملف مرفوع
+
+    الروابط الخارجية والامتدادات غير المدعومة تُعلم بأنها لا تحتاج معالجة.
+    عند تعطيل قائمة الانتظار يُجهز الملف داخل الطلب (دون ملء بنك الأسئلة)
+    فتنتهي حالته دائماً بجاهز أو فشل.
+
+    Returns:
+        AIJob | None
+    """
+    from .jobs import enqueue_job
+
+    if (
+        lecture_file.content_type == 'external_link'
+        or not lecture_file.file
+        or lecture_file.get_file_extension() not in SUPPORTED_EXTENSIONS
+    ):
+        _set_status(lecture_file, LectureFile.PROCESSING_SKIPPED)
+        return None
+
+    if not getattr(settings, 'AI_JOB_QUEUE_ENABLED', False):
+        process_lecture_file(lecture_file)
+        return None
+
+    return enqueue_job(AIJob.PREPARE_FILE, user, lecture_file)
+
+
+def prepare_uploaded_file(user, lecture_file):
+    """
+    بدء تجهيز ملف بعد رفعه بنجاح
+
+    خطأ الجدولة أو التجهيز (عند تعطيل قائمة الانتظار) لا يُفشل الرفع:
+    يُسجل ويُعلم الملف بفشل المعالجة ليظهر للمدرس.
+
+    Returns:
+        AIJob | None
+    """
+    try:
+        return schedule_file_processing(user, lecture_file)
+    except Exception as e:
+        logger.error(f"File processing scheduling failed for file {lecture_file.pk}: {e}")
+        _set_status(lecture_file, LectureFile.PROCESSING_FAILED, processing_error='تعذر بدء تجهيز الملف')
+        return None
+
+
+def process_lecture_file(lecture_file):
+    """
+    استخراج نص الملف وحفظه وفهرسته وتسجيل النتيجة على الملف
+
+    Returns:
+        bool: True إذا أصبح النص جاهزاً
+    """
+    _set_status(lecture_file, LectureFile.PROCESSING_RUNNING, processing_error='')
+
+    try:
+        content_hash = get_file_hash(lecture_file)
+    except (OSError, ValueError) as e:
+        logger.error(f"File hashing error for file {lecture_file.pk}: {e}")
+        _set_status(lecture_file, LectureFile.PROCESSING_FAILED, processing_error='تعذرت قراءة الملف')
+        return False
+
+    # نفس المحتوى رُفع واستُخرج من قبل
+    page_offsets = ExtractedText.objects.filter(
+        content_hash=content_hash,
+        extractor_version=EXTRACTOR_VERSION
+    ).values_list('page_offsets', flat=True).first()
+
+    if page_offsets is None:
+        try:
+            text, page_offsets = extract_and_store(lecture_file, content_hash)
+        except ExtractionError as e:
+            logger.error(f"Text extraction failed for file {lecture_file.pk}: {e.as_dict()}")
+            _set_status(lecture_file, LectureFile.PROCESSING_FAILED, processing_error=e.message[:255])
+            return False
+
+        if not text or not text.strip():
+            _set_status(lecture_file, LectureFile.PROCESSING_FAILED, processing_error='لا يوجد نص في الملف')
+            return False
+
+    _set_status(
+        lecture_file,
+        LectureFile.PROCESSING_READY,
+        content_hash=content_hash,
+        page_count=len(page_offsets) or None,
+        processed_at=timezone.now(),
+    )
+    return True
+
+
+def prepare_existing_file(lecture_file):
+    """
+    تحديد حالة ملف رُفع قبل تجهيز الملفات عند الرفع
+
+    الملف الذي استُخرج نص محتواه من قبل يُعلم بأنه جاهز دون استخراج،
+    والباقي يُجدول كما لو رُفع الآن.
+    """
+    if lecture_file.file and lecture_file.content_type != 'external_link':
+        try:
+            content_hash = get_file_hash(lecture_file)
+        except (OSError, ValueError) as e:
+            logger.error(f"File hashing error for file {lecture_file.pk}: {e}")
+            _set_status(lecture_file, LectureFile.PROCESSING_FAILED, processing_error='تعذرت قراءة الملف')
+            return
+
+        if ExtractedText.objects.filter(content_hash=content_hash, extractor_version=EXTRACTOR_VERSION).exists():
+            process_lecture_file(lecture_file)
+            return
+
+    schedule_file_processing(lecture_file.uploader, lecture_file)
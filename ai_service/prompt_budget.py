@@ -0,0 +1,122 @@
+"""
+ميزانية التوكنات لطلبات Gemini
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+بدلاً من اقتطاع النصوص بعدد أحرف ثابت، يُقدَّر عدد التوكنات
+ويُوزع حد كل ميزة (AI_PROMPT_BUDGETS) على التعليمات وسجل المحادثة
+والسياق بالترتيب: التعليمات أولاً، ثم حصة السجل، ثم السياق.
+"""
+
+from django.conf import settings
+
+# الحدود الافتراضية للتوكنات المدخلة لكل ميزة
+DEFAULT_PROMPT_BUDGETS = {
+    'summary': 8000,
+    'questions': 6000,
+    'chat': 5000,
+}
+
+# نسبة الأحرف إلى التوكن (تقريبية)
+ARABIC_CHARS_PER_TOKEN = 2
+LATIN_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    تقدير عدد التوكنات في النص (تقريبي)
+
+    يُحسب عدد الأحرف غير اللاتينية من فرق طول النص بترميز UTF-8
+    عن طوله بالأحرف (كل حرف عربي = بايتان)، وهي عملية تتم بالكامل
+    داخل C بدلاً من المرور على كل حرف في Python.
+
+    Args:
+        text: النص
+
+    Returns:
+        int: العدد التقريبي للتوكنات
+    """
+    if not text:
+        return 0
+
+    # الأحرف خارج ASCII (العربية أساساً) - الأحرف ذات 3 بايت تُحسب مرتين (تقدير محافظ)
+    non_latin_chars = len(text.encode('utf-8', 'surrogatepass')) - len(text)
+    latin_chars = max(len(text) - non_latin_chars, 0)
+
+    return (non_latin_chars // ARABIC_CHARS_PER_TOKEN) + (latin_chars // LATIN_CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    اقتطاع النص ليكون ضمن max_tokens تقريباً
+
+    يُقطع عند آخر سطر أو مسافة قبل الحد حتى لا تنقطع كلمة.
+    """
+    if max_tokens <= 0 or not text:
+        return ''
+
+    total = estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+
+    cut = int(len(text) * max_tokens / total)
+    while cut > 0 and estimate_tokens(text[:cut]) > max_tokens:
+        cut = int(cut * 0.9)
+
+    boundary = max(text.rfind('\n', 0, cut), text.rfind(' ', 0, cut))
+    if boundary > cut * 0.8:
+        cut = boundary
+
+    return text[:cut]
+
+
+class PromptBudget:
+    """
+    توزيع حد التوكنات لطلب واحد
+
+    Example:
+        budget = PromptBudget.for_feature('chat')
+        context, history = budget.allocate(base_prompt, context, history_turns)
+    """
+
+    def __init__(self, total_tokens: int, history_share: float = 0.25):
+        self.total_tokens = total_tokens
+        self.history_share = history_share
+
+    @classmethod
+    def for_feature(cls, feature: str) -> 'PromptBudget':
+        budgets = {**DEFAULT_PROMPT_BUDGETS, **getattr(settings, 'AI_PROMPT_BUDGETS', {})}
+        return cls(budgets.get(feature, DEFAULT_PROMPT_BUDGETS['chat']))
+
+    def available_for(self, instructions: str) -> int:
+        """التوكنات المتبقية بعد التعليمات الثابتة"""
+        return max(self.total_tokens - estimate_tokens(instructions), 0)
+
+    def fits(self, instructions: str, context: str) -> bool:
+        return estimate_tokens(context) <= self.available_for(instructions)
+
+    def allocate(self, instructions: str, context: str = '', history=None):
+        """
+        توزيع الميزانية على السجل والسياق
+
+        Args:
+            instructions: نص الطلب بدون سياق أو سجل
+            context: نص السياق (يُقتطع لما يتبقى)
+            history: أدوار المحادثة كنصوص بالترتيب الزمني (تُحذف الأقدم أولاً)
+
+        Returns:
+            tuple: (السياق بعد الاقتطاع، الأدوار المحتفظ بها بالترتيب الزمني)
+        """
+        remaining = self.available_for(instructions)
+
+        kept_history = []
+        if history:
+            history_budget = int(remaining * self.history_share) if context else remaining
+            for turn in reversed(history):
+                turn_tokens = estimate_tokens(turn)
+                if turn_tokens > history_budget:
+                    break
+                kept_history.insert(0, turn)
+                history_budget -= turn_tokens
+                remaining -= turn_tokens
+
+        return truncate_to_tokens(context or '', remaining), kept_history
@@ -0,0 +1,214 @@
+"""
+بنك الأسئلة المولدة مسبقاً
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+لكل (محتوى ملف، مستوى صعوبة) مجموعة كبيرة من الأسئلة تُولد في الخلفية
+عند رفع الملف أو أول طلب له. طلبات الطلاب تُخدم بالسحب العشوائي من
+البنك مع استبعاد ما سبق أن سُحب للطالب نفسه، ولا يُستدعى Gemini
+إلا لإعادة ملء البنك عند انخفاضه.
+
+البنك مرتبط ببصمة محتوى الملف وليس بالملف نفسه: استبدال ملف المحاضرة
+بمحتوى مختلف يبدأ بنكاً جديداً فلا تُسحب أسئلة عن المحتوى القديم.
+"""
+
+import hashlib
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import AIJob, QuestionBankItem, QuestionBankDraw
+from .text_extractor import get_file_hash
+
+# إعداد التسجيل
+logger = logging.getLogger(__name__)
+
+
+def get_bank_target_size():
+    """عدد الأسئلة المستهدف لكل (ملف، صعوبة)"""
+    return getattr(settings, 'AI_QUESTION_BANK_SIZE', 40)
+
+
+def get_bank_batch_size():
+    """عدد الأسئلة المطلوبة في كل طلب توليد لملء البنك"""
+    return getattr(settings, 'AI_QUESTION_BANK_BATCH', 10)
+
+
+def get_bank_hash(lecture_file):
+    """
+    بصمة المحتوى التي يرتبط بها بنك أسئلة الملف
+
+    Returns:
+        str | None: None للروابط الخارجية والملفات التي تعذرت قراءتها
+    """
+    if lecture_file.content_type == 'external_link' or not lecture_file.file:
+        return None
+    try:
+        return get_file_hash(lecture_file)
+    except (OSError, ValueError) as e:
+        logger.error(f"File hashing error for file {lecture_file.pk}: {e}")
+        return None
+
+
+def question_hash(question):
+    """بصمة نص السؤال بعد توحيد المسافات وحالة الأحرف"""
+    normalized = ' '.join(str(question.get('question', '')).split()).lower()
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def add_questions_to_bank(lecture_file, difficulty, questions):
+    """
+    إضافة أسئلة للبنك مع تجاهل المكرر والأسئلة غير الصالحة
+
+    Returns:
+        list: عناصر البنك المقابلة للأسئلة (الموجودة مسبقاً أو الجديدة)
+    """
+    content_hash = get_bank_hash(lecture_file)
+    if content_hash is None:
+        return []
+
+    items = {}
+    for question in questions:
+        if not isinstance(question, dict) or not question.get('question'):
+            continue
+        q_hash = question_hash(question)
+        items.setdefault(q_hash, QuestionBankItem(
+            content_hash=content_hash,
+            difficulty=difficulty,
+            question_json=question,
+            question_hash=q_hash,
+        ))
+
+    if not items:
+        return []
+
+    QuestionBankItem.objects.bulk_create(items.values(), ignore_conflicts=True)
+
+    return list(QuestionBankItem.objects.filter(
+        content_hash=content_hash,
+        difficulty=difficulty,
+        question_hash__in=items.keys()
+    ))
+
+
+def record_draws(user, items):
+    """تسجيل سحب الأسئلة للطالب حتى لا تتكرر عليه"""
+    QuestionBankDraw.objects.bulk_create(
+        [QuestionBankDraw(user=user, item=item) for item in items],
+        ignore_conflicts=True
+    )
+
+
+def draw_questions(user, lecture_file, difficulty, count):
+    """
+    سحب أسئلة لم يرها الطالب من البنك
+
+    Returns:
+        list | None: الأسئلة، أو None إذا لم يكن في البنك ما يكفي
+    """
+    if get_bank_hash(lecture_file) is None:
+        return None
+
+    with transaction.atomic():
+        items = list(
+            bank_items(lecture_file, difficulty)
+            .exclude(draws__user=user)
+            .order_by('?')[:count]
+        )
+
+        if len(items) < count:
+            return None
+
+        record_draws(user, items)
+
+    return [item.question_json for item in items]
+
+
+def bank_items(lecture_file, difficulty):
+    """أسئلة البنك لمحتوى الملف الحالي"""
+    content_hash = get_bank_hash(lecture_file)
+    if content_hash is None:
+        return QuestionBankItem.objects.none()
+    return QuestionBankItem.objects.filter(content_hash=content_hash, difficulty=difficulty)
+
+
+def bank_size(lecture_file, difficulty):
+    return bank_items(lecture_file, difficulty).count()
+
+
+def schedule_bank_fill(user, lecture_file, difficulty):
+    """
+    جدولة مهمة في الخلفية لملء البنك إذا كان أقل من الحجم المستهدف
+
+    لا تُنشأ مهمة جديدة إذا كانت هناك مهمة معلقة لنفس (الملف، الصعوبة)،
+    ولا يُملأ البنك داخل الطلب عند تعطيل قائمة الانتظار.
+
+    Returns:
+        AIJob | None
+    """
+    from .jobs import enqueue_job
+
+    if not getattr(settings, 'AI_JOB_QUEUE_ENABLED', False):
+        return None
+
+    if get_bank_hash(lecture_file) is None:
+        return None
+
+    if bank_size(lecture_file, difficulty) >= get_bank_target_size():
+        return None
+
+    pending = AIJob.objects.filter(
+        job_type=AIJob.QUESTION_BANK,
+        file=lecture_file,
+        status__in=[AIJob.PENDING, AIJob.RUNNING],
+        params__difficulty=difficulty
+    ).exists()
+    if pending:
+        return None
+
+    return enqueue_job(AIJob.QUESTION_BANK, user, lecture_file, difficulty=difficulty)
+
+
+def fill_bank(lecture_file, difficulty, text):
+    """
+    توليد أسئلة على دفعات حتى يبلغ البنك الحجم المستهدف
+
+    كل دفعة تُرسل معها نصوص الأسئلة الموجودة في البنك حتى لا يكررها النموذج.
+
+    Returns:
+        int: عدد الأسئلة الجديدة المضافة
+    """
+    from .context_cache import get_file_cached_context
+    from .utils import generate_questions
+
+    target = get_bank_target_size()
+    # الدفعات المتتالية تشير لنفس مرجع ذاكرة السياق بدلاً من إعادة إرسال النص
+    cached_context = get_file_cached_context(lecture_file, text)
+    batch = get_bank_batch_size()
+    added = 0
+
+    # حد لعدد الطلبات حتى لا يستهلك ملف واحد الحصة عند تكرار نفس الأسئلة
+    max_calls = (target // batch) + 2
+
+    for _ in range(max_calls):
+        current = bank_size(lecture_file, difficulty)
+        if current >= target:
+            break
+
+        existing = [
+            item['question'] for item in bank_items(lecture_file, difficulty).values_list('question_json', flat=True)
+            if isinstance(item, dict) and item.get('question')
+        ]
+        questions = generate_questions(
+            text, difficulty, min(batch, target - current),
+            cached_context=cached_context, avoid_questions=existing
+        )
+        if not questions:
+            break
+
+        before = current
+        add_questions_to_bank(lecture_file, difficulty, questions)
+        added += bank_size(lecture_file, difficulty) - before
+
+    logger.info(f"Question bank for file {lecture_file.pk} ({difficulty}): +{added}")
+    return added
@@ -0,0 +1,183 @@
+"""
+حدود استخدام AI بنافذة منزلقة في الذاكرة المؤقتة
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+بدلاً من COUNT(*) على جدول AIRateLimit في كل طلب، يُحفظ لكل
+(مستخدم، نوع طلب) عدّادان في Django cache: النافذة الحالية والسابقة.
+العدد التقديري = السابقة × الجزء المتبقي منها داخل الفترة + الحالية،
+والزيادة عبر cache.incr ذرية بين العمليات والخوادم عند استخدام
+ذاكرة مؤقتة مشتركة (Redis / Memcached).
+
+جدول AIRateLimit يبقى سجلاً دائماً:
+- تُملأ منه العدادات عند غيابها من الذاكرة المؤقتة (إعادة تشغيل أو حذف)
+- يُستخدم مباشرة إذا تعذر الوصول للذاكرة المؤقتة، أو إذا كانت خاصة بكل
+  عملية (LocMemCache الافتراضية) فلا تتفق عداداتها بين العمليات
+  (راجع checks.cache_is_shared)
+- تُحذف صفوفه القديمة بأمر ai_prune_rate_limits
+"""
+
+import math
+import time
+import logging
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .checks import cache_is_shared
+
+# إعداد التسجيل
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_KEY = 'ai:rl:{user_id}:{request_type}:{window}'
+
+
+def get_limit():
+    return getattr(settings, 'AI_RATE_LIMIT', 10)
+
+
+def get_period():
+    return getattr(settings, 'AI_RATE_LIMIT_PERIOD', 3600)
+
+
+def _window_key(user_id, request_type, window):
+    return RATE_LIMIT_KEY.format(user_id=user_id, request_type=request_type, window=window)
+
+
+def _count_rows(user_id, request_type, start, end=None):
+    """عدد الطلبات المسجلة في قاعدة البيانات بين وقتين (Unix timestamp)"""
+    from .models import AIRateLimit
+
+    query = AIRateLimit.objects.filter(
+        user_id=user_id,
+        request_time__gte=datetime.fromtimestamp(start, tz=dt_timezone.utc)
+    )
+    if end is not None:
+        query = query.filter(request_time__lt=datetime.fromtimestamp(end, tz=dt_timezone.utc))
+    if request_type != 'all':
+        query = query.filter(request_type=request_type)
+    return query.count()
+
+
+def _get_window_count(user_id, request_type, window, period):
+    """
+    عداد نافذة من الذاكرة المؤقتة، ويُملأ من قاعدة البيانات إن لم يكن موجوداً
+    """
+    key = _window_key(user_id, request_type, window)
+    count = cache.get(key)
+
+    if count is None:
+        start = window * period
+        count = _count_rows(user_id, request_type, start, start + period)
+        # add وليس set: لا نكتب فوق عداد أنشأته عملية أخرى في نفس اللحظة
+        if not cache.add(key, count, timeout=period * 2):
+            count = cache.get(key, count)
+
+    return count
+
+
+def _estimate_db(user_id, request_type, period):
+    """العدد الفعلي في آخر فترة من قاعدة البيانات (ذاكرة مؤقتة معطلة أو غير مشتركة)"""
+    return _count_rows(user_id, request_type, time.time() - period)
+
+
+def estimate_usage(user_id, request_type):
+    """
+    العدد التقديري للطلبات في آخر فترة (نافذة منزلقة)
+
+    Returns:
+        float: عدد الطلبات
+    """
+    period = get_period()
+    if not cache_is_shared():
+        return _estimate_db(user_id, request_type, period)
+
+    now = time.time()
+    window = int(now // period)
+    elapsed = (now - window * period) / period
+
+    try:
+        current = _get_window_count(user_id, request_type, window, period)
+        previous = _get_window_count(user_id, request_type, window - 1, period)
+    except Exception as e:
+        logger.warning(f"Rate limit cache unavailable, using database: {str(e)}")
+        return _estimate_db(user_id, request_type, period)
+
+    return previous * (1 - elapsed) + current
+
+
+def check(user, request_type='all'):
+    """
+    التحقق من حد الاستخدام
+
+    Returns:
+        tuple: (مسموح، المتبقي)
+    """
+    limit = get_limit()
+    used = math.ceil(estimate_usage(user.pk, request_type))
+    return used < limit, max(limit - used, 0)
+
+
+def _incr_window(user_id, request_type, window, period):
+    key = _window_key(user_id, request_type, window)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # العداد غير موجود: يُملأ من قاعدة البيانات (الصف الجديد محسوب فيها)
+        start = window * period
+        count = _count_rows(user_id, request_type, start, start + period)
+        if not cache.add(key, count, timeout=period * 2):
+            return cache.incr(key)
+        return count
+
+
+def record(user, request_type):
+    """
+    تسجيل طلب: صف في قاعدة البيانات وزيادة عدادات النافذة الحالية
+
+    Returns:
+        AIRateLimit: الصف المُنشأ
+    """
+    from .models import AIRateLimit
+
+    entry = AIRateLimit.objects.create(user=user, request_type=request_type)
+    if not cache_is_shared():
+        return entry
+
+    period = get_period()
+    window = int(entry.request_time.timestamp() // period)
+
+    try:
+        for key_type in {request_type, 'all'}:
+            _incr_window(user.pk, key_type, window, period)
+    except Exception as e:
+        logger.warning(f"Rate limit cache unavailable, recorded in database only: {str(e)}")
+
+    return entry
+
+
+def prune(older_than_seconds, batch_size=5000):
+    """
+    حذف صفوف AIRateLimit الأقدم من المدة المحددة على دفعات
+
+    Returns:
+        int: عدد الصفوف المحذوفة
+    """
+    from .models import AIRateLimit
+
+    # لا تُحذف صفوف داخل فترة الحد الحالية (تُستخدم لملء العدادات)
+    older_than_seconds = max(older_than_seconds, get_period() * 2)
+    cutoff = timezone.now() - timezone.timedelta(seconds=older_than_seconds)
+
+    deleted = 0
+    while True:
+        ids = list(
+            AIRateLimit.objects.filter(request_time__lt=cutoff)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        deleted += AIRateLimit.objects.filter(id__in=ids).delete()[0]
+
+    return deleted
@@ -0,0 +1,596 @@
+"""
+سياسة إعادة المحاولة والنماذج البديلة والطلبات المتحوطة (Hedged Requests)
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+- الأخطاء المؤقتة (429، 5xx، انقطاع الاتصال) يُعاد طلبها بانتظار تصاعدي
+  مع عشوائية كاملة (full jitter)، مع احترام مدة الانتظار التي يقترحها Gemini.
+- إذا بقي النموذج الأساسي مشغولاً تُجرب النماذج في AI_FALLBACK_MODELS بالترتيب.
+- المحادثة يمكنها إرسال طلب ثانٍ إذا تأخر الأول أكثر من AI_CHAT_HEDGE_DELAY
+  ثانية، وتُستخدم أول إجابة تصل. خيوط الطلبات المتحوطة تُغلق اتصالات قاعدة
+  البيانات عند انتهائها، والطلب الخاسر يُلغى إن لم يبدأ ويُغلق بثه إن بدأ.
+- عدد مرات سلوك كل مسار يُسجل في الذاكرة المؤقتة (get_resilience_metrics).
+- رقم المحاولة الحالية متاح عبر current_attempt (يُسجل في AIUsage).
+- قاطع الدائرة يُحاسب مرة واحدة لكل طلب منطقي: يُفحص قبل أول محاولة،
+  ويُسجل فشل واحد فقط بعد استنفاد كل المحاولات والنماذج البديلة. أخطاء
+  الطلب نفسه غير القابلة لإعادة المحاولة (مثل 400) لا تُحسب فشلاً للخدمة.
+- لكل دالة نسخة غير متزامنة (acall_with_retries، ahedged_call...) للعروض
+  غير المتزامنة، بنفس السياسة والمقاييس. عمليات الذاكرة المؤقتة فيها (قاطع
+  الدائرة والمقاييس) تُنفذ في خيط حتى لا توقف حلقة الأحداث.
+"""
+
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from .health import AIServiceUnavailable, circuit_breaker
+
+# إعداد التسجيل
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+OVERLOADED_STATUS_CODES = {429, 503}
+
+DEFAULT_RETRY_POLICY = {
+    'max_attempts': 3,      # محاولات لكل نموذج
+    'base_delay': 0.5,      # ثانية
+    'max_delay': 8.0,       # أقصى انتظار بين محاولتين
+    'max_total_wait': 20.0,  # أقصى انتظار إجمالي لطلب واحد
+}
+
+METRIC_KEY = 'ai:metrics:{name}'
+METRIC_NAMES = [
+    'calls', 'retries', 'retry_after_honored', 'fallbacks', 'fallback_successes',
+    'exhausted', 'hedges_launched', 'hedges_won',
+]
+
+# رقم المحاولة الجارية داخل call_with_retries (0 = الأولى)
+_current_attempt = contextvars.ContextVar('ai_retry_attempt', default=0)
+
+RETRY_DELAY_PATTERN = re.compile(r'retry[_ ]?(?:delay|after)["\']?\s*[:=]\s*["\']?(\d+(?:\.\d+)?)\s*s', re.IGNORECASE)
+
+
+def get_retry_policy():
+    return {**DEFAULT_RETRY_POLICY, **getattr(settings, 'AI_RETRY_POLICY', {})}
+
+
+def _in_thread(func):
+    """دالة تستدعي Django cache المتزامن، للاستخدام من سياق غير متزامن"""
+    return sync_to_async(func, thread_sensitive=False)
+
+
+# ==================== المقاييس ====================
+
+def record_metric(name, amount=1):
+    """زيادة عداد مقياس (لا يؤثر فشل الذاكرة المؤقتة على الطلب)"""
+    key = METRIC_KEY.format(name=name)
+    try:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, amount)
+    except Exception:
+        pass
+
+
+def get_resilience_metrics():
+    """
+    عدادات المسارات منذ آخر تصفير
+
+    Returns:
+        dict: اسم المقياس -> العدد (بما فيها fallback:<model>)
+    """
+    from .utils import DEFAULT_MODEL
+
+    names = METRIC_NAMES + [f'fallback:{model}' for model in get_fallback_models(DEFAULT_MODEL)]
+    values = cache.get_many([METRIC_KEY.format(name=name) for name in names])
+    return {name: values.get(METRIC_KEY.format(name=name), 0) for name in names}
+
+
+def reset_resilience_metrics():
+    from .utils import DEFAULT_MODEL
+
+    names = METRIC_NAMES + [f'fallback:{model}' for model in get_fallback_models(DEFAULT_MODEL)]
+    cache.delete_many([METRIC_KEY.format(name=name) for name in names])
+
+
+# ==================== تصنيف الأخطاء ====================
+
+def get_status_code(error):
+    """رمز حالة HTTP من أخطاء google-genai أو google-api-core أو الواجهة المحلية"""
+    for attr in ('code', 'status_code'):
+        code = getattr(error, attr, None)
+        if isinstance(code, int):
+            return code
+        code = getattr(code, 'value', None)  # grpc.StatusCode
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def is_retryable(error):
+    if isinstance(error, AIServiceUnavailable):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return get_status_code(error) in RETRYABLE_STATUS_CODES
+
+
+def is_overloaded(error):
+    return get_status_code(error) in OVERLOADED_STATUS_CODES
+
+
+def get_retry_after(error):
+    """
+    مدة الانتظار المقترحة من الخادم (ثانية) إن وُجدت
+
+    تُقرأ من ترويسة Retry-After أو من تفاصيل RetryInfo في رسالة الخطأ.
+    """
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is not None:
+        return float(retry_after)
+
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers:
+        value = headers.get('retry-after') or headers.get('Retry-After')
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+
+    match = RETRY_DELAY_PATTERN.search(str(error))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def current_attempt():
+    return _current_attempt.get()
+
+
+def get_fallback_models(primary):
+    return [model for model in getattr(settings, 'AI_FALLBACK_MODELS', []) if model != primary]
+
+
+# ==================== إعادة المحاولة ====================
+
+def _should_fall_back(models, model_index, last_error):
+    """الانتقال للنموذج البديل فقط عندما يكون السابق مشغولاً"""
+    if not is_overloaded(last_error):
+        return False
+    logger.warning(f"Gemini model {models[model_index - 1]} overloaded, falling back to {models[model_index]}")
+    record_metric('fallbacks')
+    record_metric(f'fallback:{models[model_index]}')
+    return True
+
+
+def _retry_delay(policy, started, attempt_number, model, last_error):
+    """
+    مدة الانتظار قبل إعادة المحاولة على نفس النموذج
+
+    Returns:
+        float | None: None للانتقال للنموذج التالي
+    """
+    if attempt_number == policy['max_attempts'] - 1:
+        return None
+
+    retry_after = get_retry_after(last_error)
+    if retry_after is not None and retry_after > policy['max_delay']:
+        # الخادم يطلب انتظاراً أطول من المسموح: الانتقال للنموذج البديل
+        return None
+
+    if retry_after is not None:
+        delay = retry_after
+        record_metric('retry_after_honored')
+    else:
+        delay = random.uniform(0, min(policy['max_delay'], policy['base_delay'] * 2 ** attempt_number))
+
+    if time.monotonic() - started + delay > policy['max_total_wait']:
+        return None
+
+    record_metric('retries')
+    logger.info(f"Retrying Gemini call on {model} in {delay:.2f}s after: {str(last_error)}")
+    return delay
+
+
+def _exhausted(last_error):
+    """الخطأ الذي يُرفع بعد فشل كل المحاولات (فشل واحد في قاطع الدائرة)"""
+    record_metric('exhausted')
+    circuit_breaker.record_failure()
+
+    if is_overloaded(last_error):
+        error = AIServiceUnavailable('خدمة الذكاء الاصطناعي مشغولة حالياً. يرجى المحاولة بعد قليل.')
+        error.__cause__ = last_error
+        return error
+    return last_error
+
+
+def call_with_retries(attempt, model_name):
+    """
+    تنفيذ attempt(model) مع إعادة المحاولة والنماذج البديلة
+
+    Args:
+        attempt: دالة تنفذ طلباً واحداً للنموذج المعطى
+        model_name: النموذج الأساسي
+
+    Returns:
+        نتيجة أول محاولة ناجحة
+
+    Raises:
+        AIServiceUnavailable: إذا كان قاطع الدائرة مفتوحاً
+        الخطأ الأخير إذا فشلت كل المحاولات (أو خطأ غير قابل لإعادة المحاولة فوراً)
+    """
+    circuit_breaker.before_call()
+    policy = get_retry_policy()
+    started = time.monotonic()
+    models = [model_name] + get_fallback_models(model_name)
+    last_error = None
+
+    record_metric('calls')
+    attempt_count = 0
+
+    for model_index, model in enumerate(models):
+        if model_index > 0 and not _should_fall_back(models, model_index, last_error):
+            break
+
+        for attempt_number in range(policy['max_attempts']):
+            token = _current_attempt.set(attempt_count)
+            attempt_count += 1
+            try:
+                result = attempt(model)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+            else:
+                circuit_breaker.record_success()
+                if model_index > 0:
+                    record_metric('fallback_successes')
+                return result
+            finally:
+                _current_attempt.reset(token)
+
+            delay = _retry_delay(policy, started, attempt_number, model, last_error)
+            if delay is None:
+                break
+            time.sleep(delay)
+
+    raise _exhausted(last_error)
+
+
+async def acall_with_retries(attempt, model_name):
+    """نسخة call_with_retries غير المتزامنة: attempt(model) دالة async والانتظار بـ asyncio"""
+    await _in_thread(circuit_breaker.before_call)()
+    policy = get_retry_policy()
+    started = time.monotonic()
+    models = [model_name] + get_fallback_models(model_name)
+    last_error = None
+
+    await _in_thread(record_metric)('calls')
+    attempt_count = 0
+
+    for model_index, model in enumerate(models):
+        if model_index > 0 and not await _in_thread(_should_fall_back)(models, model_index, last_error):
+            break
+
+        for attempt_number in range(policy['max_attempts']):
+            token = _current_attempt.set(attempt_count)
+            attempt_count += 1
+            try:
+                result = await attempt(model)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+            else:
+                await _in_thread(circuit_breaker.record_success)()
+                if model_index > 0:
+                    await _in_thread(record_metric)('fallback_successes')
+                return result
+            finally:
+                _current_attempt.reset(token)
+
+            delay = await _in_thread(_retry_delay)(policy, started, attempt_number, model, last_error)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+
+    raise await _in_thread(_exhausted)(last_error)
+
+
+def stream_with_retries(open_stream, model_name):
+    """
+    بث مع إعادة المحاولة قبل وصول أول جزء فقط
+
+    بعد إرسال أول جزء للمستخدم لا يُعاد الطلب حتى لا يتكرر النص.
+    """
+    def first_chunk(model):
+        stream = open_stream(model)
+        try:
+            return stream, next(stream)
+        except StopIteration:
+            return stream, None
+        except BaseException:
+            stream.close()
+            raise
+
+    stream, first = call_with_retries(first_chunk, model_name)
+
+    if first is None:
+        return
+    yield first
+    yield from stream
+
+
+async def astream_with_retries(open_stream, model_name):
+    """نسخة stream_with_retries غير المتزامنة: open_stream(model) يُرجع مولداً غير متزامن"""
+    async def first_chunk(model):
+        stream = open_stream(model)
+        try:
+            return stream, await stream.__anext__()
+        except StopAsyncIteration:
+            return stream, None
+        except BaseException:
+            await stream.aclose()
+            raise
+
+    stream, first = await acall_with_retries(first_chunk, model_name)
+
+    if first is None:
+        return
+    yield first
+    async for chunk in stream:
+        yield chunk
+
+
+# ==================== الطلبات المتحوطة ====================
+
+# بادئة أسماء خيوط الطلبات المتحوطة
+HEDGE_THREAD_PREFIX = 'ai-hedge'
+
+
+def get_hedge_delay():
+    return getattr(settings, 'AI_CHAT_HEDGE_DELAY', 0)
+
+
+def _release_thread_connections():
+    """إغلاق اتصال قاعدة البيانات إذا كان الخيط الحالي من خيوط الطلبات المتحوطة"""
+    if threading.current_thread().name.startswith(HEDGE_THREAD_PREFIX):
+        close_old_connections()
+
+
+def _run_hedge(func):
+    """تنفيذ أحد الطلبين المتحوطين في خيطه (الطلب يسجل نفسه في AIUsage)"""
+    try:
+        return func()
+    finally:
+        _release_thread_connections()
+
+
+def _hedge_executor():
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix=HEDGE_THREAD_PREFIX)
+
+
+def hedged_call(func, delay):
+    """
+    تنفيذ func() وإرسال نسخة ثانية إذا لم تنتهِ خلال delay ثانية
+
+    تُرجع أول نتيجة ناجحة. الطلب الأبطأ لا يمكن مقاطعته أثناء انتظار
+    Gemini، فيُترك ليكمل في خيطه ثم يُغلق اتصاله بقاعدة البيانات.
+    إذا فشل الطلبان يُرفع خطأ الأول.
+    """
+    if not delay or delay <= 0:
+        return func()
+
+    executor = _hedge_executor()
+    try:
+        # نسخ السياق لتمرير صاحب الطلب (ai_caller) إلى الخيوط
+        primary = executor.submit(contextvars.copy_context().run, _run_hedge, func)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        record_metric('hedges_launched')
+        hedge = executor.submit(contextvars.copy_context().run, _run_hedge, func)
+        pending = {primary, hedge}
+        first_error = None
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        record_metric('hedges_won')
+                    return future.result()
+                if first_error is None or future is primary:
+                    first_error = future.exception()
+
+        raise first_error
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _close_when_done(future):
+    """إغلاق بث الطلب الخاسر بعد انتهائه (يحرر مكانه ويسجله في AIUsage)"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    stream, _ = future.result()
+    try:
+        stream.close()
+    finally:
+        # عند الاستدعاء من خيط الطلب الخاسر بعد انتهائه
+        _release_thread_connections()
+
+
+def hedged_stream(open_stream, delay):
+    """
+    بث متحوط: يُرسل طلب ثانٍ إذا لم يصل أول جزء خلال delay ثانية،
+    ويُكمل البث من الطلب الذي يصل أول جزء منه أولاً.
+    """
+    def first_chunk():
+        stream = open_stream()
+        try:
+            return stream, next(stream)
+        except StopIteration:
+            return stream, None
+
+    if not delay or delay <= 0:
+        stream, first = first_chunk()
+    else:
+        executor = _hedge_executor()
+        try:
+            primary = executor.submit(contextvars.copy_context().run, _run_hedge, first_chunk)
+            done, _ = wait([primary], timeout=delay)
+
+            if done:
+                stream, first = primary.result()
+            else:
+                record_metric('hedges_launched')
+                hedge = executor.submit(contextvars.copy_context().run, _run_hedge, first_chunk)
+                pending = {primary, hedge}
+                winner = None
+                first_error = None
+
+                while pending and winner is None:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception() is None and winner is None:
+                            winner = future
+                        elif future.exception() is not None and (first_error is None or future is primary):
+                            first_error = future.exception()
+                        else:
+                            _close_when_done(future)
+
+                if winner is None:
+                    raise first_error
+
+                for future in pending:
+                    future.add_done_callback(_close_when_done)
+
+                if winner is hedge:
+                    record_metric('hedges_won')
+                stream, first = winner.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    if first is None:
+        return
+    yield first
+    yield from stream
+
+
+async def ahedged_call(func, delay):
+    """
+    نسخة hedged_call غير المتزامنة: func() دالة async
+
+    الطلب الخاسر يُلغى فور وصول أول نتيجة ناجحة (فيُحرر مكانه في حد التزامن).
+    """
+    if not delay or delay <= 0:
+        return await func()
+
+    primary = asyncio.ensure_future(func())
+    pending = {primary}
+
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return primary.result()
+
+        await _in_thread(record_metric)('hedges_launched')
+        hedge = asyncio.ensure_future(func())
+        pending = {primary, hedge}
+        first_error = None
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        await _in_thread(record_metric)('hedges_won')
+                    return task.result()
+                if first_error is None or task is primary:
+                    first_error = task.exception()
+
+        raise first_error
+    finally:
+        # انتظار انتهاء الإلغاء حتى يُحرر المكان ويُسجل الطلب في AIUsage
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _aclose_stream(task):
+    """إلغاء طلب البث الخاسر، أو إغلاق بثه إن كان قد وصل أول جزء منه"""
+    if not task.done():
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    if not task.cancelled() and task.exception() is None:
+        stream, _ = task.result()
+        await stream.aclose()
+
+
+async def ahedged_stream(open_stream, delay):
+    """
+    نسخة hedged_stream غير المتزامنة: open_stream() يُرجع مولداً غير متزامن،
+    والطلب الخاسر يُلغى بدلاً من تركه يكمل في الخلفية
+    """
+    async def first_chunk():
+        stream = open_stream()
+        try:
+            return stream, await stream.__anext__()
+        except StopAsyncIteration:
+            return stream, None
+
+    if not delay or delay <= 0:
+        stream, first = await first_chunk()
+    else:
+        primary = asyncio.ensure_future(first_chunk())
+        pending = {primary}
+        winner = None
+
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+
+            if done:
+                winner = primary
+            else:
+                await _in_thread(record_metric)('hedges_launched')
+                hedge = asyncio.ensure_future(first_chunk())
+                pending = {primary, hedge}
+                first_error = None
+
+                while pending and winner is None:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None and winner is None:
+                            winner = task
+                        elif task.exception() is not None:
+                            if first_error is None or task is primary:
+                                first_error = task.exception()
+                        else:
+                            await _aclose_stream(task)
+
+                if winner is None:
+                    raise first_error
+                if winner is hedge:
+                    await _in_thread(record_metric)('hedges_won')
+        finally:
+            for task in pending:
+                if task is not winner:
+                    await _aclose_stream(task)
+
+        stream, first = winner.result()
+
+    if first is None:
+        return
+    yield first
+    async for chunk in stream:
+        yield chunk
@@ -0,0 +1,273 @@
+"""
+فهرس استرجاع محلي لمقاطع ملفات المحاضرات (BM25)
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+يُبنى الفهرس مرة واحدة عند استخراج نص الملف ويُحفظ على القرص
+(ملف .npz لكل بصمة محتوى)، ثم يُستخدم في المحادثة لاختيار المقاطع
+الأقرب لسؤال الطالب بدلاً من إرسال أول 10 آلاف حرف من الملف.
+"""
+
+import os
+import re
+import logging
+import tempfile
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .normalization import normalize_for_search
+
+# إعداد التسجيل
+logger = logging.getLogger(__name__)
+
+# نسخة بنية الفهرس - ارفعها عند تعديل التقسيم أو الترميز
+INDEX_VERSION = 2
+
+# ثوابت BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# حجم المقطع التقريبي بالأحرف
+PASSAGE_CHARS = 1200
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """
+    تقسيم النص إلى كلمات للفهرسة بشكل البحث الموحد (تجاهل الكلمات ذات الحرف الواحد)
+
+    التشكيل يُحذف قبل التقسيم، فلا تنقسم الكلمة المشكولة عند علامات التشكيل.
+    """
+    return [token for token in TOKEN_PATTERN.findall(normalize_for_search(text)) if len(token) > 1]
+
+
+def split_passages(text, passage_chars=PASSAGE_CHARS):
+    """
+    تقسيم النص إلى مقاطع متقاربة الحجم على حدود الأسطر
+
+    Returns:
+        list: المقاطع بترتيبها في المستند
+    """
+    passages = []
+    current = []
+    current_len = 0
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        if current_len + len(line) > passage_chars and current:
+            passages.append('\n'.join(current))
+            current, current_len = [], 0
+
+        # سطر أطول من المقطع بمفرده
+        while len(line) > passage_chars:
+            passages.append(line[:passage_chars])
+            line = line[passage_chars:]
+
+        current.append(line)
+        current_len += len(line) + 1
+
+    if current:
+        passages.append('\n'.join(current))
+
+    return passages
+
+
+class ChunkIndex:
+    """
+    فهرس BM25 لمقاطع ملف واحد مخزن في مصفوفات NumPy
+
+    القوائم المقلوبة (postings) مرتبة حسب الكلمة، ومواضع بداية كل كلمة
+    في term_offsets، فحساب النتيجة لكل كلمة في السؤال عملية متجهة واحدة.
+    """
+
+    def __init__(self, passages, vocabulary, term_offsets, doc_ids, term_freqs, doc_lengths):
+        self.passages = passages
+        self.vocabulary = vocabulary
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+
+        doc_count = len(passages)
+        doc_freqs = np.diff(term_offsets)
+        self.idf = np.log(1 + (doc_count - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        self.avg_length = float(doc_lengths.mean()) if doc_count else 0.0
+
+    @classmethod
+    def build(cls, text):
+        """بناء الفهرس من النص الكامل"""
+        passages = split_passages(text)
+        vocabulary = {}
+        postings = []  # (term_id, doc_id, tf)
+        doc_lengths = np.zeros(len(passages), dtype=np.int32)
+
+        for doc_id, passage in enumerate(passages):
+            tokens = tokenize(passage)
+            doc_lengths[doc_id] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                postings.append((term_id, doc_id, tf))
+
+        postings_array = np.array(postings, dtype=np.int32).reshape(-1, 3)
+        postings_array = postings_array[np.argsort(postings_array[:, 0], kind='stable')]
+
+        term_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(postings_array[:, 0], minlength=len(vocabulary)), out=term_offsets[1:])
+
+        return cls(
+            passages=passages,
+            vocabulary=vocabulary,
+            term_offsets=term_offsets,
+            doc_ids=postings_array[:, 1].copy(),
+            term_freqs=postings_array[:, 2].astype(np.float32),
+            doc_lengths=doc_lengths,
+        )
+
+    def search(self, query, top_k=4):
+        """
+        أفضل المقاطع للسؤال
+
+        Returns:
+            list: أرقام المقاطع مرتبة حسب الصلة
+        """
+        scores = np.zeros(len(self.passages), dtype=np.float32)
+        if not self.passages:
+            return []
+
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / max(self.avg_length, 1.0))
+
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end]
+            scores[docs] += self.idf[term_id] * tf * (BM25_K1 + 1) / (tf + norm[docs])
+
+        ranked = np.argsort(-scores, kind='stable')[:top_k]
+        return [int(doc_id) for doc_id in ranked if scores[doc_id] > 0]
+
+    def save(self, path):
+        """حفظ الفهرس في ملف .npz (كتابة ذرية)"""
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        passage_lengths = np.array([len(p) for p in self.passages], dtype=np.int64)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(
+                    f,
+                    passages_text=np.array(''.join(self.passages)),
+                    passage_lengths=passage_lengths,
+                    terms=np.array(terms, dtype=str),
+                    term_offsets=self.term_offsets,
+                    doc_ids=self.doc_ids,
+                    term_freqs=self.term_freqs,
+                    doc_lengths=self.doc_lengths,
+                )
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            text = str(data['passages_text'])
+            offsets = np.concatenate([[0], np.cumsum(data['passage_lengths'])])
+            passages = [text[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+            terms = data['terms'].tolist()
+
+            return cls(
+                passages=passages,
+                vocabulary={term: term_id for term_id, term in enumerate(terms)},
+                term_offsets=data['term_offsets'],
+                doc_ids=data['doc_ids'],
+                term_freqs=data['term_freqs'],
+                doc_lengths=data['doc_lengths'],
+            )
+
+
+# ==================== التخزين على القرص ====================
+
+def get_index_path(content_hash):
+    """مسار ملف الفهرس لبصمة محتوى"""
+    from .text_extractor import EXTRACTOR_VERSION
+
+    index_dir = Path(getattr(settings, 'AI_INDEX_DIR', Path(settings.BASE_DIR) / 'ai_index'))
+    return index_dir / f"{content_hash}_e{EXTRACTOR_VERSION}_i{INDEX_VERSION}.npz"
+
+
+def build_index(content_hash, text):
+    """بناء فهرس النص وحفظه على القرص"""
+    index = ChunkIndex.build(text)
+    index.save(get_index_path(content_hash))
+    _load_index_cached.cache_clear()
+    return index
+
+
+@lru_cache(maxsize=32)
+def _load_index_cached(path):
+    return ChunkIndex.load(path)
+
+
+def load_index(content_hash):
+    """
+    تحميل فهرس من القرص (مع ذاكرة مؤقتة في العملية)
+
+    Returns:
+        ChunkIndex | None
+    """
+    path = get_index_path(content_hash)
+    if not path.exists():
+        return None
+    return _load_index_cached(path)
+
+
+def get_relevant_context(lecture_file, question, top_k=None):
+    """
+    المقاطع الأقرب لسؤال الطالب من ملف المحاضرة
+
+    يُبنى الفهرس عند الحاجة إن لم يكن قد بُني وقت الاستخراج.
+    المقاطع المختارة تُعاد بترتيبها في المستند للحفاظ على تسلسل الأفكار.
+
+    Returns:
+        str | None: نص السياق
+    """
+    from .text_extractor import get_file_hash, get_file_text
+
+    if lecture_file.content_type == 'external_link' or not lecture_file.file:
+        return None
+
+    top_k = top_k or getattr(settings, 'AI_RETRIEVAL_TOP_K', 4)
+
+    try:
+        content_hash = get_file_hash(lecture_file)
+        index = load_index(content_hash)
+
+        if index is None:
+            text = get_file_text(lecture_file)
+            if not text:
+                return None
+            index = load_index(content_hash) or build_index(content_hash, text)
+    except (OSError, ValueError) as e:
+        logger.error(f"Retrieval index error for file {lecture_file.pk}: {e}")
+        return get_file_text(lecture_file)
+
+    passage_ids = index.search(question, top_k=top_k)
+
+    # لا توجد كلمات مشتركة: بداية الملف كسياق عام
+    if not passage_ids:
+        passage_ids = list(range(min(top_k, len(index.passages))))
+
+    return '\n...\n'.join(index.passages[i] for i in sorted(passage_ids))
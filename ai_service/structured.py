@@ -0,0 +1,182 @@
+"""
+المخرجات المنظمة (JSON) لتوليد الأسئلة
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+- QUESTIONS_SCHEMA يُرسل مع الطلب (response_schema) ليلتزم Gemini بالبنية
+- iter_json_array_items يستخرج عناصر مصفوفة JSON فور اكتمال كل عنصر
+  أثناء البث، فلا يضيع الرد كاملاً بسبب خطأ في عنصر واحد أو انقطاع البث
+- validate_question يتحقق من كل سؤال ويوحد شكله
+- build_study_pack_schema: مخطط حزمة المذاكرة (الملخصات الثلاثة والأسئلة في رد واحد)
+"""
+
+import json
+
+QUESTION_DIFFICULTIES = ['easy', 'medium', 'hard']
+QUESTION_OPTIONS_COUNT = 4
+
+# مخطط الرد بصيغة OpenAPI التي يقبلها Gemini (response_schema)
+QUESTIONS_SCHEMA = {
+    'type': 'ARRAY',
+    'items': {
+        'type': 'OBJECT',
+        'properties': {
+            'question': {'type': 'STRING'},
+            'options': {
+                'type': 'ARRAY',
+                'items': {'type': 'STRING'},
+                'minItems': QUESTION_OPTIONS_COUNT,
+                'maxItems': QUESTION_OPTIONS_COUNT,
+            },
+            'correct_answer': {'type': 'STRING'},
+            'explanation': {'type': 'STRING'},
+            'difficulty': {'type': 'STRING', 'enum': QUESTION_DIFFICULTIES},
+        },
+        'required': ['question', 'options', 'correct_answer', 'explanation'],
+        'propertyOrdering': ['question', 'options', 'correct_answer', 'explanation', 'difficulty'],
+    },
+}
+
+STUDY_PACK_SUMMARY_TYPES = ['brief', 'detailed', 'key_points']
+
+
+def build_study_pack_schema(include_questions=False):
+    """مخطط رد حزمة المذاكرة: نص Markdown لكل نوع ملخص، ومصفوفة أسئلة اختيارية"""
+    properties = {summary_type: {'type': 'STRING'} for summary_type in STUDY_PACK_SUMMARY_TYPES}
+    if include_questions:
+        properties['questions'] = {'type': 'ARRAY', 'items': QUESTIONS_SCHEMA['items']}
+
+    return {
+        'type': 'OBJECT',
+        'properties': properties,
+        'required': list(properties),
+        'propertyOrdering': list(properties),
+    }
+
+
+def validate_question(item, difficulty):
+    """
+    التحقق من سؤال اختيار من متعدد وتوحيد شكله
+
+    Returns:
+        dict | None: السؤال بعد التوحيد، أو None إذا كان غير صالح
+    """
+    if not isinstance(item, dict):
+        return None
+
+    question = item.get('question')
+    options = item.get('options')
+    correct = item.get('correct_answer')
+
+    if not isinstance(question, str) or not question.strip():
+        return None
+    if not isinstance(options, list) or len(options) != QUESTION_OPTIONS_COUNT:
+        return None
+
+    options = [str(option).strip() for option in options]
+    if not all(options) or len(set(options)) != len(options):
+        return None
+
+    # قبول رقم الخيار بدلاً من نصه
+    if isinstance(correct, int) and 0 <= correct < len(options):
+        correct = options[correct]
+    if not isinstance(correct, str) or correct.strip() not in options:
+        return None
+
+    explanation = item.get('explanation')
+
+    return {
+        'question': question.strip(),
+        'options': options,
+        'correct_answer': correct.strip(),
+        'explanation': explanation.strip() if isinstance(explanation, str) else '',
+        'difficulty': difficulty,
+    }
+
+
+def iter_json_array_items(chunks):
+    """
+    استخراج عناصر مصفوفة JSON من نص يصل على أجزاء
+
+    يتجاهل ما قبل أول '[' (مثل علامات ```json). العنصر الذي لا يمكن
+    تحليله يُتخطى حتى الفاصلة التالية في نفس المستوى.
+
+    Yields:
+        عناصر المصفوفة بترتيبها
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+
+    for chunk in chunks:
+        buffer += chunk
+
+        if not started:
+            start = buffer.find('[')
+            if start == -1:
+                continue
+            position = start + 1
+            started = True
+
+        while True:
+            # تخطي المسافات والفواصل بين العناصر
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+
+            if position >= len(buffer) or buffer[position] == ']':
+                break
+
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                skip_to = _skip_malformed(buffer, position)
+                if skip_to is None:
+                    break  # العنصر لم يكتمل بعد - انتظار الجزء التالي
+                position = skip_to
+                continue
+
+            yield item
+            position = end
+
+        # حذف ما تمت معالجته حتى لا يكبر النص المؤقت
+        if position > 4096:
+            buffer = buffer[position:]
+            position = 0
+
+
+def _skip_malformed(buffer, position):
+    """
+    موضع نهاية عنصر غير صالح (الفاصلة أو ']' في نفس المستوى)
+
+    Returns:
+        int | None: None إذا لم يكتمل العنصر في النص الحالي
+    """
+    depth = 0
+    in_string = False
+    escaped = False
+
+    for index in range(position, len(buffer)):
+        char = buffer[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            depth += 1
+        elif char in '}]':
+            if depth == 0:
+                return index
+            depth -= 1
+            if depth == 0:
+                return index + 1
+        elif char == ',' and depth == 0:
+            return index + 1
+
+    return None
@@ -1,3 +1,1451 @@
-from django.test import TestCase
+"""
+اختبارات خدمة الذكاء الاصطناعي
+S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
 
-# Create your tests here.
+تعمل بالكامل دون شبكة عبر الواجهة المحلية FakeBackend.
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import shutil
+import datetime
+import tempfile
+import threading
+from io import StringIO
+from unittest import skipUnless
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, AsyncRequestFactory, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User, Role, Major, Level, UserActivity
+from core.models import Semester, Course, LectureFile
+from .concurrency import AIServiceBusy, ai_caller, acall_slot, call_slot, get_queue_stats, _poll, _release_slot, _wait
+from .backends import FakeBackend, FakeAPIError, set_backend, get_backend
+from .models import (
+    AISummary, AIQuestion, AIChat, AIRateLimit, GeminiContextCache, AIUsage, AIUsageDaily, AIJob, AIConversation,
+    SharedSummary, ExtractedText, QuestionBankItem
+)
+from . import async_views
+from .jobs import enqueue_job, run_job
+from .metering import rollup_day
+from .pipeline import prepare_uploaded_file, schedule_file_processing
+from .question_bank import bank_size, draw_questions, fill_bank
+from .rate_limit import prune
+from .resilience import HEDGE_THREAD_PREFIX, get_resilience_metrics
+from .structured import iter_json_array_items, validate_question
+from .extraction_pool import ExtractionPool, ExtractionError
+from .normalization import normalize_text
+from .prompt_budget import PromptBudget, estimate_tokens
+from .retrieval import ChunkIndex, build_index, get_index_path, load_index, tokenize
+from .text_extractor import extract_pdf_pages, get_file_text, join_pages, page_for_offset, read_document
+from .health import (
+    AIServiceUnavailable, CircuitBreaker, CIRCUIT_OPEN_UNTIL_KEY, HEALTH_PROBE_LOCK_KEY, HEALTH_STATUS_KEY,
+    circuit_breaker, get_api_status
+)
+from .checks import check_shared_cache
+from .utils import (
+    generate_content, generate_questions, generate_chat_response, generate_chat_response_stream,
+    agenerate_chat_response, generate_long_summary, split_text_into_chunks, _map_summaries
+)
+
+TEMP_DIR = tempfile.mkdtemp()
+
+
+# ==================== الواجهة المحلية ====================
+
+class FakeBackendTests(TestCase):
+
+    def test_questions_prompt_returns_requested_count(self):
+        backend = FakeBackend(latency='none', seed=1)
+        set_backend(backend)
+        self.addCleanup(set_backend, None)
+
+        questions = generate_questions('نص المحاضرة ' * 50, 'hard', 7)
+
+        self.assertEqual(len(questions), 7)
+        self.assertTrue(all(q['difficulty'] == 'hard' for q in questions))
+        self.assertIn(questions[0]['correct_answer'], questions[0]['options'])
+
+    def test_summary_prompt_returns_markdown(self):
+        backend = FakeBackend(latency='none')
+        self.assertTrue(backend.generate('لخص النص التالي', 'fake').startswith('## '))
+
+    def test_error_rate_raises_simulated_errors(self):
+        backend = FakeBackend(latency='none', error_rate=1.0, seed=1)
+
+        with self.assertRaises(FakeAPIError) as ctx:
+            backend.generate('prompt', 'fake')
+        self.assertIn(ctx.exception.code, (429, 500, 503))
+
+    def test_error_rate_is_approximate(self):
+        backend = FakeBackend(latency='none', error_rate=0.2, seed=42)
+        failures = 0
+        for _ in range(1000):
+            try:
+                backend.generate('prompt', 'fake')
+            except FakeAPIError:
+                failures += 1
+
+        self.assertTrue(150 < failures < 250, failures)
+
+    def test_latency_distributions(self):
+        self.assertEqual(FakeBackend(latency='fixed', latency_mean=0.3).sample_latency(), 0.3)
+        self.assertEqual(FakeBackend(latency='none').sample_latency(), 0.0)
+
+        uniform = FakeBackend(latency='uniform', latency_mean=1.0, latency_sigma=0.5, seed=1)
+        self.assertTrue(all(0.5 <= uniform.sample_latency() <= 1.5 for _ in range(100)))
+
+        lognormal = FakeBackend(latency='lognormal', latency_mean=1.0, latency_sigma=0.5, seed=1)
+        samples = sorted(lognormal.sample_latency() for _ in range(1001))
+        self.assertAlmostEqual(samples[500], 1.0, delta=0.15)
+
+    def test_stream_yields_full_response(self):
+        backend = FakeBackend(latency='none', stream_chunks=5)
+        prompt = 'سؤال المستخدم الحالي: ما هو التعريف؟'
+
+        chunks = list(backend.generate_stream(prompt, 'fake'))
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), backend.generate(prompt, 'fake'))
+
+    @override_settings(AI_BACKEND='fake', AI_FAKE_BACKEND={'latency': 'none'})
+    def test_backend_selected_from_settings(self):
+        set_backend(None)
+        self.addCleanup(set_backend, None)
+
+        self.assertIsInstance(get_backend(), FakeBackend)
+        self.assertTrue(generate_content('لخص'))
+
+
+# ==================== حدود الاستخدام ====================
+
+@override_settings(AI_RATE_LIMIT=3, AI_RATE_LIMIT_PERIOD=3600)
+class RateLimitTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('student1', 'pass12345', full_name='طالب', id_card_number='1')
+
+    def test_limit_reached(self):
+        for _ in range(3):
+            self.assertTrue(AIRateLimit.check_rate_limit(self.user, 'chat')[0])
+            AIRateLimit.record_request(self.user, 'chat')
+
+        self.assertEqual(AIRateLimit.check_rate_limit(self.user, 'chat'), (False, 0))
+        self.assertEqual(AIRateLimit.check_rate_limit(self.user, 'summary'), (True, 3))
+        self.assertEqual(AIRateLimit.check_rate_limit(self.user, 'all'), (False, 0))
+
+    def test_counters_restored_from_database(self):
+        AIRateLimit.record_request(self.user, 'chat')
+        AIRateLimit.record_request(self.user, 'chat')
+        cache.clear()
+
+        self.assertEqual(AIRateLimit.check_rate_limit(self.user, 'chat'), (True, 1))
+        AIRateLimit.record_request(self.user, 'chat')
+        self.assertEqual(AIRateLimit.check_rate_limit(self.user, 'chat'), (False, 0))
+
+    def test_prune_keeps_current_period(self):
+        old = AIRateLimit.record_request(self.user, 'chat')
+        AIRateLimit.objects.filter(pk=old.pk).update(request_time=timezone.now() - timezone.timedelta(days=40))
+        AIRateLimit.record_request(self.user, 'chat')
+
+        self.assertEqual(prune(30 * 86400), 1)
+        self.assertEqual(AIRateLimit.objects.count(), 1)
+
+    def test_process_local_cache_counts_from_database(self):
+        AIRateLimit.record_request(self.user, 'chat')
+
+        # عدادات LocMemCache لا تراها العمليات الأخرى فلا تُستخدم
+        self.assertIsNone(cache.get(f'ai:rl:{self.user.pk}:chat:{int(time.time() // 3600)}'))
+        self.assertEqual(AIRateLimit.check_rate_limit(self.user, 'chat'), (True, 2))
+
+        with override_settings(DEBUG=False):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['ai_service.W001'])
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(TEMP_DIR, 'cache'),
+    }
+})
+class SharedCacheRateLimitTests(RateLimitTests):
+    """نفس الاختبارات مع ذاكرة مؤقتة مشتركة بين العمليات: العدادات في الذاكرة المؤقتة"""
+
+    def test_process_local_cache_counts_from_database(self):
+        AIRateLimit.record_request(self.user, 'chat')
+
+        self.assertEqual(cache.get(f'ai:rl:{self.user.pk}:chat:{int(time.time() // 3600)}'), 1)
+        self.assertEqual(check_shared_cache(None), [])
+
+
+# ==================== الطلبات المتزامنة ====================
+
+@override_settings(AI_MAX_CONCURRENT_CALLS=2, AI_MAX_CONCURRENT_CALLS_PER_USER=1, AI_CALL_WAIT_TIMEOUT=0.2)
+class ConcurrencyLimitTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_per_user_limit_leaves_room_for_others(self):
+        with ai_caller(1), call_slot():
+            with self.assertRaises(AIServiceBusy):
+                with ai_caller(1), call_slot():
+                    pass
+
+            with ai_caller(2), call_slot():
+                self.assertEqual(get_queue_stats()['in_flight'], 2)
+
+        self.assertEqual(get_queue_stats()['in_flight'], 0)
+
+    def test_global_limit(self):
+        with ai_caller(1), call_slot(), ai_caller(2), call_slot():
+            with self.assertRaises(AIServiceBusy):
+                with ai_caller(3), call_slot():
+                    pass
+
+        self.assertEqual(get_queue_stats(), {'capacity': 2, 'in_flight': 0, 'waiting': 0})
+
+    def test_waiting_users_served_round_robin(self):
+        self.assertTrue(_poll('a', 'a0', 1, 0, 60))
+        pending = [('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1')]
+        for user, ticket in pending:
+            self.assertFalse(_poll(user, ticket, 1, 0, 60))
+        self.assertEqual(get_queue_stats()['waiting'], 4)
+
+        served = []
+        lease = 'a0'
+        while pending:
+            _wait(_release_slot(lease))
+            lease = next(ticket for user, ticket in pending if _poll(user, ticket, 1, 0, 60))
+            served.append(lease)
+            pending = [entry for entry in pending if entry[1] != lease]
+
+        # طلب المستخدم b لا ينتظر كل طلبات a التي سبقته
+        self.assertEqual(served, ['a1', 'b1', 'a2', 'a3'])
+
+    def test_release_frees_only_its_own_slot(self):
+        # مكان انتهت صلاحيته وحجزه طلب آخر
+        self.assertTrue(_poll('a', 'expired', 1, 0, -1))
+        self.assertTrue(_poll('b', 'current', 1, 0, 60))
+
+        _wait(_release_slot('expired'))
+        _wait(_release_slot('expired'))
+
+        self.assertEqual(get_queue_stats()['in_flight'], 1)
+        self.assertFalse(_poll('c', 'next', 1, 0, 60))
+
+
+# ==================== قاطع الدائرة ====================
+
+class CircuitBreakerTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+    def expire_open_period(self):
+        cache.set(CIRCUIT_OPEN_UNTIL_KEY, time.time() - 1)
+
+    def test_shared_breaker_reads_settings_lazily(self):
+        self.addCleanup(circuit_breaker.record_success)
+        with override_settings(AI_CIRCUIT_FAILURE_THRESHOLD=1, AI_CIRCUIT_RESET_TIMEOUT=30):
+            self.assertEqual(circuit_breaker.failure_threshold, 1)
+            self.assertEqual(circuit_breaker.reset_timeout, 30)
+            circuit_breaker.record_failure()
+            self.assertTrue(circuit_breaker.is_open())
+        self.assertEqual(self.breaker.failure_threshold, 2)
+
+    def test_opens_after_threshold_and_allows_one_trial(self):
+        self.breaker.record_failure()
+        self.breaker.before_call()
+        self.breaker.record_failure()
+
+        self.assertTrue(self.breaker.is_open())
+        with self.assertRaises(AIServiceUnavailable):
+            self.breaker.before_call()
+
+        # نصف مفتوح: طلب تجريبي واحد، وفشله يعيد فتح الدائرة
+        self.expire_open_period()
+        self.breaker.before_call()
+        with self.assertRaises(AIServiceUnavailable):
+            self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open())
+
+        # نجاح الطلب التجريبي يغلق الدائرة ويصفر العداد
+        self.expire_open_period()
+        self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.is_open())
+        self.breaker.record_failure()
+        self.breaker.before_call()
+
+    def test_open_circuit_reported_without_probing(self):
+        cache.set(HEALTH_STATUS_KEY, {'status': 'connected', 'checked_at': time.time()})
+        self.assertEqual(get_api_status()['status'], 'connected')
+
+        cache.set(CIRCUIT_OPEN_UNTIL_KEY, time.time() + 60)
+        self.assertEqual(get_api_status()['status'], 'error')
+        self.assertIsNone(cache.get(HEALTH_PROBE_LOCK_KEY))
+
+
+# ==================== إعادة المحاولة والنماذج البديلة ====================
+
+def join_hedge_threads():
+    """انتظار خيوط الطلبات المتحوطة الخاسرة حتى لا تكتب في اختبارات لاحقة"""
+    for thread in threading.enumerate():
+        if thread.name.startswith(HEDGE_THREAD_PREFIX):
+            thread.join(timeout=5)
+
+
+class ScriptedBackend(FakeBackend):
+    """واجهة تُرجع أخطاء محددة مسبقاً بالترتيب ثم تنجح"""
+
+    def __init__(self, errors=(), delays=None):
+        super().__init__(latency='none')
+        self.errors = list(errors)
+        self.delays = list(delays or [])
+        self.models = []
+
+    def generate(self, prompt, model_name, cached_content=None, response_schema=None):
+        self.models.append(model_name)
+        if self.delays:
+            time.sleep(self.delays.pop(0))
+        if self.errors:
+            error = self.errors.pop(0)
+            if error:
+                raise error
+        return f'ok:{model_name}'
+
+    async def agenerate(self, prompt, model_name, cached_content=None, response_schema=None):
+        self.models.append(model_name)
+        if self.delays:
+            await asyncio.sleep(self.delays.pop(0))
+        if self.errors:
+            error = self.errors.pop(0)
+            if error:
+                raise error
+        return f'ok:{model_name}'
+
+
+@override_settings(
+    AI_RETRY_POLICY={'max_attempts': 2, 'base_delay': 0.01, 'max_delay': 0.05, 'max_total_wait': 1},
+    AI_FALLBACK_MODELS=['backup-model'],
+)
+class ResilienceTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(set_backend, None)
+        self.addCleanup(join_hedge_threads)
+
+    def test_transient_error_is_retried(self):
+        backend = ScriptedBackend([FakeAPIError(503, 'overloaded')])
+        set_backend(backend)
+
+        self.assertEqual(generate_content('x', 'primary'), 'ok:primary')
+        self.assertEqual(backend.models, ['primary', 'primary'])
+        self.assertEqual(get_resilience_metrics()['retries'], 1)
+
+    def test_each_attempt_is_metered(self):
+        set_backend(ScriptedBackend([FakeAPIError(503, 'overloaded')]))
+
+        generate_content('x', 'primary')
+
+        usage = list(AIUsage.objects.order_by('id').values_list('outcome', 'retry_count', 'feature'))
+        self.assertEqual(usage, [(AIUsage.ERROR, 0, 'other'), (AIUsage.SUCCESS, 1, 'other')])
+
+    def test_overloaded_model_falls_back(self):
+        backend = ScriptedBackend([FakeAPIError(429, 'quota'), FakeAPIError(429, 'quota')])
+        set_backend(backend)
+
+        self.assertEqual(generate_content('x', 'primary'), 'ok:backup-model')
+        self.assertEqual(get_resilience_metrics()['fallback:backup-model'], 1)
+
+    def test_long_retry_after_skips_to_fallback(self):
+        error = FakeAPIError(429, 'quota')
+        error.retry_after = 60
+        backend = ScriptedBackend([error])
+        set_backend(backend)
+
+        self.assertEqual(generate_content('x', 'primary'), 'ok:backup-model')
+        self.assertEqual(backend.models, ['primary', 'backup-model'])
+
+    def test_non_retryable_error_is_raised_immediately(self):
+        backend = ScriptedBackend([FakeAPIError(400, 'bad request')])
+        set_backend(backend)
+
+        with self.assertRaises(FakeAPIError):
+            generate_content('x', 'primary')
+        self.assertEqual(backend.models, ['primary'])
+
+    def test_exhausted_overload_is_reported_as_unavailable(self):
+        set_backend(ScriptedBackend([FakeAPIError(503, 'overloaded')] * 4))
+
+        with self.assertRaises(AIServiceUnavailable):
+            generate_content('x', 'primary')
+
+    @override_settings(
+        AI_CIRCUIT_FAILURE_THRESHOLD=5,
+        AI_RETRY_POLICY={'max_attempts': 3, 'base_delay': 0.001, 'max_delay': 0.01, 'max_total_wait': 1},
+    )
+    def test_circuit_counts_logical_calls_not_attempts(self):
+        breaker = CircuitBreaker()
+        self.assertEqual(breaker.failure_threshold, 5)
+
+        # طلب واحد فشلت خمس من محاولاته ثم نجح لا يفتح الدائرة
+        set_backend(ScriptedBackend([FakeAPIError(503, 'overloaded')] * 5))
+        self.assertEqual(generate_content('x', 'primary'), 'ok:backup-model')
+        self.assertFalse(breaker.is_open())
+
+        # أخطاء الطلب نفسه لا تُحسب
+        for _ in range(5):
+            set_backend(ScriptedBackend([FakeAPIError(400, 'bad request')]))
+            with self.assertRaises(FakeAPIError):
+                generate_content('x', 'primary')
+        self.assertFalse(breaker.is_open())
+
+        # خمسة طلبات استنفدت محاولاتها تفتح الدائرة
+        for _ in range(5):
+            set_backend(ScriptedBackend([FakeAPIError(500, 'internal')] * 3))
+            with self.assertRaises(FakeAPIError):
+                generate_content('x', 'primary')
+        self.assertTrue(breaker.is_open())
+        with self.assertRaises(AIServiceUnavailable):
+            generate_content('x', 'primary')
+
+    @override_settings(AI_CHAT_HEDGE_DELAY=0.05)
+    def test_hedged_chat_uses_faster_response(self):
+        backend = ScriptedBackend(delays=[0.5, 0])
+        set_backend(backend)
+
+        started = time.monotonic()
+        self.assertTrue(generate_chat_response('ما هو الفهرس؟').startswith('ok:'))
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(get_resilience_metrics()['hedges_won'], 1)
+
+        # الطلب الخاسر يكمل في خيطه ويحرر مكانه قبل انتهاء الاختبار
+        join_hedge_threads()
+        self.assertEqual(len(backend.models), 2)
+        self.assertEqual(get_queue_stats()['in_flight'], 0)
+
+    @override_settings(AI_CHAT_HEDGE_DELAY=0.05)
+    def test_async_hedged_chat_cancels_slower_request(self):
+        backend = ScriptedBackend([FakeAPIError(503, 'overloaded')], delays=[0, 0.5, 0])
+        set_backend(backend)
+
+        started = time.monotonic()
+        answer = async_to_sync(agenerate_chat_response)('ما هو الفهرس؟')
+
+        self.assertTrue(answer.startswith('ok:'))
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(get_resilience_metrics()['retries'], 1)
+        self.assertEqual(get_resilience_metrics()['hedges_won'], 1)
+        self.assertTrue(AIUsage.objects.filter(outcome=AIUsage.CANCELLED).exists())
+
+    @override_settings(AI_CHAT_HEDGE_DELAY=0.05)
+    def test_hedged_chat_stream(self):
+        set_backend(FakeBackend(latency='none'))
+
+        answer = ''.join(generate_chat_response_stream('ما هو الفهرس؟'))
+        self.assertIn('بناءً على محتوى الملف', answer)
+
+
+# ==================== تلخيص المستندات الطويلة ====================
+
+class ChunkBackend(FakeBackend):
+    """واجهة تُرجع ملاحظات باسم الجزء، والأجزاء الأولى أبطأ حتى تنتهي بغير ترتيبها"""
+
+    def __init__(self, failing=()):
+        super().__init__(latency='none')
+        self.failing = set(failing)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.reduce_prompts = []
+
+    def generate(self, prompt, model_name, cached_content=None, response_schema=None):
+        match = re.search(r'هذا الجزء (\d+) من (\d+)', prompt)
+        if not match:
+            self.reduce_prompts.append(prompt)
+            return super().generate(prompt, model_name, cached_content, response_schema)
+
+        index, total = int(match.group(1)), int(match.group(2))
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(0.01 * (total - index))
+            if index in self.failing:
+                raise FakeAPIError(400, 'bad request')
+            return f'ملاحظات الجزء {index}'
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+@override_settings(AI_SUMMARY_MAX_WORKERS=8, AI_MAX_CONCURRENT_CALLS_PER_USER=2, AI_CALL_WAIT_TIMEOUT=0)
+class MapSummariesTests(TransactionTestCase):
+    """الأجزاء تُلخص في خيوط تسجل استخدامها في قاعدة البيانات"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(set_backend, None)
+        self.chunks = [f'نص الجزء {index}' for index in range(1, 7)]
+        self.user = User.objects.create_user('student1', 'pass12345', full_name='طالب', id_card_number='1')
+
+    def test_partials_keep_chunk_order_within_user_limit(self):
+        backend = ChunkBackend()
+        set_backend(backend)
+
+        with ai_caller(self.user):
+            partials = _map_summaries(self.chunks, 'ar')
+
+        self.assertEqual(partials, [f'ملاحظات الجزء {index}' for index in range(1, 7)])
+        self.assertEqual(backend.max_active, 2)
+
+    @override_settings(AI_SUMMARY_CHUNK_TOKENS=80)
+    def test_long_summary_reduces_partials_in_document_order(self):
+        backend = ChunkBackend()
+        set_backend(backend)
+        text = '\n'.join(f'الفقرة {index}: ' + 'كلمة ' * 30 for index in range(1, 7))
+        total = len(split_text_into_chunks(text, 80))
+        self.assertGreater(total, 2)
+
+        with ai_caller(self.user):
+            summary = generate_long_summary(text, 'brief')
+
+        self.assertTrue(summary)
+        self.assertEqual(len(backend.reduce_prompts), 1)
+        prompt = backend.reduce_prompts[0]
+        positions = [prompt.index(f'## الجزء {index}\nملاحظات الجزء {index}') for index in range(1, total + 1)]
+        self.assertEqual(positions, sorted(positions))
+
+    def test_failed_chunk_keeps_completed_ones(self):
+        set_backend(ChunkBackend(failing={3}))
+
+        with ai_caller(self.user):
+            partials = _map_summaries(self.chunks, 'ar')
+
+        self.assertEqual(partials[2], '')
+        self.assertEqual(partials[:2] + partials[3:], [f'ملاحظات الجزء {index}' for index in (1, 2, 4, 5, 6)])
+
+        set_backend(ChunkBackend(failing=range(1, 7)))
+        with ai_caller(self.user), self.assertRaises(FakeAPIError):
+            _map_summaries(self.chunks, 'ar')
+
+
+# ==================== المخرجات المنظمة ====================
+
+def make_question(number, **overrides):
+    options = [f'خيار {number}-{i}' for i in range(4)]
+    question = {
+        'question': f'السؤال رقم {number}',
+        'options': options,
+        'correct_answer': options[1],
+        'explanation': 'شرح',
+    }
+    question.update(overrides)
+    return question
+
+
+class PartialQuestionsBackend(FakeBackend):
+    """يبث ردوداً محددة مسبقاً مقسمة على أجزاء صغيرة"""
+
+    def __init__(self, replies):
+        super().__init__(latency='none')
+        self.replies = list(replies)
+        self.prompts = []
+
+    def generate_stream(self, prompt, model_name, cached_content=None, response_schema=None):
+        self.prompts.append(prompt)
+        reply = self.replies.pop(0)
+        for start in range(0, len(reply), 7):
+            yield reply[start:start + 7]
+
+
+class StructuredOutputTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(set_backend, None)
+
+    def test_items_parsed_incrementally_skipping_malformed(self):
+        text = '```json\n[' + json.dumps(make_question(1)) + ', {"question": "x" "bad"}, ' + json.dumps(make_question(2)) + ']```'
+        chunks = [text[i:i + 5] for i in range(0, len(text), 5)]
+
+        items = list(iter_json_array_items(chunks))
+
+        self.assertEqual([item['question'] for item in items], ['السؤال رقم 1', 'السؤال رقم 2'])
+
+    def test_validate_question(self):
+        self.assertIsNotNone(validate_question(make_question(1), 'easy'))
+        self.assertEqual(validate_question(make_question(1, correct_answer=2), 'easy')['correct_answer'], 'خيار 1-2')
+        self.assertIsNone(validate_question(make_question(1, correct_answer='غير موجود'), 'easy'))
+        self.assertIsNone(validate_question(make_question(1, options=['أ', 'ب']), 'easy'))
+        self.assertIsNone(validate_question('سؤال', 'easy'))
+
+    def test_only_missing_questions_are_requested_again(self):
+        first = json.dumps([make_question(1), make_question(2, correct_answer='؟'), make_question(3)], ensure_ascii=False)
+        # الرد الثاني يتضمن سؤالاً مكرراً يُتجاهل
+        second = json.dumps([make_question(1), make_question(4)], ensure_ascii=False)
+        backend = PartialQuestionsBackend([first, second])
+        set_backend(backend)
+
+        questions = generate_questions('نص المحاضرة ' * 50, 'medium', 3)
+
+        self.assertEqual([q['question'] for q in questions], ['السؤال رقم 1', 'السؤال رقم 3', 'السؤال رقم 4'])
+        self.assertIn('قم بإنشاء 1 أسئلة', backend.prompts[1])
+        self.assertIn('- السؤال رقم 1', backend.prompts[1])
+
+    def test_truncated_stream_keeps_complete_items(self):
+        reply = json.dumps([make_question(1), make_question(2)], ensure_ascii=False)
+        backend = PartialQuestionsBackend([reply[:-40], json.dumps([make_question(5)], ensure_ascii=False)])
+        set_backend(backend)
+
+        questions = generate_questions('نص المحاضرة ' * 50, 'medium', 2)
+
+        self.assertEqual([q['question'] for q in questions], ['السؤال رقم 1', 'السؤال رقم 5'])
+
+
+# ==================== استخراج النصوص ====================
+
+def make_pdf(pages):
+    """ملف PDF بسيط بصفحة لكل نص (خط Helvetica)"""
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for text in pages:
+        stream = f'BT /F1 12 Tf 72 720 Td ({text}) Tj ET'
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+        objects.append(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>'
+        )
+        kids.append(f'{len(objects)} 0 R')
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} >>'
+
+    output = '%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += f'{number} 0 obj\n{body}\nendobj\n'
+    xref = len(output)
+    output += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'
+    output += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets)
+    output += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'
+    return output.encode('latin-1')
+
+
+class TextExtractionTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = f'{directory}/pages.pdf'
+        with open(self.path, 'wb') as f:
+            f.write(make_pdf([f'Page {number} about database indexes' for number in range(1, 6)]))
+
+    def test_pdf_pages_with_offsets(self):
+        text, page_offsets = extract_pdf_pages(self.path)
+
+        self.assertEqual(len(page_offsets), 5)
+        position = text.index('Page 3')
+        self.assertEqual(page_for_offset(page_offsets, position), 3)
+        self.assertEqual(page_for_offset(page_offsets, len(text) - 1), 5)
+        self.assertEqual(page_for_offset([], position), None)
+
+    def test_pptx_slides_and_notes_in_order(self):
+        from pptx import Presentation
+        from pptx.util import Inches
+
+        presentation = Presentation()
+        for number in (1, 2):
+            slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+            slide.shapes.title.text = f'Slide {number} title'
+            slide.placeholders[1].text = f'Slide {number} body'
+            slide.notes_slide.notes_text_frame.text = f'Notes {number}'
+        table = slide.shapes.add_table(1, 2, Inches(1), Inches(4), Inches(4), Inches(1)).table
+        table.cell(0, 0).text, table.cell(0, 1).text = 'Index', 'B-tree'
+        path = self.path.replace('pages.pdf', 'slides.pptx')
+        presentation.save(path)
+
+        text, page_offsets = read_document(path, 'pptx')
+
+        self.assertEqual(len(page_offsets), 2)
+        self.assertLess(text.index('Slide 1 body'), text.index('Notes 1'))
+        self.assertLess(text.index('Notes 1'), text.index('Slide 2 title'))
+        self.assertIn('Index | B-tree', text)
+        self.assertEqual(page_for_offset(page_offsets, text.index('Notes 2')), 2)
+
+    def test_xlsx_rows_per_sheet(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        workbook.active.title = 'Grades'
+        workbook.active.append(['Student', 'Score'])
+        workbook.active.append(['Ali', 95])
+        workbook.create_sheet('Empty')
+        workbook.create_sheet('Topics').append(['Indexes', None, 'Joins'])
+        path = self.path.replace('pages.pdf', 'sheet.xlsx')
+        workbook.save(path)
+
+        text, page_offsets = read_document(path, 'xlsx')
+
+        self.assertEqual(len(page_offsets), 3)
+        self.assertIn('# Grades\nStudent | Score\nAli | 95', text)
+        self.assertIn('Indexes | Joins', text)
+        self.assertNotIn('Empty', text)
+
+    def test_pool_extracts_and_recycles_workers(self):
+        pool = ExtractionPool(workers=1, max_jobs_per_worker=2)
+        self.addCleanup(pool.shutdown)
+
+        text, page_offsets, _ = pool.extract(self.path, 'pdf')
+        self.assertIn('Page 5', text)
+        self.assertEqual(len(page_offsets), 5)
+
+        first_worker = pool._idle[0]
+        pool.extract(self.path, 'pdf')
+        # العملية تُستبدل بعد حد الملفات
+        self.assertEqual(pool._idle, [])
+        self.assertFalse(first_worker.process.is_alive())
+
+    def test_pool_reports_structured_errors(self):
+        pool = ExtractionPool(workers=1)
+        self.addCleanup(pool.shutdown)
+
+        broken = self.path.replace('pages.pdf', 'broken.pdf')
+        with open(broken, 'wb') as f:
+            f.write(b'not a pdf')
+        with self.assertRaises(ExtractionError) as raised:
+            pool.extract(broken, 'pdf')
+        self.assertEqual(raised.exception.as_dict()['code'], ExtractionError.FAILED)
+
+        # العملية سليمة بعد خطأ المكتبة فتُعاد للاستخدام
+        self.assertEqual(len(pool._idle), 1)
+
+    def test_pool_kills_worker_after_timeout(self):
+        pool = ExtractionPool(workers=1, timeout=0.01)
+        self.addCleanup(pool.shutdown)
+
+        with self.assertRaises(ExtractionError) as raised:
+            pool.extract(self.path, 'pdf')
+        self.assertEqual(raised.exception.code, ExtractionError.TIMEOUT)
+        self.assertEqual(pool._idle, [])
+
+    @skipUnless(os.path.exists('/proc/self/limits'), 'requires /proc')
+    def test_pool_worker_address_space_limited(self):
+        pool = ExtractionPool(workers=1, max_memory_mb=2048)
+        self.addCleanup(pool.shutdown)
+        pool.extract(self.path, 'pdf')
+
+        with open(f'/proc/{pool._idle[0].process.pid}/limits') as f:
+            limit = next(line for line in f if line.startswith('Max address space'))
+        self.assertEqual(limit.split()[3], str(2048 * 1024 * 1024))
+
+
+class NormalizationTests(TestCase):
+
+    def test_normalize_text(self):
+        raw = '  الـــدَّرْسُ   الأَوَّل\u200f:  ﻻ  ﺑﺪ\r\n\n\n\nﷲ  '
+        self.assertEqual(normalize_text(raw), 'الدرس الأول: لا بد\n\nالله')
+        self.assertEqual(normalize_text(normalize_text(raw)), normalize_text(raw))
+        self.assertLess(estimate_tokens(normalize_text(raw)), estimate_tokens(raw))
+
+    def test_repeated_headers_and_footers_removed(self):
+        topics = ['الفهارس', 'المعاملات', 'الاستعلامات', 'التطبيع']
+        pages = [
+            f'جامعة صنعاء - كلية الحاسوب\nدرس عن {topic}\nشرح {topic}\nأمثلة {topic}\n- {number} -'
+            for number, topic in enumerate(topics, 1)
+        ]
+
+        text, page_offsets = join_pages(iter(pages))
+
+        self.assertNotIn('جامعة صنعاء', text)
+        self.assertNotIn('- 2 -', text)
+        self.assertEqual(page_for_offset(page_offsets, text.index('شرح التطبيع')), 4)
+
+    def test_search_form_folds_letter_variants(self):
+        self.assertEqual(tokenize('أَحْمَدُ إلى المدرسةِ ٣٣'), ['احمد', 'الي', 'المدرسه', '33'])
+
+        index = ChunkIndex.build('مقدمة\nالمدرسة الأولى في قواعد البيانات')
+        self.assertEqual(index.search('المدرسه الاولى'), [0])
+
+
+# ==================== فهرس الاسترجاع ====================
+
+class RetrievalIndexTests(TestCase):
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir, ignore_errors=True)
+        topics = ['الفهارس', 'المعاملات', 'الاستعلامات', 'التطبيع']
+        # كل موضوع في مقطع مستقل (الأسطر أطول من نصف المقطع)
+        self.text = '\n'.join(f'درس عن {topic}: ' + f'{topic} في قواعد البيانات ' * 40 for topic in topics)
+
+    def test_search_ranks_matching_passage_first(self):
+        index = ChunkIndex.build(self.text)
+
+        self.assertEqual(len(index.passages), 4)
+        self.assertEqual(index.search('ما هي المعاملات؟')[0], 1)
+        # كلمة موجودة في كل المقاطع لا ترجح مقطعاً على آخر
+        self.assertEqual(index.search('شرح التطبيع في قواعد البيانات')[0], 3)
+        self.assertEqual(index.search('الشبكات العصبية'), [])
+        self.assertEqual(len(index.search('قواعد البيانات', top_k=2)), 2)
+
+    def test_build_index_saved_and_loaded(self):
+        with override_settings(AI_INDEX_DIR=self.index_dir):
+            built = build_index('a' * 64, self.text)
+            loaded = load_index('a' * 64)
+
+            self.assertTrue(get_index_path('a' * 64).exists())
+            self.assertIsNone(load_index('b' * 64))
+
+        self.assertEqual(loaded.passages, built.passages)
+        self.assertEqual(loaded.vocabulary, built.vocabulary)
+        for query in ('الفهارس', 'الاستعلامات في قواعد البيانات'):
+            self.assertEqual(loaded.search(query), built.search(query))
+
+
+# ==================== ميزانية التوكنات ====================
+
+class PromptBudgetTests(TestCase):
+
+    def setUp(self):
+        # 100 توكن للتعليمات من 300، فيتبقى 200
+        self.budget = PromptBudget(300)
+        self.instructions = 'x' * 400
+        self.context = 'word ' * 400
+        self.turns = [f'turn {number} ' + 'a' * 153 for number in range(3)]  # 40 توكن لكل دور
+
+    def test_context_truncated_to_remaining_tokens(self):
+        self.assertEqual(estimate_tokens('نص عربي'), 3)
+        self.assertEqual(self.budget.available_for(self.instructions), 200)
+        self.assertFalse(self.budget.fits(self.instructions, self.context))
+
+        context, history = self.budget.allocate(self.instructions, self.context)
+
+        self.assertEqual(history, [])
+        self.assertLessEqual(estimate_tokens(context), 200)
+        self.assertGreater(estimate_tokens(context), 190)
+        self.assertTrue(self.context.startswith(context) and context.endswith('word'))
+
+    def test_history_share_keeps_newest_turns(self):
+        # حصة السجل ربع المتبقي (50 توكن): الدور الأحدث فقط
+        context, history = self.budget.allocate(self.instructions, self.context, self.turns)
+        self.assertEqual(history, self.turns[-1:])
+        self.assertLessEqual(estimate_tokens(context), 160)
+
+        # بدون سياق يأخذ السجل كل المتبقي بترتيبه الزمني
+        self.assertEqual(self.budget.allocate(self.instructions, '', self.turns), ('', self.turns))
+
+    def test_instructions_over_budget_leave_nothing(self):
+        self.assertEqual(self.budget.allocate('x' * 2000, self.context, self.turns), ('', []))
+
+    @override_settings(AI_PROMPT_BUDGETS={'chat': 1234})
+    def test_feature_budgets_from_settings(self):
+        self.assertEqual(PromptBudget.for_feature('chat').total_tokens, 1234)
+        self.assertEqual(PromptBudget.for_feature('summary').total_tokens, 8000)
+        self.assertEqual(PromptBudget.for_feature('unknown').total_tokens, 5000)
+
+
+# ==================== العروض (بدون شبكة) ====================
+
+class RecordingBackend(FakeBackend):
+    """واجهة محلية تسجل الطلبات ومراجع ذاكرة السياق المستخدمة"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.prompts = []
+        self.cached_requests = []
+
+    def generate(self, prompt, model_name, cached_content=None, response_schema=None):
+        self.prompts.append(prompt)
+        if cached_content:
+            self.cached_requests.append(cached_content)
+        return super().generate(prompt, model_name, cached_content, response_schema)
+
+
+def parse_sse(body):
+    """أحداث Server-Sent Events كقائمة (اسم الحدث أو None، البيانات)"""
+    events = []
+    for block in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((fields.get('event'), json.loads(fields['data'])))
+    return events
+
+
+def call_async_view(view, user, data):
+    """تنفيذ عرض غير متزامن وقراءة جسم الاستجابة (بما فيه البث)"""
+    async def call():
+        request = AsyncRequestFactory().post('/ai/', data)
+        request.user = user
+
+        async def auser():
+            return user
+        request.auser = auser
+
+        response = await view(request)
+        if not response.streaming:
+            return response, response.content.decode()
+        body = [part async for part in response.streaming_content]
+        return response, b''.join(body).decode()
+
+    return async_to_sync(call)()
+
+
+def create_lecture_file():
+    """طالب وملف محاضرة نصي في مقرر من الفصل الحالي"""
+    role = Role.objects.create(name=Role.STUDENT)
+    major = Major.objects.create(name='علوم الحاسوب')
+    level = Level.objects.create(name='المستوى الأول', level_number=1)
+    semester = Semester.objects.create(
+        name='الفصل الأول', academic_year='2026', semester_number=1,
+        start_date=datetime.date.today(), end_date=datetime.date.today(), is_current=True
+    )
+    course = Course.objects.create(code='CS101', name='مقدمة', level=level, semester=semester)
+
+    user = User.objects.create_user(
+        'student1', 'pass12345', full_name='طالب', id_card_number='1',
+        role=role, major=major, level=level, account_status='active'
+    )
+    lecture_file = LectureFile(course=course, uploader=user, title='المحاضرة الأولى')
+    lecture_file.file.save(
+        'lecture.txt',
+        ContentFile(('هذا نص تجريبي لمحاضرة عن قواعد البيانات والفهارس. ' * 100).encode()),
+        save=False
+    )
+    lecture_file.save()
+    return user, lecture_file
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_DIR,
+    AI_INDEX_DIR=TEMP_DIR,
+    AI_JOB_QUEUE_ENABLED=False,
+    AI_QUESTION_BANK_PREFILL=[],
+)
+class AIViewsOfflineTests(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_DIR, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        set_backend(FakeBackend(latency='none', seed=1))
+        self.addCleanup(set_backend, None)
+
+        self.user, self.lecture_file = create_lecture_file()
+        self.client.force_login(self.user)
+
+    def test_summary_generate(self):
+        response = self.client.post(
+            reverse('ai_service:summary_generate', args=[self.lecture_file.id]),
+            {'summary_type': 'brief'}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        summary = AISummary.objects.get(user=self.user)
+        self.assertIn('ملخص المحاضرة', summary.summary_text)
+
+    def test_extracted_text_persisted_by_content_hash(self):
+        text = get_file_text(self.lecture_file)
+
+        stored = ExtractedText.objects.get()
+        self.assertEqual(stored.text, text)
+        self.assertEqual(stored.char_count, len(text))
+
+        # الطلبات التالية تقرأ النص المخزن ولا تعيد الاستخراج (حتى بعد مسح الذاكرة المؤقتة)
+        ExtractedText.objects.update(text='نص مخزن')
+        cache.clear()
+        self.assertEqual(get_file_text(self.lecture_file), 'نص مخزن')
+
+        # ملف آخر بنفس المحتوى يشترك في نفس السجل
+        copy = LectureFile(course=self.lecture_file.course, uploader=self.user, title='نسخة')
+        self.lecture_file.file.open('rb')
+        with self.lecture_file.file:
+            copy.file.save('copy.txt', ContentFile(self.lecture_file.file.read()), save=False)
+        copy.save()
+        self.assertEqual(get_file_text(copy), 'نص مخزن')
+        self.assertEqual(ExtractedText.objects.count(), 1)
+
+    def test_summary_shared_across_users(self):
+        backend = RecordingBackend(latency='none')
+        set_backend(backend)
+        url = reverse('ai_service:summary_generate', args=[self.lecture_file.id])
+        self.client.post(url, {'summary_type': 'brief'})
+
+        other = User.objects.create_user(
+            'student2', 'pass12345', full_name='طالب آخر', id_card_number='2',
+            role=self.user.role, major=self.user.major, level=self.user.level, account_status='active'
+        )
+        self.client.force_login(other)
+        response = self.client.post(url, {'summary_type': 'brief'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(backend.prompts), 1)
+        shared = SharedSummary.objects.get()
+        self.assertEqual(shared.hit_count, 1)
+        self.assertEqual(AISummary.objects.get(user=other).summary_text, shared.summary_text)
+
+        # نوع آخر من الملخص يُولد من جديد
+        self.client.post(url, {'summary_type': 'detailed'})
+        self.assertEqual(len(backend.prompts), 2)
+        self.assertEqual(SharedSummary.objects.count(), 2)
+
+    def test_summary_generate_rejects_unknown_type(self):
+        response = self.client.post(
+            reverse('ai_service:summary_generate', args=[self.lecture_file.id]),
+            {'summary_type': 'bullet_points'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response, _ = self._call_async_view(
+            lambda request: async_views.ai_summary_generate_view(request, self.lecture_file.id),
+            {'summary_type': 'bullet_points'}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(AIJob.objects.exists())
+        self.assertFalse(AIRateLimit.objects.filter(user=self.user).exists())
+
+    def test_questions_generate(self):
+        response = self.client.post(
+            reverse('ai_service:questions_generate', args=[self.lecture_file.id]),
+            {'difficulty': 'easy', 'questions_count': 5}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        questions = AIQuestion.objects.get(user=self.user)
+        self.assertEqual(questions.questions_count, 5)
+
+    def test_study_pack_single_call(self):
+        backend = FakeBackend(latency='none', seed=1)
+        set_backend(backend)
+
+        response = self.client.post(
+            reverse('ai_service:study_pack_generate', args=[self.lecture_file.id]),
+            {'language': 'ar', 'include_questions': '1'}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(
+            sorted(AISummary.objects.filter(user=self.user).values_list('summary_type', flat=True)),
+            ['brief', 'detailed', 'key_points']
+        )
+        self.assertEqual(AIQuestion.objects.get(user=self.user).questions_count, 5)
+        self.assertEqual(AIRateLimit.objects.filter(user=self.user).count(), 1)
+
+    def test_chat_stream(self):
+        response = self.client.post(
+            reverse('ai_service:chat_stream'),
+            {'question': 'ما هي الفهارس؟', 'file_id': self.lecture_file.id}
+        )
+        body = b''.join(response.streaming_content).decode()
+
+        self.assertIn('event: done', body)
+        self.assertEqual(AIChat.objects.filter(user=self.user).count(), 1)
+
+    def test_chat_stream_events(self):
+        response = self.client.post(
+            reverse('ai_service:chat_stream'),
+            {'question': 'ما هي الفهارس؟', 'file_id': self.lecture_file.id}
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream; charset=utf-8')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+        events = parse_sse(b''.join(response.streaming_content).decode())
+        deltas = [data['delta'] for event, data in events if event is None]
+        last_event, done = events[-1]
+
+        # كل الأجزاء تسبق حدث done، ومجموعها هو الإجابة المحفوظة
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual(last_event, 'done')
+        chat = AIChat.objects.get(user=self.user)
+        self.assertEqual(''.join(deltas), chat.answer)
+        self.assertEqual(done['chat_id'], chat.id)
+        self.assertEqual(done['conversation_id'], AIConversation.objects.get().pk)
+
+    def _call_async_view(self, view, data):
+        return call_async_view(view, self.user, data)
+
+    def test_async_chat_views(self):
+        response, body = self._call_async_view(
+            async_views.ai_chat_stream_view,
+            {'question': 'ما هي الفهارس؟', 'file_id': self.lecture_file.id}
+        )
+
+        self.assertIn('event: done', body)
+        self.assertEqual(AIUsage.objects.get(feature='chat').file_id, self.lecture_file.id)
+
+        response, body = self._call_async_view(async_views.ai_chat_send_view, {'question': 'وما فائدتها؟'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AIChat.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(AIRateLimit.objects.filter(user=self.user, request_type='chat').count(), 2)
+
+    @override_settings(AI_CONTEXT_CACHE_MIN_TOKENS=100)
+    def test_chat_reuses_context_cache(self):
+        backend = RecordingBackend(latency='none')
+        set_backend(backend)
+        url = reverse('ai_service:chat_send')
+
+        for _ in range(2):
+            self.client.post(url, {'question': 'ما هي الفهارس؟', 'file_id': self.lecture_file.id})
+
+        entry = GeminiContextCache.objects.get()
+        self.assertEqual(len(backend.caches), 1)
+        self.assertEqual(backend.cached_requests, [entry.cache_name, entry.cache_name])
+        self.assertEqual(entry.hit_count, 1)
+
+    @override_settings(AI_CONTEXT_CACHE_MIN_TOKENS=100)
+    def test_expired_context_cache_falls_back_to_full_prompt(self):
+        backend = RecordingBackend(latency='none')
+        set_backend(backend)
+        url = reverse('ai_service:chat_send')
+
+        self.client.post(url, {'question': 'سؤال أول', 'file_id': self.lecture_file.id})
+        backend.caches.clear()  # انتهت صلاحية المرجع لدى المزود
+
+        response = self.client.post(url, {'question': 'سؤال ثانٍ', 'file_id': self.lecture_file.id})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(GeminiContextCache.objects.exists())
+        self.assertIn('قواعد البيانات', backend.prompts[-1])
+
+    def test_chat_stream_reports_backend_error(self):
+        set_backend(FakeBackend(latency='none', error_rate=1.0, seed=1))
+
+        response = self.client.post(reverse('ai_service:chat_stream'), {'question': 'سؤال'})
+        body = b''.join(response.streaming_content).decode()
+
+        self.assertIn('event: error', body)
+        self.assertFalse(AIChat.objects.filter(user=self.user).exists())
+
+    def test_chat_stream_error_hides_details_and_logs_no_activity(self):
+        set_backend(FakeBackend(latency='none', error_rate=1.0, seed=1))
+
+        for view in (None, async_views.ai_chat_stream_view):
+            if view is None:
+                response = self.client.post(reverse('ai_service:chat_stream'), {'question': 'سؤال'})
+                body = b''.join(response.streaming_content).decode()
+            else:
+                _, body = self._call_async_view(view, {'question': 'سؤال'})
+
+            (event, data), = parse_sse(body)
+            self.assertEqual(event, 'error')
+            self.assertNotIn('simulated', data['error'])
+            self.assertNotIn('خطأ في المحادثة', data['error'])
+        self.assertFalse(UserActivity.objects.filter(user=self.user, action=UserActivity.AI_CHAT).exists())
+
+        set_backend(FakeBackend(latency='none'))
+        self.client.post(
+            reverse('ai_service:chat_stream'), {'question': 'سؤال', 'file_id': self.lecture_file.id}
+        ).getvalue()
+        activity = UserActivity.objects.get(user=self.user, action=UserActivity.AI_CHAT)
+        self.assertEqual(activity.details['chat_id'], AIChat.objects.get().id)
+
+    def test_chat_stream_records_usage(self):
+        self.client.post(
+            reverse('ai_service:chat_stream'),
+            {'question': 'ما هي الفهارس؟', 'file_id': self.lecture_file.id}
+        ).getvalue()
+
+        usage = AIUsage.objects.get()
+        self.assertEqual((usage.feature, usage.user, usage.file), ('chat', self.user, self.lecture_file))
+        self.assertEqual(usage.outcome, AIUsage.SUCCESS)
+        self.assertGreater(usage.prompt_tokens, 0)
+        self.assertGreater(usage.response_tokens, 0)
+        self.assertGreater(usage.extraction_time, 0)
+
+    def test_usage_rollup_and_report(self):
+        url = reverse('ai_service:chat_send')
+        for question in ('سؤال أول', 'سؤال ثانٍ'):
+            self.client.post(url, {'question': question, 'file_id': self.lecture_file.id})
+
+        self.assertEqual(rollup_day(timezone.localdate()), 1)
+        daily = AIUsageDaily.objects.get()
+        self.assertEqual((daily.feature, daily.calls, daily.errors), ('chat', 2, 0))
+        self.assertGreater(daily.estimated_cost, 0)
+
+        # الصفحة للمسؤول فقط
+        self.assertEqual(self.client.get(reverse('ai_service:usage_report')).status_code, 302)
+        self.user.role = Role.objects.create(name=Role.ADMIN)
+        self.user.save()
+        response = self.client.get(reverse('ai_service:usage_report'))
+        self.assertContains(response, 'المحاضرة الأولى')
+
+    @override_settings(AI_JOB_QUEUE_ENABLED=True, AI_CHAT_RECENT_TURNS=1)
+    def test_chat_history_compressed_into_session_summary(self):
+        backend = RecordingBackend(latency='none')
+        set_backend(backend)
+        url = reverse('ai_service:chat_send')
+
+        for question in ('السؤال الأول عن الفهارس', 'السؤال الثاني عن الجداول'):
+            self.client.post(url, {'question': question, 'file_id': self.lecture_file.id})
+
+        # الدور الأول خرج من النافذة الأخيرة: مهمة واحدة لضغطه
+        self.assertEqual(AIJob.objects.filter(job_type=AIJob.CHAT_SUMMARY).count(), 1)
+        job = run_job(AIJob.claim_next())
+        self.assertEqual(job.status, AIJob.DONE)
+
+        conversation = AIConversation.objects.get()
+        self.assertTrue(conversation.summary)
+        self.assertEqual(conversation.messages.count(), 4)
+
+        self.client.post(url, {'question': 'السؤال الثالث', 'file_id': self.lecture_file.id})
+
+        prompt = backend.prompts[-1]
+        self.assertIn('ملخص المحادثة حتى الآن', prompt)
+        self.assertIn('السؤال الثاني عن الجداول', prompt)
+        self.assertNotIn('السؤال الأول عن الفهارس', prompt)
+        self.assertEqual(AIConversation.objects.count(), 1)
+
+    @override_settings(AI_JOB_QUEUE_ENABLED=True, AI_QUESTION_BANK_PREFILL=['medium'])
+    def test_uploaded_file_prepared_in_background(self):
+        job = schedule_file_processing(self.user, self.lecture_file)
+        self.assertEqual(run_job(AIJob.claim_next()).status, AIJob.DONE)
+
+        self.lecture_file.refresh_from_db()
+        self.assertEqual(self.lecture_file.processing_status, LectureFile.PROCESSING_READY)
+        self.assertEqual(self.lecture_file.content_hash, ExtractedText.objects.get().content_hash)
+        self.assertEqual(job.job_type, AIJob.PREPARE_FILE)
+
+        # بنك الأسئلة يُجدول بعد تجهيز النص
+        self.assertTrue(AIJob.objects.filter(job_type=AIJob.QUESTION_BANK, status=AIJob.PENDING).exists())
+
+        link = LectureFile.objects.create(
+            course=self.lecture_file.course, uploader=self.user, title='رابط',
+            content_type='external_link', external_url='https://example.com'
+        )
+        self.assertIsNone(schedule_file_processing(self.user, link))
+        self.assertEqual(link.processing_status, LectureFile.PROCESSING_SKIPPED)
+
+    def test_uploaded_file_prepared_inline_without_queue(self):
+        self.assertIsNone(schedule_file_processing(self.user, self.lecture_file))
+
+        self.lecture_file.refresh_from_db()
+        self.assertEqual(self.lecture_file.processing_status, LectureFile.PROCESSING_READY)
+        self.assertFalse(AIJob.objects.exists())
+
+    @override_settings(AI_JOB_QUEUE_ENABLED=True)
+    def test_upload_scheduling_error_marks_file_failed(self):
+        # مستخدم غير محفوظ: إنشاء المهمة يفشل
+        self.assertIsNone(prepare_uploaded_file(User(full_name='ghost'), self.lecture_file))
+
+        self.lecture_file.refresh_from_db()
+        self.assertEqual(self.lecture_file.processing_status, LectureFile.PROCESSING_FAILED)
+        self.assertTrue(self.lecture_file.processing_error)
+        self.assertFalse(AIJob.objects.exists())
+
+    @override_settings(AI_JOB_QUEUE_ENABLED=True)
+    def test_prepare_files_command_backfills_pending_files(self):
+        # نص الملف الأول مستخرج من قبل (طالب استخدمه قبل التجهيز عند الرفع)
+        schedule_file_processing(self.user, self.lecture_file)
+        run_job(AIJob.claim_next())
+        LectureFile.objects.update(processing_status=LectureFile.PROCESSING_PENDING)
+
+        other = LectureFile(course=self.lecture_file.course, uploader=self.user, title='المحاضرة الثانية')
+        other.file.save('other.txt', ContentFile('نص آخر لم يُستخرج بعد. '.encode() * 50), save=False)
+        other.save()
+
+        out = StringIO()
+        call_command('ai_prepare_files', stdout=out)
+
+        self.lecture_file.refresh_from_db()
+        self.assertEqual(self.lecture_file.processing_status, LectureFile.PROCESSING_READY)
+        self.assertEqual(AIJob.objects.get(status=AIJob.PENDING).file, other)
+        self.assertIn('جاهز: 1', out.getvalue())
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_DIR,
+    AI_INDEX_DIR=TEMP_DIR,
+    AI_JOB_QUEUE_ENABLED=False,
+    AI_QUESTION_BANK_PREFILL=[],
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'ai_test_cache'}},
+)
+class AsyncViewsDatabaseCacheTests(TransactionTestCase):
+    """
+    DatabaseCache يرفض الاستدعاء من حلقة الأحداث، فيكشف أي عملية ذاكرة
+    مؤقتة متزامنة في مسار العروض غير المتزامنة (وعملياته تجري في خيوط)
+    """
+
+    def setUp(self):
+        call_command('createcachetable', verbosity=0)
+        cache.clear()
+        set_backend(FakeBackend(latency='none', seed=1))
+        self.addCleanup(set_backend, None)
+
+        self.user, self.lecture_file = create_lecture_file()
+
+    def test_async_chat_views(self):
+        response, body = call_async_view(
+            async_views.ai_chat_stream_view, self.user,
+            {'question': 'ما هي الفهارس؟', 'file_id': self.lecture_file.id}
+        )
+        self.assertIn('event: done', body)
+
+        response, _ = call_async_view(async_views.ai_chat_send_view, self.user, {'question': 'وما فائدتها؟'})
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(AIChat.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(get_queue_stats()['in_flight'], 0)
+        self.assertEqual(get_resilience_metrics()['calls'], 2)
+
+    def test_async_call_slot(self):
+        async def hold_slot():
+            async with acall_slot():
+                return (await sync_to_async(get_queue_stats)())['in_flight']
+
+        self.assertEqual(async_to_sync(hold_slot)(), 1)
+        self.assertEqual(get_queue_stats()['in_flight'], 0)
+
+
+# ==================== مهام الخلفية ====================
+
+@override_settings(MEDIA_ROOT=TEMP_DIR, AI_INDEX_DIR=TEMP_DIR, AI_JOB_QUEUE_ENABLED=True)
+class AIJobQueueTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        set_backend(FakeBackend(latency='none', seed=1))
+        self.addCleanup(set_backend, None)
+
+        self.user, self.lecture_file = create_lecture_file()
+
+    def test_jobs_claimed_oldest_first_and_once(self):
+        first = enqueue_job(AIJob.SUMMARY, self.user, self.lecture_file, summary_type='brief')
+        second = enqueue_job(AIJob.QUESTIONS, self.user, self.lecture_file, difficulty='easy', count=3)
+        self.assertEqual(first.status, AIJob.PENDING)
+
+        claimed = AIJob.claim_next()
+        self.assertEqual(claimed, first)
+        self.assertEqual(claimed.status, AIJob.RUNNING)
+        self.assertIsNotNone(claimed.started_at)
+
+        self.assertEqual(AIJob.claim_next(), second)
+        self.assertIsNone(AIJob.claim_next())
+
+        job = run_job(claimed)
+        self.assertEqual(job.status, AIJob.DONE)
+        self.assertEqual(AISummary.objects.get(pk=job.result_id).user, self.user)
+
+    def test_stale_running_jobs_requeued(self):
+        stale = enqueue_job(AIJob.SUMMARY, self.user, self.lecture_file, summary_type='brief')
+        recent = enqueue_job(AIJob.SUMMARY, self.user, self.lecture_file, summary_type='detailed')
+        AIJob.claim_next()
+        AIJob.claim_next()
+        AIJob.objects.filter(pk=stale.pk).update(started_at=timezone.now() - datetime.timedelta(minutes=10))
+
+        self.assertEqual(AIJob.requeue_stale(60), 1)
+
+        stale.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertEqual((stale.status, stale.started_at), (AIJob.PENDING, None))
+        self.assertEqual(recent.status, AIJob.RUNNING)
+        self.assertEqual(AIJob.claim_next(), stale)
+
+
+# ==================== بنك الأسئلة ====================
+
+class StreamRecordingBackend(FakeBackend):
+    """واجهة محلية تسجل طلبات البث (توليد الأسئلة يستخدم البث)"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.prompts = []
+
+    def generate_stream(self, prompt, model_name, cached_content=None, response_schema=None):
+        self.prompts.append(prompt)
+        return super().generate_stream(prompt, model_name, cached_content, response_schema)
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_DIR,
+    AI_INDEX_DIR=TEMP_DIR,
+    AI_JOB_QUEUE_ENABLED=False,
+    AI_QUESTION_BANK_SIZE=6,
+    AI_QUESTION_BANK_BATCH=3,
+)
+class QuestionBankTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.backend = StreamRecordingBackend(latency='none', seed=1)
+        set_backend(self.backend)
+        self.addCleanup(set_backend, None)
+
+        self.user, self.lecture_file = create_lecture_file()
+        self.text = get_file_text(self.lecture_file)
+
+    def test_fill_then_draw_without_repeats(self):
+        self.assertEqual(fill_bank(self.lecture_file, 'medium', self.text), 6)
+        self.assertEqual(bank_size(self.lecture_file, 'medium'), 6)
+
+        # الدفعة الثانية تُرسل معها أسئلة الدفعة الأولى
+        first_batch = list(QuestionBankItem.objects.order_by('pk')[:3])
+        for item in first_batch:
+            self.assertIn(item.question_json['question'], self.backend.prompts[-1])
+
+        first = draw_questions(self.user, self.lecture_file, 'medium', 3)
+        second = draw_questions(self.user, self.lecture_file, 'medium', 3)
+        self.assertEqual(len({q['question'] for q in first + second}), 6)
+        self.assertIsNone(draw_questions(self.user, self.lecture_file, 'medium', 1))
+
+        # الملء مرة أخرى لا يطلب شيئاً والبنك ممتلئ
+        calls = len(self.backend.prompts)
+        self.assertEqual(fill_bank(self.lecture_file, 'medium', self.text), 0)
+        self.assertEqual(len(self.backend.prompts), calls)
+
+    def test_replaced_file_starts_new_bank(self):
+        fill_bank(self.lecture_file, 'medium', self.text)
+        old_hash = QuestionBankItem.objects.values_list('content_hash', flat=True).first()
+
+        self.lecture_file.file.save('replaced.txt', ContentFile('محتوى مختلف تماماً. '.encode() * 50))
+
+        self.assertEqual(bank_size(self.lecture_file, 'medium'), 0)
+        self.assertIsNone(draw_questions(self.user, self.lecture_file, 'medium', 1))
+        self.assertEqual(QuestionBankItem.objects.filter(content_hash=old_hash).count(), 6)
+
+
+# ==================== الحساب المسبق ====================
+
+@override_settings(MEDIA_ROOT=TEMP_DIR, AI_INDEX_DIR=TEMP_DIR)
+class AIPrecomputeCommandTests(TransactionTestCase):
+    """التوليد يجري في خيوط، فتحتاج البيانات أن تكون محفوظة فعلاً"""
+
+    def setUp(self):
+        cache.clear()
+        self.user, self.lecture_file = create_lecture_file()
+
+    def test_precompute_command_resumes_from_checkpoint(self):
+        checkpoint = f'{TEMP_DIR}/precompute.json'
+        recorder = RecordingBackend(latency='none', seed=1)
+        set_backend(recorder)
+        self.addCleanup(set_backend, None)
+
+        call_command('ai_precompute', checkpoint=checkpoint, extract_workers=1, stdout=StringIO())
+
+        # الأنواع الثلاثة في طلب واحد
+        self.assertEqual(len(recorder.prompts), 1)
+        self.assertEqual(SharedSummary.objects.count(), 3)
+        with open(checkpoint, encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['done'], [self.lecture_file.id])
+
+        # إعادة التشغيل تتخطى الملفات المكتملة
+        output = StringIO()
+        call_command('ai_precompute', checkpoint=checkpoint, stdout=output)
+        self.assertEqual(len(recorder.prompts), 1)
+        self.assertIn('تلخيص 0 ملف', output.getvalue())
@@ -1,85 +1,315 @@
 """
 استخراج النصوص من الملفات
 S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
+
+ملفات PDF تُقرأ صفحة بصفحة (iter_pdf_pages) وتُجمع في قائمة مع بداية
+كل صفحة في النص (page_offsets)، فيمكن معرفة رقم الصفحة لأي موضع في
+النص (page_for_offset).
+شرائح PowerPoint وأوراق Excel تُعامل كصفحات بنفس الطريقة.
+النص يُوحد (normalization) مرة واحدة هنا قبل تخزينه.
 """
 
-import os
-from pathlib import Path
+import bisect
+import hashlib
+import logging
+
+from django.core.cache import cache
+
+from .retrieval import build_index
+from .metering import note_extraction_time
+from .normalization import normalize_text, remove_repeated_lines
+from .extraction_pool import ExtractionError, extract_isolated
+
+logger = logging.getLogger(__name__)
+
+# نسخة منطق الاستخراج - ارفعها عند تعديل المستخرجات لإبطال النصوص المخزنة
+EXTRACTOR_VERSION = 3
+
+# الامتدادات التي يُستخرج نصها (read_document)
+SUPPORTED_EXTENSIONS = ['pdf', 'doc', 'docx', 'pptx', 'xlsx', 'txt', 'md']
 
+# حجم القطعة عند قراءة الملف لحساب البصمة
+HASH_CHUNK_SIZE = 1024 * 1024
 
-def extract_text_from_file(lecture_file):
-    """استخراج النص من ملف المحاضرة"""
+# مدة تذكر فشل الاستخراج لملف (ثانية)
+FAILED_EXTRACTION_TTL = 3600
+
+
+def compute_file_hash(lecture_file):
+    """حساب بصمة SHA-256 لمحتوى الملف (قراءة على دفعات دون تحميله كاملاً)"""
+    digest = hashlib.sha256()
+    
+    with lecture_file.file.open('rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
     
-    if lecture_file.content_type == 'external_link':
-        return None  # لا يمكن استخراج النص من الروابط الخارجية
+    return digest.hexdigest()
+
+
+def get_file_hash(lecture_file):
+    """
+    بصمة محتوى الملف مع تخزين مؤقت
     
-    if not lecture_file.file:
+    المفتاح مرتبط باسم الملف المخزن، فعند استبدال الملف يتغير المفتاح
+    وتُحسب البصمة من جديد.
+    """
+    cache_key = f"ai:file_hash:{lecture_file.pk}:{lecture_file.file.name}"
+    content_hash = cache.get(cache_key)
+    
+    if content_hash is None:
+        content_hash = compute_file_hash(lecture_file)
+        cache.set(cache_key, content_hash, timeout=None)
+    
+    return content_hash
+
+
+def get_file_text(lecture_file):
+    """
+    الحصول على نص الملف من التخزين الدائم أو استخراجه مرة واحدة
+    
+    يُستخدم من عروض AI حتى لا يُعاد تحليل نفس الملف في كل طلب،
+    والاستخراج يتم دائماً في عملية معزولة (extract_isolated).
+    
+    Returns:
+        str | None: النص المستخرج
+    """
+    if lecture_file.content_type == 'external_link' or not lecture_file.file:
         return None
     
-    file_path = lecture_file.file.path
-    extension = lecture_file.get_file_extension()
+    try:
+        content_hash = get_file_hash(lecture_file)
+    except (OSError, ValueError) as e:
+        # ملف تعذرت قراءته لا يُحلل داخل عملية الويب
+        logger.error(f"File hashing error for file {lecture_file.pk}: {e}")
+        return None
+    
+    stored = get_stored_text(content_hash)
+    if stored is not None:
+        return stored
+    
+    # ملف فشل استخراجه مؤخراً لا يُعاد تحليله في كل طلب
+    failure_key = f"ai:extraction_failed:{content_hash}:{EXTRACTOR_VERSION}"
+    if cache.get(failure_key):
+        return None
     
     try:
-        if extension == 'pdf':
-            return extract_from_pdf(file_path)
-        elif extension in ['doc', 'docx']:
-            return extract_from_docx(file_path)
-        elif extension == 'txt':
-            return extract_from_txt(file_path)
-        elif extension == 'md':
-            return extract_from_txt(file_path)
-        else:
-            return None
-    except Exception as e:
-        print(f"Error extracting text: {e}")
+        text, _ = extract_and_store(lecture_file, content_hash)
+    except ExtractionError as e:
+        logger.error(f"Text extraction failed for file {lecture_file.pk}: {e.as_dict()}")
+        cache.set(failure_key, e.as_dict(), timeout=FAILED_EXTRACTION_TTL)
         return None
+    
+    return text
+
+
+def extract_and_store(lecture_file, content_hash):
+    """
+    استخراج نص الملف في عملية معزولة وحفظه مع فهرس الاسترجاع
+    
+    Returns:
+        tuple: (النص أو None، بدايات الصفحات)
+    
+    Raises:
+        ExtractionError
+    """
+    text, page_offsets, extraction_time = extract_isolated(
+        lecture_file.file.path, lecture_file.get_file_extension()
+    )
+    note_extraction_time(extraction_time)
+    
+    if text:
+        store_extracted_text(content_hash, text, extraction_time, page_offsets)
+    
+    return text, page_offsets
+
+
+def get_stored_text(content_hash):
+    """النص المخزن لبصمة محتوى بنسخة المستخرج الحالية (أو None)"""
+    from .models import ExtractedText
+    
+    stored = ExtractedText.objects.filter(
+        content_hash=content_hash,
+        extractor_version=EXTRACTOR_VERSION
+    ).only('text').first()
+    return stored.text if stored else None
 
 
-def extract_from_pdf(file_path):
-    """استخراج النص من PDF"""
+def store_extracted_text(content_hash, text, extraction_time=0, page_offsets=None):
+    """
+    حفظ النص المستخرج في التخزين الدائم وبناء فهرس الاسترجاع له مرة واحدة
+    
+    Returns:
+        ExtractedText
+    """
+    from .models import ExtractedText
+    
+    stored, _ = ExtractedText.objects.get_or_create(
+        content_hash=content_hash,
+        extractor_version=EXTRACTOR_VERSION,
+        defaults={
+            'text': text,
+            'char_count': len(text),
+            'page_offsets': page_offsets or [],
+            'extraction_time': extraction_time,
+        }
+    )
+    
     try:
-        from PyPDF2 import PdfReader
-        
-        reader = PdfReader(file_path)
-        text = ""
-        
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        
-        return text.strip()
+        build_index(content_hash, text)
     except Exception as e:
-        print(f"PDF extraction error: {e}")
+        logger.error(f"Retrieval index build error for {content_hash[:12]}: {e}")
+    
+    return stored
+
+
+def read_document(file_path, extension):
+    """
+    استخراج النص الموحد مع بداية كل صفحة (ترفع أخطاء المكتبات كما هي)
+    
+    Returns:
+        tuple: (النص أو None لامتداد غير مدعوم، بدايات الصفحات - فارغة للملفات بدون صفحات)
+    """
+    if extension == 'pdf':
+        return extract_pdf_pages(file_path)
+    elif extension == 'pptx':
+        return join_pages(iter_pptx_slides(file_path))
+    elif extension == 'xlsx':
+        return join_pages(iter_xlsx_sheets(file_path))
+    elif extension in ['doc', 'docx']:
+        return normalize_text(extract_from_docx(file_path)), []
+    elif extension == 'txt':
+        return normalize_text(extract_from_txt(file_path)), []
+    elif extension == 'md':
+        return normalize_text(extract_from_txt(file_path)), []
+    else:
+        return None, []
+
+
+def page_for_offset(page_offsets, offset):
+    """
+    رقم الصفحة (يبدأ من 1) التي يقع فيها موضع في النص المستخرج
+    
+    Returns:
+        int | None: None إذا لم تُسجل صفحات للملف
+    """
+    if not page_offsets:
         return None
+    return max(bisect.bisect_right(page_offsets, offset), 1)
 
 
-def extract_from_docx(file_path):
-    """استخراج النص من DOCX"""
-    try:
-        from docx import Document
-        
-        doc = Document(file_path)
-        text = ""
+def iter_pdf_pages(file_path):
+    """نص صفحات PDF واحدة تلو الأخرى (الصفحة لا تُحلل قبل طلبها)"""
+    from PyPDF2 import PdfReader
+    
+    reader = PdfReader(file_path)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+def extract_pdf_pages(file_path):
+    """
+    استخراج نص PDF مع بداية كل صفحة
+    
+    Returns:
+        tuple: (النص، بدايات الصفحات)
+    """
+    return join_pages(iter_pdf_pages(file_path))
+
+
+def join_pages(pages_iter):
+    """
+    توحيد نصوص الصفحات ودمجها مع بداية كل صفحة
+    
+    الصفحات تُجمع في قائمة وتُدمج مرة واحدة بفاصل سطر بدلاً من
+    إضافة كل صفحة إلى النص (نسخ متكرر للنص كله مع كل صفحة).
+    الترويسة والتذييل المتكرران تُحذف قبل حساب بدايات الصفحات.
+    
+    Returns:
+        tuple: (النص، بدايات الصفحات)
+    """
+    pages = remove_repeated_lines([normalize_text(page_text) for page_text in pages_iter])
+    
+    page_offsets = []
+    length = 0
+    for page_text in pages:
+        page_offsets.append(length)
+        length += len(page_text) + 1
+    
+    text = "\n".join(pages)
+    return (text if text.strip() else ""), page_offsets
+
+
+def _iter_shape_text(shapes):
+    """نصوص أشكال الشريحة بترتيبها (مربعات النص والجداول والمجموعات)"""
+    for shape in shapes:
+        if shape.has_text_frame:
+            text = shape.text_frame.text.strip()
+            if text:
+                yield text
+        elif getattr(shape, 'has_table', False) and shape.has_table:
+            for row in shape.table.rows:
+                cells = [cell.text.strip() for cell in row.cells if cell.text.strip()]
+                if cells:
+                    yield " | ".join(cells)
+        elif hasattr(shape, 'shapes'):
+            yield from _iter_shape_text(shape.shapes)
+
+
+def iter_pptx_slides(file_path):
+    """
+    نص شرائح PPTX بترتيبها (نص الشريحة ثم ملاحظات المحاضر)
+    
+    كل شريحة تُحلل عند طلبها، فلا يُبنى نص العرض كاملاً في الذاكرة.
+    """
+    from pptx import Presentation
+    
+    presentation = Presentation(file_path)
+    for slide in presentation.slides:
+        lines = list(_iter_shape_text(slide.shapes))
         
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
+        if slide.has_notes_slide:
+            notes = slide.notes_slide.notes_text_frame
+            if notes is not None and notes.text.strip():
+                lines.append(f"ملاحظات: {notes.text.strip()}")
         
-        return text.strip()
-    except Exception as e:
-        print(f"DOCX extraction error: {e}")
-        return None
+        yield "\n".join(lines)
+
+
+def iter_xlsx_sheets(file_path):
+    """
+    نص أوراق XLSX ورقة بورقة (صف في كل سطر)
+    
+    يُفتح الملف بوضع القراءة فقط (read_only) فتُقرأ الصفوف
+    بالتتابع دون تحميل الورقة كاملة في الذاكرة.
+    """
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            lines = [f"# {sheet.title}"]
+            for row in sheet.iter_rows(values_only=True):
+                cells = [str(value).strip() for value in row if value is not None and str(value).strip()]
+                if cells:
+                    lines.append(" | ".join(cells))
+            yield "\n".join(lines) if len(lines) > 1 else ""
+    finally:
+        workbook.close()
+
+
+def extract_from_docx(file_path):
+    """استخراج النص من DOCX"""
+    from docx import Document
+    
+    doc = Document(file_path)
+    return "\n".join(paragraph.text for paragraph in doc.paragraphs).strip()
 
 
 def extract_from_txt(file_path):
-    """استخراج النص من TXT"""
+    """استخراج النص من TXT (UTF-8 ثم Windows-1256)"""
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             return f.read().strip()
     except UnicodeDecodeError:
-        try:
-            with open(file_path, 'r', encoding='cp1256') as f:
-                return f.read().strip()
-        except:
-            return None
-    except Exception as e:
-        print(f"TXT extraction error: {e}")
-        return None
+        with open(file_path, 'r', encoding='cp1256') as f:
+            return f.read().strip()
@@ -3,17 +3,23 @@
 S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
 """
 
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
 
 app_name = 'ai_service'
 
+# عروض التوليد والمحادثة والحالة: النسخ غير المتزامنة عند التشغيل عبر ASGI
+generation_views = async_views if getattr(settings, 'AI_ASYNC_VIEWS', False) else views
+
 urlpatterns = [
     # ==================== التلخيص ====================
     # صفحة توليد الملخص (GET)
     path('summary/<int:file_id>/', views.ai_summary_view, name='generate_summary'),
     # توليد الملخص عبر HTMX (POST)
-    path('summary/<int:file_id>/generate/', views.ai_summary_generate_view, name='summary_generate'),
+    path('summary/<int:file_id>/generate/', generation_views.ai_summary_generate_view, name='summary_generate'),
+    # توليد حزمة المذاكرة عبر HTMX (POST)
+    path('summary/<int:file_id>/study-pack/', views.ai_study_pack_generate_view, name='study_pack_generate'),
     # عرض ملخص محفوظ
     path('summary/view/<int:summary_id>/', views.view_summary_view, name='view_summary'),
     # تصدير الملخص
@@ -27,7 +33,7 @@ urlpatterns = [
     # صفحة توليد الأسئلة (GET)
     path('questions/<int:file_id>/', views.ai_questions_view, name='generate_questions'),
     # توليد الأسئلة عبر HTMX (POST)
-    path('questions/<int:file_id>/generate/', views.ai_questions_generate_view, name='questions_generate'),
+    path('questions/<int:file_id>/generate/', generation_views.ai_questions_generate_view, name='questions_generate'),
     # عرض أسئلة محفوظة
     path('questions/view/<int:questions_id>/', views.view_questions_view, name='view_questions'),
     # حذف أسئلة
@@ -39,9 +45,19 @@ urlpatterns = [
     # صفحة المحادثة
     path('chat/', views.ai_chat_view, name='chat'),
     # إرسال رسالة عبر HTMX (POST)
-    path('chat/send/', views.ai_chat_send_view, name='chat_send'),
+    path('chat/send/', generation_views.ai_chat_send_view, name='chat_send'),
+    # إرسال رسالة مع بث الإجابة (SSE)
+    path('chat/stream/', generation_views.ai_chat_stream_view, name='chat_stream'),
+    
+    # ==================== مهام الخلفية ====================
+    # حالة مهمة AI عبر HTMX (استطلاع دوري)
+    path('jobs/<int:job_id>/', generation_views.ai_job_status_view, name='job_status'),
+    
+    # ==================== تقرير الاستهلاك ====================
+    # تقرير استهلاك AI (للمسؤول)
+    path('usage/', views.usage_report_view, name='usage_report'),
     
     # ==================== API ====================
     # التحقق من حالة API
-    path('api/status/', views.api_status_view, name='api_status'),
+    path('api/status/', generation_views.api_status_view, name='api_status'),
 ]
@@ -9,9 +9,27 @@ S-ACM - نظام إدارة المحتوى الأكاديمي الذكي
 import os
 import json
 import logging
-from typing import Optional, List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Iterator, AsyncIterator
 
 from django.conf import settings
+from django.db import close_old_connections
+
+from asgiref.sync import sync_to_async
+
+from .backends import get_backend
+from .concurrency import call_slot, acall_slot, ai_caller, current_caller, get_limits
+from .context_cache import ATTACHED_TEXT_NOTE, invalidate as invalidate_cached_context
+from .structured import (
+    QUESTIONS_SCHEMA, STUDY_PACK_SUMMARY_TYPES, build_study_pack_schema, iter_json_array_items, validate_question
+)
+from .resilience import (
+    get_status_code, call_with_retries, stream_with_retries, hedged_call, hedged_stream, get_hedge_delay,
+    acall_with_retries, astream_with_retries, ahedged_call, ahedged_stream
+)
+from .health import get_api_status
+from .prompt_budget import PromptBudget, estimate_tokens
+from .metering import meter_call, ameter_call, bind_meter, current_scope, use_scope
 
 # إعداد التسجيل
 logger = logging.getLogger(__name__)
@@ -19,6 +37,9 @@ logger = logging.getLogger(__name__)
 # متغير للتخزين المؤقت للـ client
 _gemini_client = None
 
+# النموذج الافتراضي
+DEFAULT_MODEL = "gemini-1.5-flash"
+
 
 # ==================== إعداد Gemini API ====================
 
@@ -56,74 +77,297 @@ def get_gemini_client():
     return _gemini_client
 
 
-def generate_content(prompt: str, model_name: str = "gemini-1.5-flash") -> str:
+# إعدادات التوليد المشتركة
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+}
+
+
+def _resolve_prompt(prompt, model_name, cached_context, full_prompt):
+    """
+    الطلب المناسب للنموذج: المختصر مع مرجع ذاكرة السياق إن كان لنفس النموذج،
+    وإلا الطلب الكامل (مثلاً عند الانتقال لنموذج بديل)
+    
+    Returns:
+        tuple: (نص الطلب، اسم مرجع ذاكرة السياق أو None)
+    """
+    if cached_context is not None and cached_context.model == model_name:
+        return prompt, cached_context.name
+    return full_prompt or prompt, None
+
+
+def _is_stale_cache_error(error, cached_name):
+    """المرجع انتهت صلاحيته أو حُذف لدى المزود"""
+    return cached_name is not None and get_status_code(error) in (400, 403, 404)
+
+
+def _generate_once(prompt: str, model_name: str, cached_context=None, full_prompt=None, response_schema=None) -> str:
+    """طلب واحد للنموذج (بدون إعادة محاولة) ضمن حد التزامن، ويُسجل في AIUsage"""
+    prompt, cached_name = _resolve_prompt(prompt, model_name, cached_context, full_prompt)
+    
+    with meter_call(model_name, prompt) as meter, call_slot():
+        meter.slot_acquired()
+        try:
+            try:
+                with bind_meter(meter):
+                    text = get_backend().generate(
+                        prompt, model_name, cached_content=cached_name, response_schema=response_schema
+                    )
+            except Exception as e:
+                if not _is_stale_cache_error(e, cached_name):
+                    raise
+                # المرجع لم يعد صالحاً: حذفه وإرسال الطلب الكامل
+                logger.warning(f"Context cache {cached_name} rejected, sending full prompt: {str(e)}")
+                invalidate_cached_context(cached_context)
+                meter.prompt = full_prompt or prompt
+                with bind_meter(meter):
+                    text = get_backend().generate(full_prompt or prompt, model_name, response_schema=response_schema)
+            
+            meter.add_response(text or '')
+            return text
+                
+        except Exception as e:
+            logger.error(f"Gemini API error ({model_name}): {str(e)}")
+            raise
+
+
+def _generate_stream_once(
+    prompt: str, model_name: str, cached_context=None, full_prompt=None, response_schema=None
+) -> Iterator[str]:
+    """بث واحد من النموذج (بدون إعادة محاولة) ضمن حد التزامن، ويُسجل في AIUsage"""
+    prompt, cached_name = _resolve_prompt(prompt, model_name, cached_context, full_prompt)
+    
+    with meter_call(model_name, prompt) as meter, call_slot():
+        meter.slot_acquired()
+        try:
+            try:
+                with bind_meter(meter):
+                    stream = get_backend().generate_stream(
+                        prompt, model_name, cached_content=cached_name, response_schema=response_schema
+                    )
+                    first = next(stream, None)
+            except Exception as e:
+                if not _is_stale_cache_error(e, cached_name):
+                    raise
+                logger.warning(f"Context cache {cached_name} rejected, sending full prompt: {str(e)}")
+                invalidate_cached_context(cached_context)
+                meter.prompt = full_prompt or prompt
+                with bind_meter(meter):
+                    stream = get_backend().generate_stream(full_prompt or prompt, model_name, response_schema=response_schema)
+                    first = next(stream, None)
+            
+            if first is not None:
+                meter.add_response(first)
+                yield first
+                for chunk in stream:
+                    meter.add_response(chunk)
+                    yield chunk
+            
+        except Exception as e:
+            logger.error(f"Gemini API stream error ({model_name}): {str(e)}")
+            raise
+
+
+def generate_content(
+    prompt: str,
+    model_name: str = DEFAULT_MODEL,
+    cached_context=None,
+    full_prompt: Optional[str] = None,
+    response_schema: Optional[Dict[str, Any]] = None
+) -> str:
     """
-    توليد محتوى باستخدام Gemini API
+    توليد محتوى عبر واجهة النموذج المحددة في AI_BACKEND (Gemini افتراضياً)
+    
+    الأخطاء المؤقتة يُعاد طلبها وتُجرب النماذج البديلة (راجع resilience.py).
     
     Args:
         prompt: النص المطلوب
         model_name: اسم النموذج
+        cached_context: مرجع ذاكرة السياق (CachedContext) - prompt عندها لا يتضمن نص الملف
+        full_prompt: الطلب الكامل بنص الملف، يُستخدم إذا لم يصلح المرجع للنموذج أو انتهت صلاحيته
+        response_schema: مخطط JSON للرد (مخرجات منظمة، اختياري)
     
     Returns:
         str: النص المولد
+    
+    Raises:
+        AIServiceUnavailable: إذا كان قاطع الدائرة مفتوحاً أو بقيت الخدمة مشغولة بعد إعادة المحاولة
+        AIServiceBusy: إذا لم يتوفر مكان ضمن حد الطلبات المتزامنة قبل انتهاء المهلة
     """
-    try:
-        client = get_gemini_client()
+    return call_with_retries(
+        lambda model: _generate_once(prompt, model, cached_context, full_prompt, response_schema),
+        model_name
+    )
+
+
+def generate_content_stream(
+    prompt: str,
+    model_name: str = DEFAULT_MODEL,
+    cached_context=None,
+    full_prompt: Optional[str] = None,
+    response_schema: Optional[Dict[str, Any]] = None
+) -> Iterator[str]:
+    """
+    توليد محتوى بشكل متدفق (جزءاً بجزء) عبر واجهة النموذج المحددة
+    
+    يُعاد الطلب عند الأخطاء المؤقتة قبل وصول أول جزء فقط.
+    
+    Args:
+        prompt: النص المطلوب
+        model_name: اسم النموذج
+        cached_context: مرجع ذاكرة السياق (CachedContext)
+        full_prompt: الطلب الكامل بنص الملف (راجع generate_content)
+        response_schema: مخطط JSON للرد (مخرجات منظمة، اختياري)
+    
+    Yields:
+        str: أجزاء النص المولد بترتيب وصولها
+    
+    Raises:
+        AIServiceUnavailable: إذا كان قاطع الدائرة مفتوحاً أو بقيت الخدمة مشغولة بعد إعادة المحاولة
+        AIServiceBusy: إذا لم يتوفر مكان ضمن حد الطلبات المتزامنة قبل انتهاء المهلة
+    """
+    return stream_with_retries(
+        lambda model: _generate_stream_once(prompt, model, cached_context, full_prompt, response_schema),
+        model_name
+    )
+
+
+# ==================== التوليد غير المتزامن (ASGI) ====================
+
+async def _agenerate_once(
+    prompt: str, model_name: str, cached_context=None, full_prompt=None, response_schema=None
+) -> str:
+    """نسخة _generate_once غير المتزامنة (عميل Gemini غير المتزامن، الانتظار لا يحجز خيطاً)"""
+    prompt, cached_name = _resolve_prompt(prompt, model_name, cached_context, full_prompt)
+    
+    async with ameter_call(model_name, prompt) as meter, acall_slot():
+        meter.slot_acquired()
+        try:
+            try:
+                with bind_meter(meter):
+                    text = await get_backend().agenerate(
+                        prompt, model_name, cached_content=cached_name, response_schema=response_schema
+                    )
+            except Exception as e:
+                if not _is_stale_cache_error(e, cached_name):
+                    raise
+                logger.warning(f"Context cache {cached_name} rejected, sending full prompt: {str(e)}")
+                await sync_to_async(invalidate_cached_context)(cached_context)
+                meter.prompt = full_prompt or prompt
+                with bind_meter(meter):
+                    text = await get_backend().agenerate(full_prompt or prompt, model_name, response_schema=response_schema)
+            
+            meter.add_response(text or '')
+            return text
         
-        # التحقق من نوع العميل
-        if hasattr(client, 'models'):
-            # المكتبة الجديدة google-genai
-            from google.genai import types
-            response = client.models.generate_content(
-                model=model_name,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.7,
-                    top_p=0.95,
-                    top_k=40,
-                    max_output_tokens=8192,
-                )
-            )
-            return response.text
-        else:
-            # المكتبة القديمة google-generativeai
-            model = client.GenerativeModel(
-                model_name=model_name,
-                generation_config={
-                    "temperature": 0.7,
-                    "top_p": 0.95,
-                    "top_k": 40,
-                    "max_output_tokens": 8192,
-                }
-            )
-            response = model.generate_content(prompt)
-            return response.text
+        except Exception as e:
+            logger.error(f"Gemini API error ({model_name}): {str(e)}")
+            raise
+
+
+async def _agenerate_stream_once(
+    prompt: str, model_name: str, cached_context=None, full_prompt=None, response_schema=None
+) -> AsyncIterator[str]:
+    """نسخة _generate_stream_once غير المتزامنة"""
+    prompt, cached_name = _resolve_prompt(prompt, model_name, cached_context, full_prompt)
+    
+    async with ameter_call(model_name, prompt) as meter, acall_slot():
+        meter.slot_acquired()
+        try:
+            try:
+                with bind_meter(meter):
+                    stream = get_backend().agenerate_stream(
+                        prompt, model_name, cached_content=cached_name, response_schema=response_schema
+                    )
+                    first = await anext(stream, None)
+            except Exception as e:
+                if not _is_stale_cache_error(e, cached_name):
+                    raise
+                logger.warning(f"Context cache {cached_name} rejected, sending full prompt: {str(e)}")
+                await sync_to_async(invalidate_cached_context)(cached_context)
+                meter.prompt = full_prompt or prompt
+                with bind_meter(meter):
+                    stream = get_backend().agenerate_stream(full_prompt or prompt, model_name, response_schema=response_schema)
+                    first = await anext(stream, None)
             
-    except Exception as e:
-        logger.error(f"Gemini API error: {str(e)}")
-        raise
+            if first is not None:
+                meter.add_response(first)
+                yield first
+                async for chunk in stream:
+                    meter.add_response(chunk)
+                    yield chunk
+            
+        except Exception as e:
+            logger.error(f"Gemini API stream error ({model_name}): {str(e)}")
+            raise
+
+
+async def agenerate_content(
+    prompt: str,
+    model_name: str = DEFAULT_MODEL,
+    cached_context=None,
+    full_prompt: Optional[str] = None,
+    response_schema: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    نسخة generate_content للعروض غير المتزامنة (نفس المعاملات وإعادة المحاولة والقياس)
+    
+    Raises:
+        AIServiceUnavailable: إذا كان قاطع الدائرة مفتوحاً أو بقيت الخدمة مشغولة بعد إعادة المحاولة
+        AIServiceBusy: إذا لم يتوفر مكان ضمن حد الطلبات المتزامنة قبل انتهاء المهلة
+    """
+    return await acall_with_retries(
+        lambda model: _agenerate_once(prompt, model, cached_context, full_prompt, response_schema),
+        model_name
+    )
+
+
+def agenerate_content_stream(
+    prompt: str,
+    model_name: str = DEFAULT_MODEL,
+    cached_context=None,
+    full_prompt: Optional[str] = None,
+    response_schema: Optional[Dict[str, Any]] = None
+) -> AsyncIterator[str]:
+    """
+    نسخة generate_content_stream للعروض غير المتزامنة
+    
+    Yields:
+        str: أجزاء النص المولد بترتيب وصولها (async for)
+    """
+    return astream_with_retries(
+        lambda model: _agenerate_stream_once(prompt, model, cached_context, full_prompt, response_schema),
+        model_name
+    )
 
 
 # ==================== دوال التلخيص ====================
 
-def generate_summary(text: str, summary_type: str = 'brief', language: str = 'ar') -> str:
+# نسخة تعليمات التلخيص - ارفعها عند تعديل التعليمات لإبطال الملخصات المشتركة
+SUMMARY_PROMPT_VERSION = 2
+
+# تعليمات لغة المخرجات (العربية هي لغة التعليمات الافتراضية)
+SUMMARY_LANGUAGE_INSTRUCTIONS = {
+    'ar': '',
+    'en': '\nاكتب الملخص كاملاً باللغة الإنجليزية.\n',
+}
+
+
+def build_summary_prompt(text: str, summary_type: str = 'brief', language: str = 'ar') -> str:
     """
-    توليد ملخص للنص باستخدام Gemini API
+    بناء نص طلب التلخيص حسب النوع واللغة
     
     Args:
-        text: النص المراد تلخيصه
+        text: النص المراد تلخيصه (يجب أن يكون ضمن حدود طلب واحد)
         summary_type: نوع الملخص ('brief', 'detailed', 'key_points')
-        language: لغة المخرجات ('ar' للعربية، 'en' للإنجليزية)
+        language: لغة المخرجات
     
     Returns:
-        str: الملخص بصيغة Markdown
-    
-    Raises:
-        Exception: في حالة فشل الاتصال بـ API
+        str: نص الطلب
     """
-    if not text or len(text.strip()) < 50:
-        return "# خطأ\n\nالنص قصير جداً للتلخيص."
-    
     # تحديد التعليمات حسب نوع الملخص
     prompts = {
         'brief': f"""
@@ -139,7 +383,7 @@ def generate_summary(text: str, summary_type: str = 'brief', language: str = 'ar
 5. ابدأ بعنوان "# ملخص موجز"
 
 النص:
-{text[:15000]}
+{text}
 """,
         'detailed': f"""
 أنت مساعد أكاديمي متخصص في تلخيص المحتوى التعليمي.
@@ -155,7 +399,7 @@ def generate_summary(text: str, summary_type: str = 'brief', language: str = 'ar
 6. ابدأ بعنوان "# ملخص تفصيلي"
 
 النص:
-{text[:15000]}
+{text}
 """,
         'key_points': f"""
 أنت مساعد أكاديمي متخصص في استخراج النقاط الرئيسية.
@@ -171,14 +415,214 @@ def generate_summary(text: str, summary_type: str = 'brief', language: str = 'ar
 6. ابدأ بعنوان "# النقاط الرئيسية"
 
 النص:
-{text[:15000]}
+{text}
 """
     }
     
     prompt = prompts.get(summary_type, prompts['brief'])
+    return prompt + SUMMARY_LANGUAGE_INSTRUCTIONS.get(language, '')
+
+
+def split_text_into_chunks(text: str, max_tokens: int) -> List[str]:
+    """
+    تقسيم النص إلى أجزاء لا يتجاوز كل منها max_tokens (تقديرياً)
+    
+    يُقسم على حدود الفقرات والأسطر قدر الإمكان حتى لا تنقطع الأفكار،
+    والسطر الأطول من الحد يُقسم على عدد الأحرف.
+    
+    Args:
+        text: النص الكامل
+        max_tokens: الحد الأقصى للتوكنات في كل جزء
+    
+    Returns:
+        list: أجزاء النص بالترتيب
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    
+    for line in text.splitlines():
+        line_tokens = estimate_tokens(line) + 1
+        
+        # سطر أطول من الحد بمفرده: تقسيمه على عدد الأحرف
+        if line_tokens > max_tokens:
+            if current:
+                chunks.append('\n'.join(current))
+                current, current_tokens = [], 0
+            step = max(int(len(line) * max_tokens / line_tokens), 1)
+            chunks.extend(line[k:k + step] for k in range(0, len(line), step))
+            continue
+        
+        if current_tokens + line_tokens > max_tokens and current:
+            chunks.append('\n'.join(current))
+            current, current_tokens = [], 0
+        
+        current.append(line)
+        current_tokens += line_tokens
+    
+    if current:
+        chunks.append('\n'.join(current))
+    
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def _summarize_chunk(args) -> str:
+    """تلخيص جزء واحد من مستند طويل (مرحلة Map)"""
+    index, total, chunk, language, caller, scope = args
+    
+    prompt = f"""
+أنت مساعد أكاديمي متخصص في تلخيص المحتوى التعليمي.
+
+المهمة: هذا الجزء {index} من {total} من محاضرة طويلة. استخرج منه ملاحظات مركزة.
+
+التعليمات:
+1. اذكر جميع الأفكار والمفاهيم والتعريفات المهمة في هذا الجزء
+2. احتفظ بالأمثلة والأرقام والمعادلات المهمة
+3. لا تضف مقدمة أو خاتمة
+4. اكتب بصيغة Markdown بنقاط مختصرة
+
+الجزء:
+{chunk}
+""" + SUMMARY_LANGUAGE_INSTRUCTIONS.get(language, '')
     
+    # الخيوط لا ترث صاحب الطلب ونطاق القياس من الخيط الأصلي
     try:
-        result = generate_content(prompt)
+        with ai_caller(caller), use_scope(scope):
+            return generate_content(prompt) or ''
+    finally:
+        # الخيط يسجل الطلب في AIUsage: إغلاق اتصال قاعدة البيانات الخاص به
+        close_old_connections()
+
+
+def _map_summaries(chunks: List[str], language: str) -> List[str]:
+    """
+    تلخيص الأجزاء بالتوازي في مجموعة خيوط محدودة مع الحفاظ على الترتيب
+    
+    عدد الخيوط لا يتجاوز حد المستخدم (AI_MAX_CONCURRENT_CALLS_PER_USER) لأن
+    كل الأجزاء تُحتسب على نفس المستخدم. الجزء الذي يفشل يُترك فارغاً
+    ولا تضيع الأجزاء المكتملة، ويُرفع الخطأ فقط إذا فشلت كلها.
+    """
+    _, user_limit, _, _ = get_limits()
+    max_workers = min(getattr(settings, 'AI_SUMMARY_MAX_WORKERS', 8), len(chunks))
+    if user_limit > 0:
+        max_workers = min(max_workers, user_limit)
+    max_workers = max(max_workers, 1)
+    
+    total = len(chunks)
+    caller = current_caller()
+    scope = current_scope()
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_summarize_chunk, (index, total, chunk, language, caller, scope))
+            for index, chunk in enumerate(chunks, start=1)
+        ]
+    
+    partials = []
+    first_error = None
+    for index, future in enumerate(futures, start=1):
+        try:
+            partials.append(future.result())
+        except Exception as e:
+            logger.warning(f"Summary chunk {index}/{total} failed: {str(e)}")
+            first_error = first_error or e
+            partials.append('')
+    
+    if first_error is not None and not any(partial.strip() for partial in partials):
+        raise first_error
+    return partials
+
+
+def _condense_for_budget(text: str, instructions: str, language: str = 'ar') -> str:
+    """
+    مرحلة Map: تلخيص أجزاء النص بالتوازي حتى تتسع ملاحظاتها لطلب واحد
+    
+    Returns:
+        str: ملاحظات الأجزاء مقتطعة ضمن ميزانية التلخيص
+    """
+    budget = PromptBudget.for_feature('summary')
+    chunk_tokens = min(
+        getattr(settings, 'AI_SUMMARY_CHUNK_TOKENS', 6000),
+        budget.available_for(instructions)
+    )
+    
+    combined = text
+    for _ in range(3):  # حد أقصى لمستويات الدمج
+        chunks = split_text_into_chunks(combined, chunk_tokens)
+        partials = _map_summaries(chunks, language)
+        combined = '\n\n'.join(
+            f"## الجزء {index}\n{partial.strip()}"
+            for index, partial in enumerate(partials, start=1)
+            if partial.strip()
+        )
+        if budget.fits(instructions, combined):
+            break
+    
+    combined, _ = budget.allocate(instructions, combined)
+    return combined
+
+
+def generate_long_summary(text: str, summary_type: str = 'brief', language: str = 'ar') -> str:
+    """
+    تلخيص مستند طويل بأسلوب Map-Reduce
+    
+    1. Map: تقسيم النص لأجزاء ضمن حد التوكنات وتلخيصها بالتوازي
+    2. Reduce: دمج ملخصات الأجزاء في ملخص نهائي من النوع المطلوب
+       (إذا بقيت ملخصات الأجزاء أطول من الحد تُكرر مرحلة Map عليها)
+    
+    زمن التنفيذ قريب من زمن طلبين متتاليين مهما طال المستند
+    ما دام عدد الأجزاء ضمن AI_SUMMARY_MAX_WORKERS وحد المستخدم.
+    
+    Returns:
+        str: الملخص بصيغة Markdown
+    """
+    instructions = build_summary_prompt('', summary_type, language)
+    combined = _condense_for_budget(text, instructions, language)
+    return generate_content(build_summary_prompt(combined, summary_type, language))
+
+
+def generate_summary(
+    text: str,
+    summary_type: str = 'brief',
+    language: str = 'ar',
+    cached_context=None
+) -> str:
+    """
+    توليد ملخص للنص باستخدام Gemini API
+    
+    النصوص التي لا تتسع لها ميزانية التلخيص (AI_PROMPT_BUDGETS['summary'])
+    تُلخص بأسلوب Map-Reduce (راجع generate_long_summary) بدلاً من اقتطاعها.
+    
+    Args:
+        text: النص المراد تلخيصه
+        summary_type: نوع الملخص ('brief', 'detailed', 'key_points')
+        language: لغة المخرجات ('ar' للعربية، 'en' للإنجليزية)
+        cached_context: مرجع ذاكرة السياق لنص الملف (اختياري) - يُغني عن إرسال النص
+    
+    Returns:
+        str: الملخص بصيغة Markdown
+    
+    Raises:
+        Exception: في حالة فشل الاتصال بـ API
+    """
+    if not text or len(text.strip()) < 50:
+        return "# خطأ\n\nالنص قصير جداً للتلخيص."
+    
+    budget = PromptBudget.for_feature('summary')
+    
+    try:
+        if cached_context is not None:
+            # النص الكامل في ذاكرة السياق - الطلب الكامل للنماذج البديلة فقط
+            instructions = build_summary_prompt('', summary_type, language)
+            result = generate_content(
+                build_summary_prompt(ATTACHED_TEXT_NOTE, summary_type, language),
+                cached_context=cached_context,
+                full_prompt=build_summary_prompt(budget.allocate(instructions, text)[0], summary_type, language)
+            )
+        elif budget.fits(build_summary_prompt('', summary_type, language), text):
+            result = generate_content(build_summary_prompt(text, summary_type, language))
+        else:
+            result = generate_long_summary(text, summary_type, language)
         
         if result:
             return result
@@ -193,23 +637,38 @@ def generate_summary(text: str, summary_type: str = 'brief', language: str = 'ar
 
 # ==================== دوال توليد الأسئلة ====================
 
+QUESTION_DIFFICULTY_DESCRIPTIONS = {
+    'easy': 'سهلة ومباشرة، تختبر الفهم الأساسي',
+    'medium': 'متوسطة الصعوبة، تختبر الفهم والتطبيق',
+    'hard': 'صعبة، تختبر التحليل والتقييم'
+}
+
+
 def generate_questions(
     text: str, 
     difficulty: str = 'medium', 
     count: int = 5,
-    question_type: str = 'multiple_choice'
+    question_type: str = 'multiple_choice',
+    cached_context=None,
+    avoid_questions: Optional[List[str]] = None
 ) -> List[Dict[str, Any]]:
     """
     توليد أسئلة اختبارية من النص باستخدام Gemini API
     
+    يُطلب الرد بصيغة JSON منظمة (QUESTIONS_SCHEMA) ويُبث، فيُتحقق من كل سؤال
+    فور اكتماله. إذا كان جزء من الرد غير صالح تُطلب الأسئلة الناقصة فقط
+    (حتى AI_QUESTIONS_REPAIR_ROUNDS مرة) بدلاً من إعادة الدفعة كاملة.
+    
     Args:
         text: النص المصدر
         difficulty: مستوى الصعوبة ('easy', 'medium', 'hard')
         count: عدد الأسئلة المطلوبة
         question_type: نوع الأسئلة ('multiple_choice', 'true_false', 'short_answer')
+        cached_context: مرجع ذاكرة السياق لنص الملف (اختياري)
+        avoid_questions: نصوص أسئلة موجودة مسبقاً (بنك الأسئلة) يُطلب عدم تكرارها
     
     Returns:
-        list: قائمة الأسئلة بصيغة JSON
+        list: قائمة الأسئلة الصالحة (قد تكون أقل من count إذا استمر الخلل)
     
     Raises:
         Exception: في حالة فشل الاتصال بـ API
@@ -217,26 +676,27 @@ def generate_questions(
     if not text or len(text.strip()) < 100:
         return []
     
-    difficulty_desc = {
-        'easy': 'سهلة ومباشرة، تختبر الفهم الأساسي',
-        'medium': 'متوسطة الصعوبة، تختبر الفهم والتطبيق',
-        'hard': 'صعبة، تختبر التحليل والتقييم'
-    }
-    
-    prompt = f"""
+    def build_prompt(source_text, needed=count, existing=()):
+        avoid_section = ''
+        if existing:
+            avoid_section = '\nلا تكرر الأسئلة التالية (تم إنشاؤها مسبقاً):\n' + '\n'.join(
+                f'- {question}' for question in existing
+            ) + '\n'
+        
+        return f"""
 أنت مساعد أكاديمي متخصص في إنشاء الاختبارات.
 
-المهمة: قم بإنشاء {count} أسئلة اختيار من متعدد من النص التالي.
+المهمة: قم بإنشاء {needed} أسئلة اختيار من متعدد من النص التالي.
 
-مستوى الصعوبة: {difficulty_desc.get(difficulty, difficulty_desc['medium'])}
+مستوى الصعوبة: {QUESTION_DIFFICULTY_DESCRIPTIONS.get(difficulty, QUESTION_DIFFICULTY_DESCRIPTIONS['medium'])}
 
 التعليمات:
-1. أنشئ {count} أسئلة متنوعة تغطي المحتوى
+1. أنشئ {needed} أسئلة متنوعة تغطي المحتوى
 2. كل سؤال يجب أن يحتوي على 4 خيارات
 3. خيار واحد فقط صحيح
 4. الخيارات الخاطئة يجب أن تكون منطقية ومقنعة
 5. أرجع النتيجة بصيغة JSON فقط (بدون أي نص إضافي)
-
+{avoid_section}
 صيغة JSON المطلوبة:
 [
     {{
@@ -249,91 +709,202 @@ def generate_questions(
 ]
 
 النص:
-{text[:12000]}
+{source_text}
 
 أرجع JSON فقط:
 """
     
+    avoid_questions = list(avoid_questions or [])
+    
+    # اقتطاع النص حسب ميزانية التوكنات المتبقية بعد التعليمات
+    context, _ = PromptBudget.for_feature('questions').allocate(build_prompt('', count, avoid_questions), text)
+    
+    questions = []
+    seen = set(avoid_questions)
+    repair_rounds = getattr(settings, 'AI_QUESTIONS_REPAIR_ROUNDS', 2)
+    
     try:
-        result = generate_content(prompt)
-        
-        if result:
-            # محاولة استخراج JSON من الرد
-            json_text = result.strip()
-            
-            # إزالة علامات الكود إن وجدت
-            if json_text.startswith('```json'):
-                json_text = json_text[7:]
-            if json_text.startswith('```'):
-                json_text = json_text[3:]
-            if json_text.endswith('```'):
-                json_text = json_text[:-3]
+        for round_number in range(repair_rounds + 1):
+            needed = count - len(questions)
+            if needed <= 0:
+                break
             
-            json_text = json_text.strip()
+            existing = avoid_questions + [question['question'] for question in questions]
+            prompt = build_prompt(context, needed, existing)
+            stream = generate_content_stream(
+                build_prompt(ATTACHED_TEXT_NOTE, needed, existing) if cached_context else prompt,
+                cached_context=cached_context,
+                full_prompt=prompt,
+                response_schema=QUESTIONS_SCHEMA
+            )
             
-            questions = json.loads(json_text)
+            invalid = 0
+            try:
+                for item in iter_json_array_items(stream):
+                    question = validate_question(item, difficulty)
+                    if question is None or question['question'] in seen:
+                        invalid += 1
+                        continue
+                    
+                    seen.add(question['question'])
+                    questions.append(question)
+                    if len(questions) >= count:
+                        break
+            except Exception as e:
+                # انقطاع البث بعد وصول بعض الأسئلة: تُطلب البقية في الجولة التالية
+                if not questions:
+                    raise
+                logger.warning(f"Questions stream interrupted after {len(questions)} questions: {str(e)}")
+            finally:
+                stream.close()
             
-            # التحقق من صحة البنية
-            if isinstance(questions, list):
-                return questions[:count]
-            else:
-                logger.error("Invalid questions format from Gemini")
-                return []
-        else:
-            logger.error("Gemini API returned empty response for questions")
-            return []
+            if len(questions) < count:
+                logger.warning(
+                    f"Questions round {round_number + 1}: {len(questions)}/{count} valid "
+                    f"({invalid} invalid items)"
+                )
+        
+        return questions
             
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parsing error: {str(e)}")
-        return []
     except Exception as e:
         logger.error(f"Gemini API error: {str(e)}")
         raise Exception(f"خطأ في توليد الأسئلة: {str(e)}")
 
 
+# ==================== حزمة المذاكرة ====================
+
+def build_study_pack_prompt(
+    text: str,
+    language: str = 'ar',
+    questions_count: int = 0,
+    difficulty: str = 'medium'
+) -> str:
+    """
+    بناء طلب حزمة المذاكرة: الملخص الموجز والتفصيلي والنقاط الرئيسية
+    (وأسئلة اختيارية) في رد JSON واحد
+    """
+    questions_section = ''
+    if questions_count:
+        questions_section = f"""
+- questions: {questions_count} أسئلة اختيار من متعدد، مستوى الصعوبة: {QUESTION_DIFFICULTY_DESCRIPTIONS.get(difficulty, QUESTION_DIFFICULTY_DESCRIPTIONS['medium'])}
+  لكل سؤال 4 خيارات منطقية وخيار واحد صحيح، مع شرح مختصر للإجابة و "difficulty": "{difficulty}"
+"""
+    
+    return f"""
+أنت مساعد أكاديمي متخصص في تلخيص المحتوى التعليمي وإعداد مواد المذاكرة.
+
+المهمة: أنشئ حزمة مذاكرة كاملة للنص التالي بصيغة JSON تحتوي على الحقول:
+
+- brief: ملخص موجز بصيغة Markdown في 3-5 فقرات يركز على الأفكار الرئيسية، يبدأ بعنوان "# ملخص موجز"
+- detailed: ملخص تفصيلي شامل بصيغة Markdown مقسم إلى أقسام بعناوين فرعية، يشرح المفاهيم الصعبة
+  ويذكر الأمثلة إن وجدت، يبدأ بعنوان "# ملخص تفصيلي"
+- key_points: 10-15 نقطة رئيسية مرتبة حسب الأهمية في قائمة نقطية (-) بصيغة Markdown،
+  تبدأ بعنوان "# النقاط الرئيسية"
+{questions_section}
+النص:
+{text}
+""" + SUMMARY_LANGUAGE_INSTRUCTIONS.get(language, '')
+
+
+def generate_study_pack(
+    text: str,
+    language: str = 'ar',
+    questions_count: int = 0,
+    difficulty: str = 'medium',
+    cached_context=None
+) -> Dict[str, Any]:
+    """
+    توليد أنواع الملخص الثلاثة (وأسئلة اختيارية) في طلب واحد بمخرجات منظمة
+    
+    بدلاً من ثلاثة أو أربعة طلبات يُرسل فيها نص الملف كاملاً كل مرة.
+    النصوص الطويلة تُختصر مرة واحدة بمرحلة Map وتُستخدم ملاحظاتها للحزمة كاملة.
+    
+    Args:
+        text: النص المصدر
+        language: لغة الملخصات
+        questions_count: عدد الأسئلة (0 = بدون أسئلة)
+        difficulty: مستوى صعوبة الأسئلة
+        cached_context: مرجع ذاكرة السياق لنص الملف (اختياري)
+    
+    Returns:
+        dict: {'brief', 'detailed', 'key_points': نص Markdown، 'questions': قائمة الأسئلة الصالحة}
+    
+    Raises:
+        Exception: في حالة فشل الاتصال بـ API أو رد غير صالح
+    """
+    budget = PromptBudget.for_feature('summary')
+    instructions = build_study_pack_prompt('', language, questions_count, difficulty)
+    schema = build_study_pack_schema(include_questions=questions_count > 0)
+    
+    try:
+        if cached_context is not None:
+            result = generate_content(
+                build_study_pack_prompt(ATTACHED_TEXT_NOTE, language, questions_count, difficulty),
+                cached_context=cached_context,
+                full_prompt=build_study_pack_prompt(
+                    budget.allocate(instructions, text)[0], language, questions_count, difficulty
+                ),
+                response_schema=schema
+            )
+        else:
+            if not budget.fits(instructions, text):
+                text = _condense_for_budget(text, instructions, language)
+            result = generate_content(
+                build_study_pack_prompt(text, language, questions_count, difficulty),
+                response_schema=schema
+            )
+        
+        pack = json.loads(result)
+        if not isinstance(pack, dict):
+            raise ValueError('الرد ليس كائن JSON')
+    
+    except Exception as e:
+        logger.error(f"Gemini study pack error: {str(e)}")
+        raise Exception(f"خطأ في توليد حزمة المذاكرة: {str(e)}")
+    
+    summaries = {
+        summary_type: pack[summary_type].strip()
+        for summary_type in STUDY_PACK_SUMMARY_TYPES
+        if isinstance(pack.get(summary_type), str) and pack[summary_type].strip()
+    }
+    
+    questions = []
+    for item in pack.get('questions') or []:
+        question = validate_question(item, difficulty)
+        if question is not None and len(questions) < questions_count:
+            questions.append(question)
+    
+    return {**summaries, 'questions': questions}
+
+
 # ==================== دوال المحادثة (Chatbot) ====================
 
-def generate_chat_response(
+def build_chat_prompt(
     question: str, 
     context: Optional[str] = None,
-    chat_history: Optional[List[Dict[str, str]]] = None
+    chat_history: Optional[List[Dict[str, str]]] = None,
+    attached_file: bool = False,
+    conversation_summary: Optional[str] = None
 ) -> str:
     """
-    توليد إجابة للمساعد الذكي باستخدام Gemini API
+    بناء نص الطلب للمساعد الذكي (مشترك بين الرد العادي والمتدفق)
     
     Args:
         question: سؤال المستخدم
         context: سياق من الملف (اختياري)
-        chat_history: سجل المحادثة السابقة (اختياري)
+        chat_history: آخر أدوار المحادثة غير الملخصة (اختياري)
+        attached_file: نص الملف كاملاً في ذاكرة السياق (يُستخدم بدل context)
+        conversation_summary: ملخص الأدوار الأقدم في الجلسة (اختياري)
     
     Returns:
-        str: الإجابة
-    
-    Raises:
-        Exception: في حالة فشل الاتصال بـ API
+        str: نص الطلب
     """
-    if not question or len(question.strip()) < 2:
-        return "يرجى إدخال سؤال واضح."
-    
-    # بناء السياق
-    context_section = ""
-    if context:
-        context_section = f"""
-السياق المتاح (من الملف المحدد):
----
-{context[:10000]}
----
-"""
-    
-    # بناء سجل المحادثة
-    history_section = ""
-    if chat_history:
-        history_section = "\nالمحادثة السابقة:\n"
-        for msg in chat_history[-5:]:  # آخر 5 رسائل فقط
-            history_section += f"المستخدم: {msg.get('question', '')}\n"
-            history_section += f"المساعد: {msg.get('answer', '')}\n\n"
+    summary_section = ""
+    if conversation_summary:
+        summary_section = f"\nملخص المحادثة حتى الآن:\n{conversation_summary}\n"
     
-    prompt = f"""
+    def build_prompt(context_section, history_section):
+        return f"""
 أنت مساعد أكاديمي ذكي لنظام S-ACM (نظام إدارة المحتوى الأكاديمي الذكي).
 
 مهمتك:
@@ -343,7 +914,7 @@ def generate_chat_response(
 - إذا لم تعرف الإجابة، قل ذلك بصراحة
 
 {context_section}
-
+{summary_section}
 {history_section}
 
 سؤال المستخدم الحالي: {question}
@@ -351,8 +922,82 @@ def generate_chat_response(
 أجب بشكل مفيد ومختصر:
 """
     
+    # أدوار المحادثة السابقة (آخر 5 رسائل كحد أقصى)
+    turns = [
+        f"المستخدم: {msg.get('question', '')}\nالمساعد: {msg.get('answer', '')}\n\n"
+        for msg in (chat_history or [])[-5:]
+    ]
+    
+    # توزيع ميزانية التوكنات: السجل الأحدث أولاً ثم السياق
+    context, turns = PromptBudget.for_feature('chat').allocate(build_prompt('', ''), context or '', turns)
+    
+    # بناء السياق
+    context_section = ""
+    if attached_file:
+        context_section = f"\nالسياق المتاح (من الملف المحدد): {ATTACHED_TEXT_NOTE}\n"
+    elif context:
+        context_section = f"""
+السياق المتاح (من الملف المحدد):
+---
+{context}
+---
+"""
+    
+    # بناء سجل المحادثة
+    history_section = ""
+    if turns:
+        history_section = "\nالمحادثة السابقة:\n" + ''.join(turns)
+    
+    return build_prompt(context_section, history_section)
+
+
+def _build_chat_prompts(question, context, chat_history, cached_context, conversation_summary):
+    """
+    طلب المحادثة الكامل، والمختصر المرافق لمرجع ذاكرة السياق إن وُجد
+    
+    Returns:
+        tuple: (الطلب الكامل، الطلب المختصر أو None)
+    """
+    prompt = build_chat_prompt(question, context, chat_history, conversation_summary=conversation_summary)
+    cached_prompt = None
+    if cached_context is not None:
+        cached_prompt = build_chat_prompt(
+            question, None, chat_history, attached_file=True, conversation_summary=conversation_summary
+        )
+    return prompt, cached_prompt
+
+
+def generate_chat_response(
+    question: str, 
+    context: Optional[str] = None,
+    chat_history: Optional[List[Dict[str, str]]] = None,
+    cached_context=None,
+    conversation_summary: Optional[str] = None
+) -> str:
+    """
+    توليد إجابة للمساعد الذكي باستخدام Gemini API
+    
+    Args:
+        question: سؤال المستخدم
+        context: سياق من الملف (اختياري)
+        chat_history: آخر أدوار المحادثة غير الملخصة (اختياري)
+        cached_context: مرجع ذاكرة السياق لنص الملف (اختياري) - يُرسل بدلاً من المقاطع
+        conversation_summary: ملخص الأدوار الأقدم في جلسة المحادثة (اختياري)
+    
+    Returns:
+        str: الإجابة
+    
+    Raises:
+        Exception: في حالة فشل الاتصال بـ API
+    """
+    if not question or len(question.strip()) < 2:
+        return "يرجى إدخال سؤال واضح."
+    
+    prompt, cached_prompt = _build_chat_prompts(question, context, chat_history, cached_context, conversation_summary)
+    
     try:
-        result = generate_content(prompt)
+        # طلب متحوط: نسخة ثانية إذا تأخر الأول (AI_CHAT_HEDGE_DELAY)
+        result = hedged_call(lambda: generate_content(cached_prompt or prompt, cached_context=cached_context, full_prompt=prompt), get_hedge_delay())
         
         if result:
             return result
@@ -364,49 +1009,106 @@ def generate_chat_response(
         raise Exception(f"خطأ في المحادثة: {str(e)}")
 
 
-# ==================== دوال مساعدة ====================
-
-def check_api_connection() -> Dict[str, Any]:
+def generate_chat_response_stream(
+    question: str, 
+    context: Optional[str] = None,
+    chat_history: Optional[List[Dict[str, str]]] = None,
+    cached_context=None,
+    conversation_summary: Optional[str] = None
+) -> Iterator[str]:
     """
-    التحقق من الاتصال بـ Gemini API
+    توليد إجابة المساعد الذكي بشكل متدفق
     
-    Returns:
-        dict: حالة الاتصال
+    Args:
+        question: سؤال المستخدم
+        context: سياق من الملف (اختياري)
+        chat_history: آخر أدوار المحادثة غير الملخصة (اختياري)
+        cached_context: مرجع ذاكرة السياق لنص الملف (اختياري) - يُرسل بدلاً من المقاطع
+        conversation_summary: ملخص الأدوار الأقدم في جلسة المحادثة (اختياري)
+    
+    Yields:
+        str: أجزاء الإجابة بترتيب وصولها
+    
+    Raises:
+        Exception: في حالة فشل الاتصال بـ API
     """
+    if not question or len(question.strip()) < 2:
+        yield "يرجى إدخال سؤال واضح."
+        return
+    
+    prompt, cached_prompt = _build_chat_prompts(question, context, chat_history, cached_context, conversation_summary)
+    
     try:
-        result = generate_content("قل: مرحباً")
+        yield from hedged_stream(lambda: generate_content_stream(cached_prompt or prompt, cached_context=cached_context, full_prompt=prompt), get_hedge_delay())
+    except Exception as e:
+        logger.error(f"Gemini Chat stream error: {str(e)}")
+        raise Exception(f"خطأ في المحادثة: {str(e)}")
+
+
+async def agenerate_chat_response(
+    question: str, 
+    context: Optional[str] = None,
+    chat_history: Optional[List[Dict[str, str]]] = None,
+    cached_context=None,
+    conversation_summary: Optional[str] = None
+) -> str:
+    """نسخة generate_chat_response للعروض غير المتزامنة (نفس المعاملات والرد)"""
+    if not question or len(question.strip()) < 2:
+        return "يرجى إدخال سؤال واضح."
+    
+    prompt, cached_prompt = _build_chat_prompts(question, context, chat_history, cached_context, conversation_summary)
+    
+    try:
+        result = await ahedged_call(
+            lambda: agenerate_content(cached_prompt or prompt, cached_context=cached_context, full_prompt=prompt),
+            get_hedge_delay()
+        )
         
-        return {
-            'status': 'connected',
-            'model': 'gemini-1.5-flash',
-            'message': 'الاتصال ناجح'
-        }
-    except ValueError as e:
-        return {
-            'status': 'error',
-            'model': None,
-            'message': str(e)
-        }
+        if result:
+            return result
+        else:
+            return "عذراً، لم أتمكن من توليد إجابة. يرجى إعادة صياغة سؤالك."
+    
+    except Exception as e:
+        logger.error(f"Gemini Chat API error: {str(e)}")
+        raise Exception(f"خطأ في المحادثة: {str(e)}")
+
+
+async def agenerate_chat_response_stream(
+    question: str, 
+    context: Optional[str] = None,
+    chat_history: Optional[List[Dict[str, str]]] = None,
+    cached_context=None,
+    conversation_summary: Optional[str] = None
+) -> AsyncIterator[str]:
+    """نسخة generate_chat_response_stream للعروض غير المتزامنة (async for)"""
+    if not question or len(question.strip()) < 2:
+        yield "يرجى إدخال سؤال واضح."
+        return
+    
+    prompt, cached_prompt = _build_chat_prompts(question, context, chat_history, cached_context, conversation_summary)
+    
+    try:
+        async for chunk in ahedged_stream(
+            lambda: agenerate_content_stream(cached_prompt or prompt, cached_context=cached_context, full_prompt=prompt),
+            get_hedge_delay()
+        ):
+            yield chunk
     except Exception as e:
-        return {
-            'status': 'error',
-            'model': None,
-            'message': f'خطأ في الاتصال: {str(e)}'
-        }
+        logger.error(f"Gemini Chat stream error: {str(e)}")
+        raise Exception(f"خطأ في المحادثة: {str(e)}")
 
 
-def estimate_tokens(text: str) -> int:
+# ==================== دوال مساعدة ====================
+
+def check_api_connection() -> Dict[str, Any]:
     """
-    تقدير عدد التوكنات في النص (تقريبي)
+    التحقق من الاتصال بـ Gemini API
     
-    Args:
-        text: النص
+    تُرجع آخر حالة محفوظة فوراً، ويتم الفحص الفعلي في الخلفية
+    (راجع ai_service.health).
     
     Returns:
-        int: العدد التقريبي للتوكنات
+        dict: حالة الاتصال
     """
-    # تقدير تقريبي: 1 توكن ≈ 4 أحرف للإنجليزية، 2 أحرف للعربية
-    arabic_chars = sum(1 for c in text if '\u0600' <= c <= '\u06FF')
-    english_chars = len(text) - arabic_chars
-    
-    return (arabic_chars // 2) + (english_chars // 4)
+    return get_api_status()
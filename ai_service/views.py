@@ -15,20 +15,100 @@ import logging
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST, require_GET
 from django.template.loader import render_to_string
+from django.utils.html import escape
+from django.conf import settings
 
 from core.models import LectureFile
 from accounts.models import UserActivity
-from .models import AISummary, AIQuestion, AIChat, AIRateLimit
-from .text_extractor import extract_text_from_file
-from .utils import generate_summary, generate_questions, generate_chat_response, check_api_connection
+from .models import AISummary, AIQuestion, AIChat, AIRateLimit, AIJob, SharedSummary
+from .jobs import enqueue_job
+from .concurrency import ai_caller, get_queue_stats
+from .health import AIServiceUnavailable
+from .metering import usage_scope
+from .question_bank import draw_questions, schedule_bank_fill
+from .context_cache import get_file_cached_context
+from .conversations import get_conversation, get_prompt_history, record_turn
+from .retrieval import get_relevant_context
+from .utils import generate_chat_response, generate_chat_response_stream, check_api_connection, SUMMARY_LANGUAGE_INSTRUCTIONS
 
 # إعداد التسجيل
 logger = logging.getLogger(__name__)
 
 
+# ==================== مهام الخلفية ====================
+
+SUMMARY_TYPES = dict(AISummary.SUMMARY_TYPE_CHOICES)
+
+
+def _invalid_summary_type():
+    return HttpResponse(
+        '<div class="alert alert-danger">نوع الملخص غير معروف.</div>',
+        status=400
+    )
+
+
+def _render_job(request, job):
+    """
+    إرجاع HTML جزئي لحالة المهمة
+    
+    - مكتملة: قالب النتيجة المعتاد (ملخص أو أسئلة)
+    - فاشلة: رسالة الخطأ
+    - غير ذلك: مؤشر انتظار يستطلع الحالة عبر HTMX
+    """
+    if job.status == AIJob.DONE:
+        # حزمة المذاكرة تُحتسب من حد الملخصات
+        rate_type = AIJob.SUMMARY if job.job_type == AIJob.STUDY_PACK else job.job_type
+        _, remaining = AIRateLimit.check_rate_limit(request.user, rate_type)
+        
+        if job.job_type == AIJob.STUDY_PACK:
+            results = job.params.get('results', {})
+            summaries = AISummary.objects.filter(id__in=results.get('summary_ids', []), user=request.user)
+            return render(request, 'ai_service/partials/study_pack_result.html', {
+                'summaries': sorted(summaries, key=lambda summary: results['summary_ids'].index(summary.id)),
+                'questions_id': results.get('questions_id'),
+                'remaining': remaining,
+            })
+        
+        if job.job_type == AIJob.SUMMARY:
+            summary = get_object_or_404(AISummary, id=job.result_id, user=request.user)
+            return render(request, 'ai_service/partials/summary_result.html', {
+                'summary': summary,
+                'remaining': remaining,
+            })
+        
+        ai_questions = get_object_or_404(AIQuestion, id=job.result_id, user=request.user)
+        return render(request, 'ai_service/partials/questions_result.html', {
+            'ai_questions': ai_questions,
+            'remaining': remaining,
+        })
+    
+    if job.status == AIJob.FAILED:
+        return HttpResponse(
+            f'<div class="alert alert-danger">'
+            f'<i class="bi bi-x-circle me-2"></i>'
+            f'{escape(job.error)}'
+            f'</div>'
+        )
+    
+    return render(request, 'ai_service/partials/job_status.html', {
+        'job': job,
+        'poll_interval': getattr(settings, 'AI_JOB_POLL_INTERVAL', 2),
+    })
+
+
+@login_required
+@require_GET
+def ai_job_status_view(request, job_id):
+    """
+    حالة مهمة AI - يُستدعى دورياً عبر HTMX حتى تكتمل المهمة
+    """
+    job = get_object_or_404(AIJob, id=job_id, user=request.user)
+    return _render_job(request, job)
+
+
 # ==================== عروض التلخيص ====================
 
 @login_required
@@ -69,7 +149,7 @@ def ai_summary_view(request, file_id):
 def ai_summary_generate_view(request, file_id):
     """
     توليد الملخص - يُستدعى عبر HTMX
-    يُرجع HTML جزئي للنتيجة
+    يُنشئ مهمة في الخلفية ويُرجع HTML جزئي يستطلع حالتها
     """
     if not request.user.is_student():
         return HttpResponse(
@@ -79,52 +159,20 @@ def ai_summary_generate_view(request, file_id):
     
     lecture_file = get_object_or_404(LectureFile, id=file_id, is_deleted=False)
     
-    # التحقق من حد الاستخدام
-    can_use, remaining = AIRateLimit.check_rate_limit(request.user, 'summary')
-    if not can_use:
-        return HttpResponse(
-            '<div class="alert alert-warning">'
-            '<i class="bi bi-exclamation-triangle me-2"></i>'
-            'لقد تجاوزت الحد المسموح (10 طلبات/ساعة). يرجى المحاولة لاحقاً.'
-            '</div>',
-            status=429
-        )
-    
     summary_type = request.POST.get('summary_type', 'brief')
-    start_time = time.time()
+    if summary_type not in SUMMARY_TYPES:
+        return _invalid_summary_type()
+    language = request.POST.get('language', 'ar')
+    if language not in SUMMARY_LANGUAGE_INSTRUCTIONS:
+        language = 'ar'
     
-    try:
-        # استخراج النص من الملف
-        text = extract_text_from_file(lecture_file)
-        
-        if not text or len(text.strip()) < 50:
-            return HttpResponse(
-                '<div class="alert alert-danger">'
-                '<i class="bi bi-x-circle me-2"></i>'
-                'لم نتمكن من استخراج نص كافٍ من هذا الملف.'
-                '</div>',
-                status=400
-            )
-        
-        # توليد الملخص عبر Gemini API
-        summary_text = generate_summary(text, summary_type)
-        
-        processing_time = time.time() - start_time
-        
-        # حفظ الملخص في قاعدة البيانات
-        summary = AISummary.objects.create(
-            file=lecture_file,
-            user=request.user,
-            summary_type=summary_type,
-            summary_text=summary_text,  # محفوظ بصيغة Markdown
-            word_count=len(summary_text.split()),
-            processing_time=processing_time
-        )
-        
-        # تسجيل الطلب في Rate Limit
-        AIRateLimit.record_request(request.user, 'summary')
+    # الملخص المشترك: إن ولّده طالب آخر يُعرض فوراً دون احتسابه من الحد
+    start_time = time.time()
+    shared = SharedSummary.for_file(lecture_file, summary_type, language)
+    if shared:
+        shared.record_hit()
+        summary = shared.create_user_summary(request.user, lecture_file, time.time() - start_time)
         
-        # تسجيل النشاط في User_Activity
         UserActivity.log(
             user=request.user,
             action=UserActivity.AI_SUMMARY,
@@ -134,30 +182,81 @@ def ai_summary_generate_view(request, file_id):
                 'file_name': lecture_file.title,
                 'summary_type': summary_type,
                 'summary_id': summary.id,
+                'shared_summary_id': shared.id,
                 'word_count': summary.word_count,
-                'processing_time': round(processing_time, 2)
+                'processing_time': round(summary.processing_time, 3)
             }
         )
         
-        logger.info(f"Summary generated for user {request.user.academic_id}, file {file_id}")
-        
-        # إرجاع HTML جزئي للنتيجة
-        html = render_to_string('ai_service/partials/summary_result.html', {
+        _, remaining = AIRateLimit.check_rate_limit(request.user, 'summary')
+        return render(request, 'ai_service/partials/summary_result.html', {
             'summary': summary,
-            'remaining': remaining - 1,
-        }, request=request)
-        
-        return HttpResponse(html)
-        
-    except Exception as e:
-        logger.error(f"Summary generation error: {str(e)}")
+            'remaining': remaining,
+        })
+    
+    # التحقق من حد الاستخدام
+    can_use, remaining = AIRateLimit.check_rate_limit(request.user, 'summary')
+    if not can_use:
         return HttpResponse(
-            f'<div class="alert alert-danger">'
-            f'<i class="bi bi-x-circle me-2"></i>'
-            f'حدث خطأ: {str(e)}'
-            f'</div>',
-            status=500
+            '<div class="alert alert-warning">'
+            '<i class="bi bi-exclamation-triangle me-2"></i>'
+            'لقد تجاوزت الحد المسموح (10 طلبات/ساعة). يرجى المحاولة لاحقاً.'
+            '</div>',
+            status=429
+        )
+    
+    # إنشاء مهمة في الخلفية وإرجاع رقمها فوراً
+    job = enqueue_job(
+        AIJob.SUMMARY, request.user, lecture_file,
+        summary_type=summary_type, language=language
+    )
+    
+    # تسجيل الطلب في Rate Limit
+    AIRateLimit.record_request(request.user, 'summary')
+    
+    return _render_job(request, job)
+
+
+@login_required
+@require_POST
+def ai_study_pack_generate_view(request, file_id):
+    """
+    توليد حزمة المذاكرة (الملخص الموجز والتفصيلي والنقاط الرئيسية وأسئلة اختيارية)
+    بطلب واحد للنموذج - يُستدعى عبر HTMX ويُحتسب طلباً واحداً من حد الملخصات
+    """
+    if not request.user.is_student():
+        return HttpResponse(
+            '<div class="alert alert-danger">غير مصرح لك بهذه العملية.</div>',
+            status=403
+        )
+    
+    lecture_file = get_object_or_404(LectureFile, id=file_id, is_deleted=False)
+    
+    language = request.POST.get('language', 'ar')
+    if language not in SUMMARY_LANGUAGE_INSTRUCTIONS:
+        language = 'ar'
+    questions_count = 5 if request.POST.get('include_questions') else 0
+    
+    # التحقق من حد الاستخدام
+    can_use, remaining = AIRateLimit.check_rate_limit(request.user, 'summary')
+    if not can_use:
+        return HttpResponse(
+            '<div class="alert alert-warning">'
+            '<i class="bi bi-exclamation-triangle me-2"></i>'
+            'لقد تجاوزت الحد المسموح (10 طلبات/ساعة). يرجى المحاولة لاحقاً.'
+            '</div>',
+            status=429
         )
+    
+    job = enqueue_job(
+        AIJob.STUDY_PACK, request.user, lecture_file,
+        language=language, questions_count=questions_count
+    )
+    
+    # تسجيل الطلب في Rate Limit (مرة واحدة للحزمة كاملة)
+    AIRateLimit.record_request(request.user, 'summary')
+    
+    return _render_job(request, job)
 
 
 @login_required
@@ -211,7 +310,8 @@ def ai_questions_view(request, file_id):
 def ai_questions_generate_view(request, file_id):
     """
     توليد الأسئلة - يُستدعى عبر HTMX
-    يُرجع HTML جزئي للنتيجة
+    يسحب الأسئلة من بنك الملف، وإن لم يكفِ يُنشئ مهمة في الخلفية
+    ويُرجع HTML جزئي يستطلع حالتها
     """
     if not request.user.is_student():
         return HttpResponse(
@@ -233,52 +333,31 @@ def ai_questions_generate_view(request, file_id):
         )
     
     difficulty = request.POST.get('difficulty', 'medium')
+    if difficulty not in dict(AIQuestion.DIFFICULTY_CHOICES):
+        difficulty = 'medium'
     questions_count = int(request.POST.get('questions_count', 5))
     questions_count = min(max(questions_count, 3), 15)  # بين 3 و 15
     
+    # السحب من بنك الأسئلة (قراءة من قاعدة البيانات بدون طلب لـ Gemini)
     start_time = time.time()
+    drawn = draw_questions(request.user, lecture_file, difficulty, questions_count)
     
-    try:
-        # استخراج النص من الملف
-        text = extract_text_from_file(lecture_file)
-        
-        if not text or len(text.strip()) < 100:
-            return HttpResponse(
-                '<div class="alert alert-danger">'
-                '<i class="bi bi-x-circle me-2"></i>'
-                'لم نتمكن من استخراج نص كافٍ من هذا الملف.'
-                '</div>',
-                status=400
-            )
-        
-        # توليد الأسئلة عبر Gemini API
-        questions_json = generate_questions(text, difficulty, questions_count)
-        
-        if not questions_json:
-            return HttpResponse(
-                '<div class="alert alert-warning">'
-                '<i class="bi bi-exclamation-triangle me-2"></i>'
-                'لم نتمكن من توليد أسئلة من هذا المحتوى. جرب ملفاً آخر.'
-                '</div>',
-                status=400
-            )
-        
-        processing_time = time.time() - start_time
-        
-        # حفظ الأسئلة في قاعدة البيانات
+    # تسجيل الطلب في Rate Limit
+    AIRateLimit.record_request(request.user, 'questions')
+    
+    # إعادة ملء البنك في الخلفية عند انخفاضه
+    schedule_bank_fill(request.user, lecture_file, difficulty)
+    
+    if drawn:
         ai_questions = AIQuestion.objects.create(
             file=lecture_file,
             user=request.user,
             difficulty=difficulty,
-            questions_json=questions_json,
-            questions_count=len(questions_json),
-            processing_time=processing_time
+            questions_json=drawn,
+            questions_count=len(drawn),
+            processing_time=time.time() - start_time
         )
         
-        # تسجيل الطلب في Rate Limit
-        AIRateLimit.record_request(request.user, 'questions')
-        
-        # تسجيل النشاط في User_Activity
         UserActivity.log(
             user=request.user,
             action=UserActivity.AI_QUESTIONS,
@@ -288,30 +367,23 @@ def ai_questions_generate_view(request, file_id):
                 'file_name': lecture_file.title,
                 'difficulty': difficulty,
                 'questions_id': ai_questions.id,
-                'questions_count': len(questions_json),
-                'processing_time': round(processing_time, 2)
+                'questions_count': len(drawn),
+                'from_bank': True,
             }
         )
         
-        logger.info(f"Questions generated for user {request.user.academic_id}, file {file_id}")
-        
-        # إرجاع HTML جزئي للنتيجة
-        html = render_to_string('ai_service/partials/questions_result.html', {
+        return render(request, 'ai_service/partials/questions_result.html', {
             'ai_questions': ai_questions,
             'remaining': remaining - 1,
-        }, request=request)
-        
-        return HttpResponse(html)
-        
-    except Exception as e:
-        logger.error(f"Questions generation error: {str(e)}")
-        return HttpResponse(
-            f'<div class="alert alert-danger">'
-            f'<i class="bi bi-x-circle me-2"></i>'
-            f'حدث خطأ: {str(e)}'
-            f'</div>',
-            status=500
-        )
+        })
+    
+    # البنك لا يكفي: إنشاء مهمة توليد في الخلفية وإرجاع رقمها فوراً
+    job = enqueue_job(
+        AIJob.QUESTIONS, request.user, lecture_file,
+        difficulty=difficulty, questions_count=questions_count
+    )
+    
+    return _render_job(request, job)
 
 
 @login_required
@@ -363,6 +435,61 @@ def ai_chat_view(request):
     return render(request, 'ai_service/chat.html', context)
 
 
+def _prepare_chat_context(user, file_id, question, conversation_id=None):
+    """
+    تجهيز سياق المحادثة: الملف المحدد وأقرب مقاطعه للسؤال وجلسة المحادثة
+    
+    Returns:
+        tuple: (lecture_file, context_text, conversation, chat_history, cached_context)
+    """
+    context_text = None
+    lecture_file = None
+    cached_context = None
+    
+    if file_id:
+        lecture_file = LectureFile.objects.filter(id=file_id, is_deleted=False).first()
+        if lecture_file:
+            context_text = get_relevant_context(lecture_file, question)
+            # نص الملف الكامل في ذاكرة سياق Gemini (للملفات الكبيرة فقط)
+            cached_context = get_file_cached_context(lecture_file)
+    
+    # جلسة المحادثة: ملخص الأدوار القديمة + آخر الأدوار
+    conversation = get_conversation(user, lecture_file, conversation_id)
+    summary, chat_history = get_prompt_history(conversation)
+    conversation.summary = summary
+    
+    return lecture_file, context_text, conversation, chat_history, cached_context
+
+
+def _sse_event(data, event=None):
+    """تنسيق حدث Server-Sent Events"""
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+
+CHAT_STREAM_ERROR = 'تعذر توليد الإجابة حالياً. يرجى المحاولة مرة أخرى.'
+
+
+def _sse_error_event(error):
+    """
+    حدث error برسالة ثابتة للمستخدم (تفاصيل الخطأ في السجل فقط)
+
+    رسائل AIServiceUnavailable (الخدمة مشغولة أو متوقفة) مكتوبة للمستخدم،
+    فتُرسل كما هي ولو كانت سبباً لخطأ آخر.
+    """
+    message = CHAT_STREAM_ERROR
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, AIServiceUnavailable):
+            message = str(error)
+            break
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return _sse_event({'error': message}, event='error')
+
+
 @login_required
 @require_POST
 def ai_chat_send_view(request):
@@ -403,21 +530,17 @@ def ai_chat_send_view(request):
         )
     
     try:
-        # الحصول على سياق الملف إن وجد
-        context_text = None
-        lecture_file = None
-        
-        if file_id:
-            lecture_file = LectureFile.objects.filter(id=file_id, is_deleted=False).first()
-            if lecture_file:
-                context_text = extract_text_from_file(lecture_file)
-        
-        # الحصول على سجل المحادثة الأخير
-        recent_chats = AIChat.objects.filter(user=request.user).order_by('-created_at')[:5]
-        chat_history = [{'question': c.question, 'answer': c.answer} for c in recent_chats]
-        
-        # توليد الإجابة عبر Gemini API
-        answer = generate_chat_response(question, context_text, chat_history)
+        with ai_caller(request.user), usage_scope('chat') as scope:
+            # الحصول على سياق الملف وسجل المحادثة
+            lecture_file, context_text, conversation, chat_history, cached_context = _prepare_chat_context(
+                request.user, file_id, question, request.POST.get('conversation_id')
+            )
+            scope.file_id = getattr(lecture_file, 'pk', None)
+            
+            # توليد الإجابة عبر Gemini API
+            answer = generate_chat_response(
+                question, context_text, chat_history, cached_context, conversation.summary
+            )
         
         # حفظ المحادثة
         chat = AIChat.objects.create(
@@ -427,6 +550,9 @@ def ai_chat_send_view(request):
             answer=answer
         )
         
+        # إضافة الدور للجلسة (وتحديث ملخصها في الخلفية)
+        record_turn(conversation, question, answer)
+        
         # تسجيل الطلب في Rate Limit
         AIRateLimit.record_request(request.user, 'chat')
         
@@ -464,6 +590,98 @@ def ai_chat_send_view(request):
         )
 
 
+@login_required
+@require_POST
+def ai_chat_stream_view(request):
+    """
+    إرسال رسالة للمساعد الذكي مع بث الإجابة جزءاً بجزء (Server-Sent Events)
+    
+    الأحداث المرسلة:
+    - (افتراضي) {"delta": "..."} لكل جزء من الإجابة
+    - done: {"chat_id": ..., "conversation_id": ..., "remaining": ...} بعد حفظ المحادثة
+    - error: {"error": "..."} عند فشل التوليد
+    """
+    if not request.user.is_student():
+        return JsonResponse({'error': 'غير مصرح لك بهذه العملية.'}, status=403)
+    
+    # التحقق من حد الاستخدام
+    can_use, remaining = AIRateLimit.check_rate_limit(request.user, 'chat')
+    if not can_use:
+        return JsonResponse(
+            {'error': 'لقد تجاوزت الحد المسموح (10 طلبات/ساعة). يرجى المحاولة لاحقاً.'},
+            status=429
+        )
+    
+    question = request.POST.get('question', '').strip()
+    file_id = request.POST.get('file_id')
+    conversation_id = request.POST.get('conversation_id')
+    
+    if not question:
+        return JsonResponse({'error': 'يرجى إدخال سؤال.'}, status=400)
+    
+    user = request.user
+    
+    def event_stream():
+        answer_parts = []
+        
+        try:
+            with ai_caller(user), usage_scope('chat') as scope:
+                lecture_file, context_text, conversation, chat_history, cached_context = _prepare_chat_context(
+                    user, file_id, question, conversation_id
+                )
+                scope.file_id = getattr(lecture_file, 'pk', None)
+                
+                for chunk in generate_chat_response_stream(
+                    question, context_text, chat_history, cached_context, conversation.summary
+                ):
+                    answer_parts.append(chunk)
+                    yield _sse_event({'delta': chunk})
+            
+            answer = ''.join(answer_parts) or 'عذراً، لم أتمكن من توليد إجابة. يرجى إعادة صياغة سؤالك.'
+            
+            # حفظ المحادثة بعد اكتمال البث
+            chat = AIChat.objects.create(
+                user=user,
+                file=lecture_file,
+                question=question,
+                answer=answer
+            )
+            
+            # إضافة الدور للجلسة (وتحديث ملخصها في الخلفية)
+            record_turn(conversation, question, answer)
+            
+            # تسجيل الطلب في Rate Limit
+            AIRateLimit.record_request(user, 'chat')
+            
+            # تسجيل النشاط بعد نجاح البث فقط (IP والمتصفح من ترويسات الطلب)
+            UserActivity.log(
+                user=user,
+                action=UserActivity.AI_CHAT,
+                request=request,
+                details={
+                    'file_id': file_id,
+                    'question_length': len(question),
+                    'streamed': True,
+                    'chat_id': chat.id,
+                    'answer_length': len(answer),
+                }
+            )
+            
+            yield _sse_event(
+                {'chat_id': chat.id, 'conversation_id': conversation.pk, 'remaining': remaining - 1},
+                event='done'
+            )
+            
+        except Exception as e:
+            logger.exception(f"Chat stream error: {str(e)}")
+            yield _sse_error_event(e)
+    
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # منع التخزين المؤقت في Nginx
+    return response
+
+
 # ==================== عروض إضافية ====================
 
 @login_required
@@ -518,21 +736,31 @@ def export_summary_view(request, summary_id, format):
     return redirect('ai_service:view_summary', summary_id=summary_id)
 
 
-@login_required
-@require_GET
-def api_status_view(request):
-    """
-    التحقق من حالة API - يُستدعى عبر HTMX
-    """
-    status = check_api_connection()
-    
-    if status['status'] == 'connected':
+def _api_status_badge(path, status, queue):
+    """شارة حالة API (مشتركة مع العرض غير المتزامن)"""
+    if status['status'] == 'connected' and queue['waiting']:
+        # كل الأماكن مشغولة وهناك طلبات في الانتظار
+        html = f'''
+        <span class="badge bg-warning text-dark" title="{queue['in_flight']}/{queue['capacity']} طلبات جارية">
+            <i class="bi bi-hourglass-split me-1"></i>
+            مشغول ({queue['waiting']} في الانتظار)
+        </span>
+        '''
+    elif status['status'] == 'connected':
         html = '''
         <span class="badge bg-success">
             <i class="bi bi-check-circle me-1"></i>
             متصل
         </span>
         '''
+    elif status['status'] == 'checking':
+        # الفحص الأول يجري في الخلفية - إعادة الاستعلام بعد ثوانٍ
+        html = f'''
+        <span class="badge bg-secondary" hx-get="{path}" hx-trigger="load delay:3s" hx-swap="outerHTML">
+            <i class="bi bi-hourglass-split me-1"></i>
+            جاري التحقق
+        </span>
+        '''
     else:
         html = f'''
         <span class="badge bg-danger" title="{status['message']}">
@@ -541,7 +769,17 @@ def api_status_view(request):
         </span>
         '''
     
-    return HttpResponse(html)
+    return html
+
+
+@login_required
+@require_GET
+def api_status_view(request):
+    """
+    التحقق من حالة API - يُستدعى عبر HTMX
+    يُرجع الحالة المحفوظة فوراً (الفحص الفعلي يتم في الخلفية)
+    """
+    return HttpResponse(_api_status_badge(request.path, check_api_connection(), get_queue_stats()))
 
 
 @login_required
@@ -560,3 +798,88 @@ def delete_questions_view(request, questions_id):
     questions.delete()
     messages.success(request, 'تم حذف الأسئلة.')
     return redirect('ai_service:my_questions')
+
+
+# ==================== تقرير الاستهلاك ====================
+
+@login_required
+def usage_report_view(request):
+    """
+    تقرير استهلاك AI للمسؤول
+    
+    الأيام السابقة من AIUsageDaily (ai_usage_rollup)، واليوم الحالي
+    وأبطأ الملفات مباشرة من AIUsage.
+    """
+    if not request.user.is_admin():
+        messages.error(request, 'ليس لديك صلاحية الوصول لهذه الصفحة.')
+        return redirect('core:dashboard_redirect')
+    
+    from datetime import timedelta
+    from django.db.models import Sum, Avg, Count
+    from django.utils import timezone
+    from .models import AIUsage, AIUsageDaily
+    from .metering import aggregate_usage, estimate_cost
+    
+    today = timezone.localdate()
+    period_start = today - timedelta(days=30)
+    
+    # اليوم الحالي (لم يُجمع بعد)
+    today_rows = list(aggregate_usage(AIUsage.objects.filter(created_at__date=today)))
+    for row in today_rows:
+        row['estimated_cost'] = estimate_cost(
+            row['model_name'], row['prompt_tokens'] or 0, row['cached_tokens'] or 0, row['response_tokens'] or 0
+        )
+        row['avg_latency'] = (row['total_latency'] or 0) / row['calls']
+    
+    history = AIUsageDaily.objects.filter(date__gte=period_start, date__lt=today)
+    
+    daily = history.values('date').annotate(
+        calls=Sum('calls'),
+        errors=Sum('errors'),
+        prompt_tokens=Sum('prompt_tokens'),
+        response_tokens=Sum('response_tokens'),
+        total_latency=Sum('total_latency'),
+        estimated_cost=Sum('estimated_cost'),
+    ).order_by('-date')
+    
+    by_feature = history.values('feature', 'model_name').annotate(
+        calls=Sum('calls'),
+        errors=Sum('errors'),
+        retries=Sum('retries'),
+        prompt_tokens=Sum('prompt_tokens'),
+        cached_tokens=Sum('cached_tokens'),
+        response_tokens=Sum('response_tokens'),
+        total_queue_time=Sum('total_queue_time'),
+        total_latency=Sum('total_latency'),
+        estimated_cost=Sum('estimated_cost'),
+    ).order_by('-estimated_cost')
+    
+    totals = history.aggregate(
+        calls=Sum('calls'),
+        errors=Sum('errors'),
+        tokens=Sum('prompt_tokens') + Sum('response_tokens'),
+        total_latency=Sum('total_latency'),
+        estimated_cost=Sum('estimated_cost'),
+    )
+    
+    # الملفات الأبطأ (زمن النموذج + الاستخراج) في آخر 7 أيام
+    slowest_files = AIUsage.objects.filter(
+        created_at__date__gte=today - timedelta(days=7),
+        file__isnull=False,
+    ).values('file_id', 'file__title').annotate(
+        calls=Count('id'),
+        avg_latency=Avg('latency'),
+        avg_queue_time=Avg('queue_time'),
+        extraction_time=Sum('extraction_time'),
+    ).order_by('-avg_latency')[:10]
+    
+    context = {
+        'today_rows': today_rows,
+        'daily': daily,
+        'by_feature': by_feature,
+        'totals': totals,
+        'avg_latency': (totals['total_latency'] or 0) / totals['calls'] if totals['calls'] else 0,
+        'slowest_files': slowest_files,
+        'period_start': period_start,
+    }
+    return render(request, 'admin_panel/ai_usage.html', context)
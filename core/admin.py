@@ -79,10 +79,13 @@ class LectureFileAdmin(admin.ModelAdmin):
         'title', 'course', 'file_type_badge', 'uploaded_by',
         'file_size_display', 'download_count', 'is_deleted_badge', 'upload_date'
     ]
-    list_filter = ['file_type', 'is_deleted', 'course', 'upload_date']
+    list_filter = ['file_type', 'is_deleted', 'processing_status', 'course', 'upload_date']
     search_fields = ['title', 'description', 'course__name', 'uploaded_by__full_name']
     ordering = ['-upload_date']
-    readonly_fields = ['download_count', 'upload_date', 'file_size', 'content_type']
+    readonly_fields = [
+        'download_count', 'upload_date', 'file_size', 'content_type',
+        'processing_status', 'processing_error', 'processed_at', 'content_hash', 'page_count'
+    ]
     
     def file_type_badge(self, obj):
         colors = {
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lecturefile',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='بصمة المحتوى'),
+        ),
+        migrations.AddField(
+            model_name='lecturefile',
+            name='page_count',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='عدد الصفحات'),
+        ),
+        migrations.AddField(
+            model_name='lecturefile',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='تاريخ المعالجة'),
+        ),
+        migrations.AddField(
+            model_name='lecturefile',
+            name='processing_error',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='خطأ المعالجة'),
+        ),
+        migrations.AddField(
+            model_name='lecturefile',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'في الانتظار'), ('processing', 'قيد المعالجة'), ('ready', 'جاهز'), ('failed', 'فشلت المعالجة'), ('skipped', 'لا يحتاج معالجة')], default='pending', max_length=20, verbose_name='حالة المعالجة'),
+        ),
+    ]
@@ -106,6 +106,21 @@ class LectureFile(models.Model):
         ('external_link', 'رابط خارجي'),
     ]
     
+    # حالة تجهيز النص بعد الرفع (ai_service.pipeline)
+    PROCESSING_PENDING = 'pending'
+    PROCESSING_RUNNING = 'processing'
+    PROCESSING_READY = 'ready'
+    PROCESSING_FAILED = 'failed'
+    PROCESSING_SKIPPED = 'skipped'
+    
+    PROCESSING_STATUS_CHOICES = [
+        (PROCESSING_PENDING, 'في الانتظار'),
+        (PROCESSING_RUNNING, 'قيد المعالجة'),
+        (PROCESSING_READY, 'جاهز'),
+        (PROCESSING_FAILED, 'فشلت المعالجة'),
+        (PROCESSING_SKIPPED, 'لا يحتاج معالجة'),
+    ]
+    
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='files', verbose_name='المقرر')
     uploader = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='uploaded_files', verbose_name='الرافع')
     title = models.CharField(max_length=255, verbose_name='العنوان')
@@ -124,6 +139,14 @@ class LectureFile(models.Model):
     download_count = models.PositiveIntegerField(default=0, verbose_name='عدد التحميلات')
     view_count = models.PositiveIntegerField(default=0, verbose_name='عدد المشاهدات')
     
+    processing_status = models.CharField(
+        max_length=20, choices=PROCESSING_STATUS_CHOICES, default=PROCESSING_PENDING, verbose_name='حالة المعالجة'
+    )
+    processing_error = models.CharField(max_length=255, blank=True, default='', verbose_name='خطأ المعالجة')
+    processed_at = models.DateTimeField(blank=True, null=True, verbose_name='تاريخ المعالجة')
+    content_hash = models.CharField(max_length=64, blank=True, default='', verbose_name='بصمة المحتوى')
+    page_count = models.PositiveIntegerField(blank=True, null=True, verbose_name='عدد الصفحات')
+    
     upload_date = models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الرفع')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='تاريخ التحديث')
     
@@ -488,11 +488,15 @@ def instructor_upload_file_view(request, course_id):
             
             # إرسال إشعار للطلاب (باستخدام bulk_create)
             send_file_notification(course, lecture_file, request.user)
+        except Exception as e:
+            messages.error(request, f'حدث خطأ: {str(e)}')
+        else:
+            # تجهيز نص الملف وفهرسه ثم بنك الأسئلة في الخلفية (خطأ التجهيز لا يُفشل الرفع)
+            from ai_service.pipeline import prepare_uploaded_file
+            prepare_uploaded_file(request.user, lecture_file)
             
             messages.success(request, f'تم رفع الملف "{title}" بنجاح.')
             return redirect('core:instructor_course_files', course_id=course.id)
-        except Exception as e:
-            messages.error(request, f'حدث خطأ: {str(e)}')
     
     context = {
         'course': course,
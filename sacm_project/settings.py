@@ -145,13 +145,101 @@ DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'S-ACM <noreply@sacm.edu>')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
 AI_RATE_LIMIT = int(os.getenv('AI_RATE_LIMIT', 10))  # عدد الطلبات
 AI_RATE_LIMIT_PERIOD = int(os.getenv('AI_RATE_LIMIT_PERIOD', 3600))  # الفترة بالثواني
+# العدادات في Django cache: عند تشغيل عدة عمليات أو خوادم اضبط CACHES على ذاكرة مشتركة (Redis / Memcached)،
+# وإلا تُعد الطلبات من قاعدة البيانات في كل طلب (فحص ai_service.W001)
+
+# واجهة النموذج: gemini أو fake (محلية بدون شبكة لاختبارات الحمل - لا تستخدمها في الإنتاج)
+AI_BACKEND = os.getenv('AI_BACKEND', 'gemini')
+AI_FAKE_BACKEND = {
+    'latency': os.getenv('AI_FAKE_LATENCY', 'lognormal'),  # none / fixed / uniform / lognormal
+    'latency_mean': float(os.getenv('AI_FAKE_LATENCY_MEAN', 1.0)),  # بالثواني
+    'latency_sigma': float(os.getenv('AI_FAKE_LATENCY_SIGMA', 0.5)),
+    'error_rate': float(os.getenv('AI_FAKE_ERROR_RATE', 0.0)),  # نسبة الطلبات الفاشلة (0 - 1)
+}
+
+# مهام AI في الخلفية (python manage.py ai_worker)
+# معطلة افتراضياً (التنفيذ داخل الطلب كما كان)؛ تفعيلها يتطلب تشغيل العامل في النشر، وإلا تبقى المهام معلقة
+AI_JOB_QUEUE_ENABLED = os.getenv('AI_JOB_QUEUE_ENABLED', 'False') == 'True'
+AI_WORKER_CONCURRENCY = int(os.getenv('AI_WORKER_CONCURRENCY', 4))  # عدد المهام المتزامنة لكل عامل
+AI_JOB_POLL_INTERVAL = int(os.getenv('AI_JOB_POLL_INTERVAL', 2))  # فترة استطلاع الواجهة بالثواني
+AI_JOB_STALE_AFTER = int(os.getenv('AI_JOB_STALE_AFTER', 600))  # إعادة المهام العالقة بعد (ثانية)
+
+# عروض AI غير المتزامنة (ai_service/async_views.py) - فعّلها عند التشغيل عبر خادم ASGI
+# مثل: uvicorn sacm_project.asgi:application (مع WSGI يُجمع بث المحادثة قبل إرساله)
+AI_ASYNC_VIEWS = os.getenv('AI_ASYNC_VIEWS', 'False') == 'True'
+
+# مراقبة حالة API وقاطع الدائرة
+AI_HEALTH_CHECK_INTERVAL = int(os.getenv('AI_HEALTH_CHECK_INTERVAL', 300))  # فترة الفحص في الخلفية (ثانية)
+AI_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('AI_CIRCUIT_FAILURE_THRESHOLD', 5))  # أخطاء متتالية قبل فتح الدائرة
+AI_CIRCUIT_RESET_TIMEOUT = int(os.getenv('AI_CIRCUIT_RESET_TIMEOUT', 60))  # مدة إيقاف الطلبات (ثانية)
+
+# حد طلبات Gemini المتزامنة على مستوى النشر (مشترك عبر Django cache - يتطلب ذاكرة مؤقتة مشتركة، فحص ai_service.W001)
+# المنتظرون يُخدمون بالتناوب بين المستخدمين وبترتيب الوصول لكل مستخدم
+AI_MAX_CONCURRENT_CALLS = int(os.getenv('AI_MAX_CONCURRENT_CALLS', 16))  # الحد الكلي (0 = بدون حد)
+AI_MAX_CONCURRENT_CALLS_PER_USER = int(os.getenv('AI_MAX_CONCURRENT_CALLS_PER_USER', 4))  # حد المستخدم الواحد
+AI_CALL_WAIT_TIMEOUT = int(os.getenv('AI_CALL_WAIT_TIMEOUT', 30))  # أقصى انتظار لمكان متاح (ثانية)
+AI_CALL_SLOT_TTL = 300  # تحرير المكان تلقائياً إذا توقفت العملية (ثانية)
+
+# إعادة المحاولة والنماذج البديلة والطلبات المتحوطة
+AI_RETRY_POLICY = {
+    'max_attempts': int(os.getenv('AI_RETRY_MAX_ATTEMPTS', 3)),  # محاولات لكل نموذج
+    'base_delay': 0.5,  # بداية الانتظار التصاعدي (ثانية)
+    'max_delay': 8.0,  # أقصى انتظار بين محاولتين (ثانية)
+    'max_total_wait': 20.0,  # أقصى انتظار إجمالي لطلب واحد (ثانية)
+}
+AI_FALLBACK_MODELS = [m.strip() for m in os.getenv('AI_FALLBACK_MODELS', 'gemini-1.5-flash-8b').split(',') if m.strip()]
+AI_CHAT_HEDGE_DELAY = float(os.getenv('AI_CHAT_HEDGE_DELAY', 0))  # إرسال طلب محادثة ثانٍ بعد (ثانية) - 0 = معطل
+
+# تلخيص المستندات الطويلة (Map-Reduce)
+AI_SUMMARY_CHUNK_TOKENS = int(os.getenv('AI_SUMMARY_CHUNK_TOKENS', 6000))  # حد التوكنات لكل جزء
+AI_SUMMARY_MAX_WORKERS = int(os.getenv('AI_SUMMARY_MAX_WORKERS', 8))  # عدد الأجزاء المُلخصة بالتوازي
+
+# فهرس الاسترجاع للمحادثة (BM25)
+AI_INDEX_DIR = BASE_DIR / 'ai_index'  # مجلد ملفات الفهارس (خارج media حتى لا تُخدم للعامة)
+AI_RETRIEVAL_TOP_K = int(os.getenv('AI_RETRIEVAL_TOP_K', 4))  # عدد المقاطع المرسلة مع كل سؤال
+AI_PRECOMPUTE_DIR = BASE_DIR / 'ai_precompute'  # نقاط استئناف أمر ai_precompute
+
+# عزل استخراج النصوص في عمليات منفصلة
+AI_EXTRACTION_SANDBOX = os.getenv('AI_EXTRACTION_SANDBOX', 'True') == 'True'
+AI_EXTRACTION_WORKERS = int(os.getenv('AI_EXTRACTION_WORKERS', 2))  # عدد عمليات الاستخراج لكل خادم
+AI_EXTRACTION_TIMEOUT = int(os.getenv('AI_EXTRACTION_TIMEOUT', 60))  # أقصى زمن لاستخراج ملف (ثانية)
+AI_EXTRACTION_MAX_MEMORY_MB = int(os.getenv('AI_EXTRACTION_MAX_MEMORY_MB', 1024))  # أقصى ذاكرة مقيمة للعملية
+AI_EXTRACTION_MAX_JOBS_PER_WORKER = int(os.getenv('AI_EXTRACTION_MAX_JOBS_PER_WORKER', 50))  # استبدال العملية بعد
+
+# ذاكرة السياق لدى Gemini: نص الملف يُرفع مرة ويُشار إليه في الطلبات اللاحقة
+AI_CONTEXT_CACHE_ENABLED = os.getenv('AI_CONTEXT_CACHE_ENABLED', 'True') == 'True'
+AI_CONTEXT_CACHE_TTL = int(os.getenv('AI_CONTEXT_CACHE_TTL', 3600))  # مدة صلاحية المرجع (ثانية)
+AI_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv('AI_CONTEXT_CACHE_MIN_TOKENS', 32768))  # الحد الأدنى لدى المزود للنموذج
+
+# ميزانية التوكنات المدخلة لكل ميزة (التعليمات + السياق + سجل المحادثة)
+AI_PROMPT_BUDGETS = {
+    'summary': int(os.getenv('AI_PROMPT_BUDGET_SUMMARY', 8000)),
+    'questions': int(os.getenv('AI_PROMPT_BUDGET_QUESTIONS', 6000)),
+    'chat': int(os.getenv('AI_PROMPT_BUDGET_CHAT', 5000)),
+}
+
+# بنك الأسئلة المولدة مسبقاً
+AI_QUESTION_BANK_SIZE = int(os.getenv('AI_QUESTION_BANK_SIZE', 40))  # عدد الأسئلة المستهدف لكل (ملف، صعوبة)
+AI_QUESTION_BANK_BATCH = int(os.getenv('AI_QUESTION_BANK_BATCH', 10))  # عدد الأسئلة في كل طلب توليد
+AI_QUESTION_BANK_PREFILL = ['medium']  # مستويات الصعوبة التي تُجهز عند رفع الملف
+AI_QUESTIONS_REPAIR_ROUNDS = int(os.getenv('AI_QUESTIONS_REPAIR_ROUNDS', 2))  # طلبات إكمال الأسئلة الناقصة أو غير الصالحة
+
+# جلسات المحادثة: الأدوار الأقدم تُضغط في ملخص متجدد بمهمة في الخلفية
+AI_CHAT_SESSION_TIMEOUT = int(os.getenv('AI_CHAT_SESSION_TIMEOUT', 3 * 3600))  # بدء جلسة جديدة بعد خمول (ثانية)
+AI_CHAT_RECENT_TURNS = int(os.getenv('AI_CHAT_RECENT_TURNS', 1))  # أدوار تُرسل كما هي بعد الملخص
+AI_CHAT_SUMMARY_MAX_TOKENS = int(os.getenv('AI_CHAT_SUMMARY_MAX_TOKENS', 400))  # حد ملخص الجلسة
+
+# قياس الاستهلاك: صف AIUsage لكل طلب Gemini، ويُجمع يومياً بأمر ai_usage_rollup
+AI_USAGE_METERING_ENABLED = os.getenv('AI_USAGE_METERING_ENABLED', 'True') == 'True'
+# أسعار النماذج بالدولار لكل مليون توكن (تُضاف للأسعار الافتراضية في metering.py)
+AI_MODEL_PRICING = {}
 
 # ==========================================
 # File Upload Settings
 # ==========================================
 FILE_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
-ALLOWED_FILE_EXTENSIONS = ['pdf', 'doc', 'docx', 'ppt', 'pptx', 'txt', 'md', 'mp4', 'webm', 'jpg', 'jpeg', 'png']
+ALLOWED_FILE_EXTENSIONS = ['pdf', 'doc', 'docx', 'ppt', 'pptx', 'xlsx', 'txt', 'md', 'mp4', 'webm', 'jpg', 'jpeg', 'png']
 
 # ==========================================
 # Security Settings (للإنتاج)